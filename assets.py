@@ -0,0 +1,422 @@
+# ================================
+# assets.py
+# ================================
+#
+# Build-once static assets for the portal (landing image variants, the
+# minified CSS bundles from styles/, shared scripts, the vendored Tableau
+# embedding library). Outputs are content-hashed, live under static/ (also reachable
+# through Streamlit's /app/static when server.enableStaticServing is on)
+# and are published on the token service with immutable cache headers,
+# so pages only carry URLs.
+
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import token_server
+from async_http import Response
+from config_store import get_config
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+STYLE_DIR = os.path.join(BASE_DIR, "styles")
+
+# Where browsers fetch static/ from. Default: the token service's /assets
+# route. Set to "/app/static" to use Streamlit's static serving instead.
+ASSET_BASE_URL = os.environ.get("PORTAL_ASSET_BASE_URL")
+ASSET_ROUTE = "/assets/"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+LANDING_NAMES = ("landing_page.jpg", "landing_page.jpeg", "landing_page.png", "landing_page.webp")
+LANDING_WIDTHS = (640, 1280, 1920)
+
+_lock = threading.Lock()
+_published: Dict[str, str] = {}
+_responses: Dict[str, Response] = {}
+_landing_rules: Dict[str, str] = {}     # landing image folder -> CSS
+_bundles: Dict[str, str] = {}
+_prebuild_started = False
+
+
+# -----------------------------------
+# Helpers
+# -----------------------------------
+def content_hash(data: bytes, length: int = 12) -> str:
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write via a unique temp file + rename: concurrent writers never collide."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def write_hashed(stem: str, ext: str, data: bytes) -> str:
+    """Write data as static/build/<stem>.<hash>.<ext>; return the file name."""
+    name = f"{stem}.{content_hash(data)}.{ext}"
+    path = os.path.join(BUILD_DIR, name)
+    if not os.path.isfile(path):
+        # the prebuild thread and the first page run may build the same file
+        write_atomic(path, data)
+    return name
+
+
+def static_response(name: str) -> Response:
+    """static/<name> as an immutable, in-memory response (loaded once)."""
+    response = _responses.get(name)
+    if response is not None:
+        return response
+
+    path = os.path.normpath(os.path.join(STATIC_DIR, name))
+    if not path.startswith(STATIC_DIR + os.sep):
+        raise FileNotFoundError(name)
+    with open(path, "rb") as f:
+        body = f.read()
+    ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if ctype.startswith("text/") or ctype.endswith("javascript"):
+        ctype += "; charset=utf-8"
+    response = Response(body, 200, ctype, {
+        "Cache-Control": IMMUTABLE,
+        "ETag": f'"{content_hash(body)}"',
+    })
+    _responses[name] = response
+    return response
+
+
+async def serve_static(request) -> Response:
+    try:
+        return static_response(request.path[len(ASSET_ROUTE):])
+    except OSError:
+        return Response(b"not found", 404)
+
+
+def serve_on(http) -> None:
+    """Serve static/ under ASSET_ROUTE on an async_http server (once)."""
+    if not any(prefix == ASSET_ROUTE for _, prefix, _ in http.prefix_routes):
+        http.route_prefix(ASSET_ROUTE)(serve_static)
+
+
+def publish(name: str) -> str:
+    """Serve static/<name> with immutable caching; return its URL."""
+    url = _published.get(name)
+    if url is not None:
+        return url
+
+    static_response(name)  # fail early (and warm the cache) if it is missing
+    if ASSET_BASE_URL:
+        url = f"{ASSET_BASE_URL.rstrip('/')}/{name}"
+    else:
+        # in-process token service, or the launcher's shared token daemon
+        # (which serves static/ itself)
+        service = token_server.ensure_started()
+        if service is not None:
+            serve_on(service.http)
+        url = f"{token_server.public_url()}{ASSET_ROUTE}{name}"
+
+    _published[name] = url
+    return url
+
+
+# -----------------------------------
+# Landing background
+# -----------------------------------
+def find_landing_image(folder: str = BASE_DIR) -> Optional[str]:
+    """landing_page.* in `folder` only (each login page keeps its own location)."""
+    for fname in LANDING_NAMES:
+        path = os.path.join(folder, fname)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _encoders():
+    from PIL import features
+
+    encoders = []
+    if features.check("avif"):
+        encoders.append(("avif", "image/avif", {"quality": 55, "speed": 8}))
+    if features.check("webp"):
+        encoders.append(("webp", "image/webp", {"quality": 80, "method": 4}))
+    encoders.append(("jpg", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}))
+    return encoders
+
+
+def build_landing_images(src: str, widths=LANDING_WIDTHS) -> List[Dict]:
+    """
+    Resize the landing image to `widths` and encode AVIF/WebP/JPEG variants.
+    Results are recorded in a manifest named after the source hash, so a
+    restart with an unchanged image does no image work at all.
+    """
+    from PIL import Image
+
+    with open(src, "rb") as f:
+        src_hash = content_hash(f.read())
+
+    manifest_path = os.path.join(BUILD_DIR, f"landing.{src_hash}.json")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("source") == src_hash and all(
+                os.path.isfile(os.path.join(BUILD_DIR, v["file"])) for v in manifest["variants"]):
+            return manifest["variants"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    variants = []
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        for width in sorted({min(w, im.width) for w in widths}):
+            height = round(im.height * width / im.width)
+            resized = im if width == im.width else im.resize((width, height), Image.LANCZOS)
+            for ext, mime, options in _encoders():
+                buf = BytesIO()
+                resized.save(buf, format="JPEG" if ext == "jpg" else ext.upper(), **options)
+                name = write_hashed(f"landing_page.{width}", ext, buf.getvalue())
+                variants.append({"width": width, "format": ext, "mime": mime, "file": name})
+
+    write_atomic(manifest_path, json.dumps({"source": src_hash, "variants": variants},
+                                           indent=2).encode("utf-8"))
+    return variants
+
+
+def _background_rule(selector: str, variants: List[Dict]) -> str:
+    jpg = next(v for v in variants if v["format"] == "jpg")
+    image_set = ", ".join(f'url("{publish("build/" + v["file"])}") type("{v["mime"]}")'
+                          for v in variants)
+    return (
+        f'{selector} {{'
+        f'background-image: url("{publish("build/" + jpg["file"])}");'
+        f'background-image: image-set({image_set});'
+        f'}}'
+    )
+
+
+def landing_background_rules(folder: str = BASE_DIR,
+                             selector: str = '[data-testid="stAppViewContainer"]') -> str:
+    """
+    CSS pointing the login background at the pre-built, responsive
+    variants of the landing image in `folder`. Built once per process;
+    empty if no image exists.
+    """
+    rules = _landing_rules.get(folder)
+    if rules is not None:
+        return rules
+
+    with _lock:
+        if folder in _landing_rules:
+            return _landing_rules[folder]
+
+        src = find_landing_image(folder)
+        if src is None:
+            _landing_rules[folder] = ""
+            return ""
+
+        variants = build_landing_images(src)
+        widths = sorted({v["width"] for v in variants})
+        rules = [f"{selector} {{background-size: cover; background-position: center;}}"]
+        for i, width in enumerate(widths):
+            rule = _background_rule(selector, [v for v in variants if v["width"] == width])
+            if i == 0:
+                rules.append(rule)
+            else:
+                rules.append(f"@media (min-width: {widths[i - 1] + 1}px) {{{rule}}}")
+
+        _landing_rules[folder] = "".join(rules)
+        log.info("landing image: %d variants from %s", len(variants), os.path.relpath(src, BASE_DIR))
+        return _landing_rules[folder]
+
+
+def landing_background_css(folder: str = BASE_DIR) -> str:
+    rules = landing_background_rules(folder)
+    return f"<style>{rules}</style>" if rules else ""
+
+
+# -----------------------------------
+# CSS bundles
+# -----------------------------------
+# bundle name -> (source files in styles/, folder whose landing image to
+# append as background rules, or None). streamlit_app's login screen has
+# always used the repo root, login.py only assets/.
+BUNDLES = {
+    "login": (("login.css",), BASE_DIR),
+    "login_page": (("login_page.css",), os.path.join(BASE_DIR, "assets")),
+    "dashboard": (("dashboard.css",), None),
+    "viz": (("viz.css",), None),
+}
+
+_COMMENTS = re.compile(r"/\*.*?\*/", re.S)
+_SPACES = re.compile(r"\s+")
+_PUNCT = re.compile(r"\s*([{};:,>])\s*")
+
+
+def minify_css(css: str) -> str:
+    css = _COMMENTS.sub("", css)
+    css = _SPACES.sub(" ", css)
+    css = _PUNCT.sub(r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def bundle_url(name: str) -> str:
+    """Build (once per process) and publish the hashed, minified bundle."""
+    url = _bundles.get(name)
+    if url is not None:
+        return url
+
+    sources, background = BUNDLES[name]
+    parts = []
+    for fname in sources:
+        with open(os.path.join(STYLE_DIR, fname), "r", encoding="utf-8") as f:
+            parts.append(f.read())
+    if background:
+        parts.append(landing_background_rules(background))
+
+    css = minify_css("\n".join(parts))
+    url = publish("build/" + write_hashed(name, "css", css.encode("utf-8")))
+    _bundles[name] = url
+    return url
+
+
+def css_import(name: str) -> str:
+    """One-line <style>@import</style> for st.markdown (the only CSS a rerun sends)."""
+    return f'<style>@import url("{bundle_url(name)}");</style>'
+
+
+def css_link(name: str) -> str:
+    """<link> tag for component iframes."""
+    return f'<link rel="stylesheet" href="{bundle_url(name)}">'
+
+
+# -----------------------------------
+# Scripts
+# -----------------------------------
+# name -> source file, for pages outside the tableau_viz frame (which
+# loads its own copy relatively)
+SCRIPTS = {
+    "rum": os.path.join(BASE_DIR, "tableau_viz", "frontend", "rum.js"),
+}
+_scripts: Dict[str, str] = {}
+
+
+def script_url(name: str) -> str:
+    """Publish (once per process) the hashed copy of a shared script."""
+    url = _scripts.get(name)
+    if url is None:
+        with open(SCRIPTS[name], "rb") as f:
+            url = _scripts[name] = publish("build/" + write_hashed(name, "js", f.read()))
+    return url
+
+
+# -----------------------------------
+# Tableau embedding library
+# -----------------------------------
+# static/vendor/ holds a pinned copy written by vendor_tableau.py; the lock
+# file records its version and SRI hash. Without it we fall back to the
+# host's "latest" build (not long-term cacheable).
+DEFAULT_TABLEAU_HOST = "https://prod-in-a.online.tableau.com"
+TABLEAU_LOCK = os.path.join(VENDOR_DIR, "tableau_embedding.json")
+
+_tableau_lib: Optional[Dict] = None
+
+
+def sri_hash(data: bytes) -> str:
+    return "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode()
+
+
+def tableau_host() -> str:
+    return get_config().secrets.get("host") or DEFAULT_TABLEAU_HOST
+
+
+def tableau_embedding() -> Dict[str, Optional[str]]:
+    """{"url", "integrity", "version"} of the embedding library to load."""
+    global _tableau_lib
+    if _tableau_lib is not None:
+        return _tableau_lib
+
+    lib = None
+    try:
+        with open(TABLEAU_LOCK, "r", encoding="utf-8") as f:
+            lock = json.load(f)
+        with open(os.path.join(VENDOR_DIR, lock["file"]), "rb") as f:
+            data = f.read()
+        if sri_hash(data) != lock["integrity"]:
+            log.error("vendored %s does not match its lock file; not using it", lock["file"])
+        else:
+            lib = {"url": publish("vendor/" + lock["file"]),
+                   "integrity": lock["integrity"],
+                   "version": lock.get("version")}
+    except (OSError, ValueError, KeyError):
+        log.warning("no vendored Tableau embedding library; run vendor_tableau.py")
+
+    if lib is None:
+        lib = {"url": f"{tableau_host()}/javascripts/api/tableau.embedding.3.latest.min.js",
+               "integrity": None,
+               "version": "latest"}
+    _tableau_lib = lib
+    return lib
+
+
+def _integrity_attrs(lib: Dict) -> str:
+    if not lib["integrity"]:
+        return ""
+    return f' integrity="{lib["integrity"]}" crossorigin="anonymous"'
+
+
+def tableau_script_tag() -> str:
+    lib = tableau_embedding()
+    return f'<script type="module" src="{lib["url"]}"{_integrity_attrs(lib)}></script>'
+
+
+def tableau_preload_tags() -> str:
+    """
+    Warm-up hints for the login page: open DNS+TLS to the Tableau host (and
+    the asset host) and pull the embedding library into the HTTP cache while
+    credentials are being typed.
+    """
+    lib = tableau_embedding()
+    host = tableau_host()
+    tags = [f'<link rel="dns-prefetch" href="{host}">',
+            f'<link rel="preconnect" href="{host}">',
+            f'<link rel="preconnect" href="{host}" crossorigin>']
+    origin = "/".join(lib["url"].split("/")[:3])
+    if lib["url"].startswith("http") and origin != host:
+        tags.append(f'<link rel="preconnect" href="{origin}" crossorigin>')
+    tags.append(f'<link rel="modulepreload" href="{lib["url"]}"{_integrity_attrs(lib)}>')
+    return "".join(tags)
+
+
+def prebuild() -> None:
+    """Build landing variants and CSS bundles in the background (once per process)."""
+    global _prebuild_started
+    if _prebuild_started:
+        return
+    _prebuild_started = True
+
+    def build():
+        for name in BUNDLES:
+            bundle_url(name)
+        tableau_embedding()
+
+    threading.Thread(target=build, name="asset-prebuild", daemon=True).start()
@@ -0,0 +1,292 @@
+# ================================
+# async_http.py
+# ================================
+#
+# Minimal asyncio HTTP/1.1 server for the portal's sidecar endpoints
+# (keep-alive, CORS, exact-path and prefix routing, TCP or Unix socket,
+# chunked streaming responses).
+# Stdlib only; it is not meant to be a general-purpose web server.
+
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from typing import (AsyncIterator, Awaitable, Callable, Collection, Dict, Iterable, List,
+                    Optional, Tuple, Union)
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+log = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+KEEPALIVE_TIMEOUT = 15.0
+
+NO_STORE = {"Cache-Control": "no-store"}
+
+
+# -----------------------------------
+# Request / Response
+# -----------------------------------
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body", "version")
+
+    def __init__(self, method: str, path: str, query: Dict[str, str],
+                 headers: Dict[str, str], body: bytes, version: str):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.version = version
+
+    def arg(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.query.get(name, default)
+
+    def json(self):
+        return json.loads(self.body or b"null")
+
+
+class Response:
+    __slots__ = ("status", "body", "headers")
+
+    def __init__(self, body: bytes = b"", status: int = 200,
+                 content_type: str = "text/plain; charset=utf-8",
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.headers = {"Content-Type": content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+class StreamResponse(Response):
+    """
+    Body produced chunk by chunk by an async iterator and sent with chunked
+    transfer encoding. Each chunk is written only once the client has taken
+    the previous one, so nothing is buffered ahead of a slow reader.
+    """
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks: AsyncIterator[bytes], status: int = 200,
+                 content_type: str = "application/octet-stream",
+                 headers: Optional[Dict[str, str]] = None):
+        super().__init__(b"", status, content_type, headers)
+        self.chunks = chunks
+
+
+def json_response(obj, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return Response(body, status, "application/json", headers)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+# -----------------------------------
+# Server
+# -----------------------------------
+class HTTPServer:
+    """
+    Exact-path (then prefix) router + keep-alive connection loop.
+
+    `cors_origin` is sent as Access-Control-Allow-Origin as is ("*"), or,
+    given a collection of origins, echoed back to those origins only.
+    """
+
+    def __init__(self, cors_origin: Union[str, Collection[str], None] = "*",
+                 keepalive_timeout: float = KEEPALIVE_TIMEOUT):
+        self.cors_origin = cors_origin
+        self.keepalive_timeout = keepalive_timeout
+        self.routes: Dict[Tuple[str, str], Handler] = {}
+        self.prefix_routes: List[Tuple[str, str, Handler]] = []
+        self.connections = 0
+        self.requests = 0
+        self._servers = []
+        self._writers = set()
+
+    def route(self, path: str, methods: Iterable[str] = ("GET",)):
+        def register(handler: Handler) -> Handler:
+            for method in methods:
+                self.routes[(method, path)] = handler
+                if method == "GET":
+                    self.routes[("HEAD", path)] = handler
+            return handler
+        return register
+
+    def route_prefix(self, prefix: str, methods: Iterable[str] = ("GET",)):
+        """Handle every path starting with `prefix` (checked after exact routes)."""
+        def register(handler: Handler) -> Handler:
+            for method in methods:
+                self.prefix_routes.append((method, prefix, handler))
+                if method == "GET":
+                    self.prefix_routes.append(("HEAD", prefix, handler))
+            return handler
+        return register
+
+    # ---- lifecycle ----
+    async def start(self, host: str = "127.0.0.1", port: int = 0,
+                    unix_path: Optional[str] = None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self._serve, path=unix_path,
+                                                     limit=MAX_HEADER_BYTES)
+        else:
+            server = await asyncio.start_server(self._serve, host, port,
+                                                limit=MAX_HEADER_BYTES)
+        self._servers.append(server)
+        return server
+
+    async def close(self, grace: float = 2.0) -> None:
+        for server in self._servers:
+            server.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers.clear()
+
+        # let in-flight requests finish, then drop idle keep-alive sockets
+        deadline = asyncio.get_running_loop().time() + grace
+        while self._writers and asyncio.get_running_loop().time() < deadline:
+            for writer in list(self._writers):
+                if writer.transport.is_closing():
+                    self._writers.discard(writer)
+            await asyncio.sleep(0.05)
+        for writer in list(self._writers):
+            writer.close()
+
+    # ---- connection loop ----
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                                  self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, Response(b"", 431), False)
+                    break
+
+                try:
+                    request = self._parse(head)
+                    length = int(request.headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError("negative content-length")
+                except ValueError:
+                    await self._send(writer, Response(b"bad request", 400), False)
+                    break
+
+                if length > MAX_BODY_BYTES or "transfer-encoding" in request.headers:
+                    await self._send(writer, Response(b"", 413), False)
+                    break
+                if length:
+                    try:
+                        request.body = await reader.readexactly(length)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        break
+
+                conn = request.headers.get("connection", "").lower()
+                keep_alive = conn != "close" if request.version == "HTTP/1.1" else conn == "keep-alive"
+
+                self.requests += 1
+                response = await self._dispatch(request)
+                await self._send(writer, response, keep_alive, request.method == "HEAD",
+                                 request.headers.get("origin"))
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _parse(head: bytes) -> Request:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        if not version.startswith("HTTP/1."):
+            raise ValueError(version)
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        parts = urlsplit(target)
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        return Request(method.upper(), unquote(parts.path), query, headers, b"", version)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            handler = next((h for method, prefix, h in self.prefix_routes
+                            if method == request.method and request.path.startswith(prefix)), None)
+        if handler is None:
+            if request.method == "OPTIONS":
+                return Response(b"", 204, headers={
+                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                    "Access-Control-Allow-Headers": "Content-Type",
+                    "Access-Control-Max-Age": "86400",
+                })
+            if any(path == request.path for _, path in self.routes) or any(
+                    request.path.startswith(prefix) for _, prefix, _ in self.prefix_routes):
+                return Response(b"method not allowed", 405)
+            return Response(b"not found", 404)
+
+        try:
+            return await handler(request)
+        except Exception as exc:
+            log.exception("handler for %s failed", request.path)
+            return json_response({"error": str(exc)}, 500, NO_STORE)
+
+    async def _send(self, writer: asyncio.StreamWriter, response: Response,
+                    keep_alive: bool, head_only: bool = False,
+                    origin: Optional[str] = None) -> None:
+        status = HTTPStatus(response.status)
+        streaming = isinstance(response, StreamResponse)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                 "Transfer-Encoding: chunked" if streaming
+                 else f"Content-Length: {len(response.body)}",
+                 "Connection: " + ("keep-alive" if keep_alive else "close")]
+        if isinstance(self.cors_origin, str):
+            if self.cors_origin:
+                lines.append(f"Access-Control-Allow-Origin: {self.cors_origin}")
+        elif self.cors_origin:
+            if origin in self.cors_origin:
+                lines.append(f"Access-Control-Allow-Origin: {origin}")
+            lines.append("Vary: Origin")
+        lines.extend(f"{k}: {v}" for k, v in response.headers.items())
+
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        if not head_only:
+            data += response.body
+        writer.write(data)
+        await writer.drain()
+        if streaming:
+            await self._send_chunks(writer, response.chunks, head_only)
+
+    @staticmethod
+    async def _send_chunks(writer: asyncio.StreamWriter, chunks: AsyncIterator[bytes],
+                           head_only: bool) -> None:
+        try:
+            if not head_only:
+                async for chunk in chunks:
+                    if chunk:
+                        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        await writer.drain()
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception:
+            # the status line is already out: all we can do is cut the
+            # connection so the client sees an incomplete body
+            log.exception("streaming response failed")
+            writer.transport.abort()
+            raise ConnectionError("stream aborted")
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
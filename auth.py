@@ -2,40 +2,33 @@
 # frontend/auth.py  (FINAL VERSION)
 # ================================
 
+import base64
+import hashlib
+import hmac
 import json
+import logging
 import os
+import threading
 import time
-import jwt  # PyJWT
-from typing import Dict, Optional
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
 
-# -----------------------------------
-# Path for secrets.json
-# -----------------------------------
-SECRETS_PATH = os.path.join(os.path.dirname(__file__), "secrets.json")
+import metrics
+from config_store import SECRETS_PATH, get_config
+
+log = logging.getLogger(__name__)
+
+EMBED_SCOPES = ("tableau:views:embed",)
 
 
 # -----------------------------------
 # Load tableau + login credentials
 # -----------------------------------
 def load_secrets() -> Dict:
-    if not os.path.isfile(SECRETS_PATH):
-        raise FileNotFoundError(f"secrets.json not found at {SECRETS_PATH}")
-
-    with open(SECRETS_PATH, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-
-    # Handle nested structure
-    cfg = raw.get("tableau", raw)
-
-    return {
-        "client_id": cfg.get("client_id"),
-        "secret_id": cfg.get("secret_id"),
-        "secret_value": cfg.get("secret_value"),
-        "site_id": cfg.get("site_guid") or cfg.get("site_id"),
-        "host": cfg.get("host") or cfg.get("tableau_host"),
-        "admin_user": cfg.get("admin_user"),
-        "admin_password": cfg.get("admin_password")
-    }
+    """Normalised secrets.json, served from the process-wide config store."""
+    return dict(get_config().secrets)
 
 
 # -----------------------------------
@@ -67,38 +60,240 @@ def authenticate_user(email: str, password: str) -> bool:
 # -----------------------------------
 # Tableau JWT generator
 # -----------------------------------
-def generate_tableau_jwt(user_email: Optional[str] = None, ttl_seconds: int = 300) -> str:
+def new_jti() -> str:
+    """Process-unique (in practice globally unique) JWT id."""
+    return uuid.uuid4().hex
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class JWTSigner:
+    """
+    Pre-built HS256 signing state for one Connected App + scope set.
+
+    The header, the constant claims (iss/aud/scp/site) and the HMAC key
+    schedule are encoded once; sign() only serialises sub/jti/exp.
+    The variable part of the payload is space-padded to a multiple of 3
+    bytes so its base64 can be concatenated with the pre-encoded tail.
+    """
+
+    def __init__(self, client_id: str, secret_id: Optional[str], secret_value: str,
+                 site_id: str, scopes: Tuple[str, ...] = EMBED_SCOPES):
+        if not all([client_id, secret_value, site_id]):
+            raise ValueError("Missing required fields in secrets.json")
+
+        header = {"alg": "HS256", "typ": "JWT"}
+        if secret_id:
+            header["kid"] = secret_id
+        self._header = _b64url(json.dumps(header, separators=(",", ":")).encode()) + b"."
+
+        tail = json.dumps(
+            {"iss": client_id, "aud": "tableau", "scp": list(scopes), "site": {"id": site_id}},
+            separators=(",", ":"),
+        )
+        self._tail = _b64url(tail[1:].encode())  # drop the opening "{"
+        self._mac = hmac.new(secret_value.strip().encode(), digestmod=hashlib.sha256)
+
+    def sign(self, subject: Optional[str], exp: int, jti: str) -> str:
+        head = '{"sub":%s,"jti":"%s","exp":%d,' % (json.dumps(subject), jti, exp)
+        head = head.encode()
+        head += b" " * (-len(head) % 3)
+        signing_input = self._header + _b64url(head) + self._tail
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64url(mac.digest())).decode("ascii")
+
+
+@lru_cache(maxsize=32)
+def _signer(client_id, secret_id, secret_value, site_id, scopes: Tuple[str, ...]) -> JWTSigner:
+    return JWTSigner(client_id, secret_id, secret_value, site_id, scopes)
+
+
+def get_signer(secrets: Dict, scopes: Iterable[str] = EMBED_SCOPES) -> JWTSigner:
+    return _signer(secrets.get("client_id"), secrets.get("secret_id"),
+                   secrets.get("secret_value"), secrets.get("site_id"), tuple(scopes))
+
+
+def sign_tableau_jwt(secrets: Dict, subject: Optional[str], ttl_seconds: int = 300,
+                     scopes: Iterable[str] = EMBED_SCOPES) -> Tuple[str, int]:
+    """
+    Sign a fresh Connected App JWT (HS256), bypassing the cache.
+    Returns (token, exp). site_id MUST be GUID.
+    """
+    signer = get_signer(secrets, scopes)
+    exp = int(time.time()) + ttl_seconds
+    return signer.sign(subject, exp, new_jti()), exp
+
+
+def generate_tableau_jwts(subjects: Iterable[Optional[str]], ttl: int = 300,
+                          scopes: Iterable[str] = EMBED_SCOPES) -> List[str]:
+    """
+    Mint one fresh token per subject (same order), e.g. for pre-provisioned
+    email links or kiosks. Credentials, header, constant claims and HMAC
+    key state are prepared once for the whole batch.
+    """
+    subjects = list(subjects)
+    if not subjects:
+        return []
+
+    secrets = get_config().secrets
+    signer = get_signer(secrets, scopes)
+    exp = int(time.time()) + ttl
+    jtis = os.urandom(16 * len(subjects)).hex()
+    sign = signer.sign
+    admin = secrets.get("admin_user")
+
+    return [sign(sub or admin, exp, jtis[i * 32:(i + 1) * 32])
+            for i, sub in enumerate(subjects)]
+
+
+# -----------------------------------
+# Token cache (refresh-ahead)
+# -----------------------------------
+class TokenCache:
     """
-    Generate a JWT suitable for Tableau Connected App (HS256).
-    site_id MUST be GUID.
+    Hands out still-valid tokens keyed by (subject, scopes, site, TTL).
+
+    A token whose remaining lifetime drops below `refresh_ahead` of its TTL
+    is still served, and a replacement is signed on a background thread.
+    Tokens within `min_remaining` seconds of expiry are never served.
     """
-    secrets = load_secrets()
 
-    CLIENT_ID = secrets["client_id"]
-    SECRET_VALUE = secrets["secret_value"]
-    SECRET_ID = secrets["secret_id"]
-    SITE_GUID = secrets["site_id"]
-    admin = user_email or secrets.get("admin_user")
+    def __init__(self, refresh_ahead: float = 0.25, min_remaining: int = 30,
+                 max_entries: int = 1024):
+        self.refresh_ahead = refresh_ahead
+        self.min_remaining = min_remaining
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, Tuple[str, int]] = {}
+        self._pending = set()
+        self._signing: Dict[Tuple, Future] = {}   # misses being signed (single-flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def _key(secrets: Dict, subject, ttl_seconds: int, scopes: Tuple) -> Tuple:
+        # Issuer/kid/secret are part of the key so a rotated Connected App
+        # secret never serves a token signed with the old one.
+        return (subject, scopes, secrets.get("site_id"), ttl_seconds,
+                secrets.get("client_id"), secrets.get("secret_id"),
+                secrets.get("secret_value"))
+
+    def _margin(self, ttl_seconds: int) -> int:
+        return min(self.min_remaining, ttl_seconds // 10)
 
-    if not all([CLIENT_ID, SECRET_VALUE, SITE_GUID]):
-        raise ValueError("Missing required fields in secrets.json")
+    def get(self, subject, ttl_seconds: int = 300, scopes: Iterable[str] = EMBED_SCOPES,
+            secrets: Optional[Dict] = None) -> str:
+        secrets = secrets if secrets is not None else get_config().secrets
+        scopes = tuple(scopes)
+        key = self._key(secrets, subject, ttl_seconds, scopes)
+        now = time.time()
 
-    now = int(time.time())
-    payload = {
-        "iss": CLIENT_ID,
-        "sub": admin,
-        "aud": "tableau",
-        "jti": str(now),
-        "exp": now + ttl_seconds,
-        "scp": ["tableau:views:embed"],
-        "site": {"id": SITE_GUID}
-    }
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                token, exp = entry
+                remaining = exp - now
+                if remaining > self._margin(ttl_seconds):
+                    self.hits += 1
+                    if remaining < ttl_seconds * self.refresh_ahead and key not in self._pending:
+                        self._schedule_refresh(key, secrets, subject, ttl_seconds, scopes)
+                    return token
 
-    headers = {"kid": SECRET_ID} if SECRET_ID else {}
+            # hits are only counted (metrics reads stats()); signing is timed
+            self.misses += 1
+            flight = self._signing.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._signing[key] = Future()
 
-    token = jwt.encode(payload, SECRET_VALUE, algorithm="HS256", headers=headers)
+        if not leader:
+            return flight.result()
+        # signed outside the lock: a miss never holds up other keys' hits
+        try:
+            with metrics.phase("generate_tableau_jwt", "sign"):
+                token, exp = sign_tableau_jwt(secrets, subject, ttl_seconds, scopes)
+        except BaseException as exc:
+            with self._lock:
+                del self._signing[key]
+            flight.set_exception(exc)
+            raise
+        with self._lock:
+            self._store(key, token, exp)
+            del self._signing[key]
+        flight.set_result(token)
+        return token
 
-    return token.decode("utf-8") if isinstance(token, bytes) else token
+    def _store(self, key: Tuple, token: str, exp: int) -> None:
+        if len(self._entries) >= self.max_entries and key not in self._entries:
+            now = time.time()
+            for k in [k for k, (_, e) in self._entries.items() if e <= now]:
+                del self._entries[k]
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (token, exp)
+
+    def _schedule_refresh(self, key, secrets, subject, ttl_seconds, scopes) -> None:
+        # called with self._lock held
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jwt-refresh")
+        self._pending.add(key)
+        self._executor.submit(self._refresh, key, secrets, subject, ttl_seconds, scopes)
+
+    def _refresh(self, key, secrets, subject, ttl_seconds, scopes) -> None:
+        try:
+            with metrics.phase("generate_tableau_jwt", "refresh"):
+                token, exp = sign_tableau_jwt(secrets, subject, ttl_seconds, scopes)
+        except Exception:
+            log.exception("background JWT refresh failed")
+            with self._lock:
+                self.refresh_errors += 1
+                self._pending.discard(key)
+            return
+
+        with self._lock:
+            self.refreshes += 1
+            self._store(key, token, exp)
+            self._pending.discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "entries": len(self._entries),
+                "signs_saved": self.hits - self.refreshes,
+                "hit_ratio_pct": round(100.0 * self.hits / total, 1) if total else 0.0,
+            }
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def generate_tableau_jwt(user_email: Optional[str] = None, ttl_seconds: int = 300,
+                         scopes: Iterable[str] = EMBED_SCOPES, use_cache: bool = True) -> str:
+    """
+    Return a JWT suitable for Tableau Connected App (HS256).
+    Served from TOKEN_CACHE unless use_cache=False.
+    """
+    secrets = get_config().secrets
+    subject = user_email or secrets.get("admin_user")
+
+    if not use_cache:
+        return sign_tableau_jwt(secrets, subject, ttl_seconds, scopes)[0]
+    return TOKEN_CACHE.get(subject, ttl_seconds, scopes, secrets=secrets)
 
 
 # -----------------------------------
@@ -108,5 +303,12 @@ if __name__ == "__main__":
     try:
         print("Testing JWT...")
         print(generate_tableau_jwt())
+        print(TOKEN_CACHE.stats())
+
+        # Batch minting throughput (target: >= 10x the per-call path)
+        subjects = [f"user{i}@example.com" for i in range(10000)]
+        t0 = time.perf_counter()
+        generate_tableau_jwts(subjects)
+        print(f"Batch: {len(subjects) / (time.perf_counter() - t0):,.0f} tokens/s")
     except Exception as e:
         print("Error:", e)
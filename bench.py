@@ -0,0 +1,271 @@
+# ================================
+# bench.py
+# ================================
+#
+# Micro-benchmarks for the portal's Python hot paths, compared against
+# committed baselines (bench_baseline.json):
+#
+#   python bench.py                    # run all, fail (exit 1) on regression
+#   python bench.py -k jwt             # only benchmarks whose name contains "jwt"
+#   python bench.py --update           # re-record the baseline
+#   python bench.py --threshold 0.3    # allowed p50 / peak memory growth (default 25%)
+#
+# Per benchmark: ops/s, p50/p99 latency and allocations (peak traced
+# memory of one call, and bytes still held per call after many calls).
+# Fast operations are timed in batches, so their percentiles are of batch
+# means. Everything runs offline: JWTs are signed locally, handlers are
+# called in-process and the page is rendered through Streamlit's AppTest.
+#
+# Baselines are only comparable on the same machine/Python; re-record
+# with --update when either changes.
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BASE_DIR, "bench_baseline.json")
+LANDING = os.path.join(BASE_DIR, "landing_page.jpg")
+VIEW_URL = "https://prod-in-a.online.tableau.com/t/site/views/PL/PL_1?:origin=card_share_link&:embed=n"
+
+THRESHOLD = 0.25
+MIN_BATCH_S = 0.002         # fast ops are timed in batches at least this long
+MIN_SAMPLES = 5
+ROUNDS = 5
+
+# name -> factory; the factory does the setup and returns the operation
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name: str):
+    def register(factory):
+        BENCHMARKS[name] = factory
+        return factory
+    return register
+
+
+def _quiet_streamlit() -> None:
+    # bare-mode calls log "missing ScriptRunContext" on every st.* call;
+    # Streamlit resets logger levels when its config loads, so disable it
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+
+
+def _app():
+    _quiet_streamlit()
+    import streamlit_app  # bare mode: st.* calls outside a script run are no-ops
+    return streamlit_app
+
+
+# -----------------------------------
+# Benchmarks
+# -----------------------------------
+@benchmark("auth.load_secrets")
+def _load_secrets():
+    from auth import load_secrets
+    return load_secrets
+
+
+@benchmark("auth.generate_tableau_jwt")
+def _jwt_cached():
+    from auth import generate_tableau_jwt
+    return lambda: generate_tableau_jwt("bench@example.com")
+
+
+@benchmark("auth.generate_tableau_jwt[uncached]")
+def _jwt_signed():
+    from auth import generate_tableau_jwt
+    return lambda: generate_tableau_jwt("bench@example.com", use_cache=False)
+
+
+@benchmark("streamlit_app.generate_tableau_jwt")
+def _app_jwt():
+    app = _app()
+    from config_store import get_config
+    return lambda: app.generate_tableau_jwt(get_config().secrets, "bench@example.com")
+
+
+@benchmark("streamlit_app.build_iframe_url")
+def _iframe_url():
+    app = _app()
+    return lambda: app.build_iframe_url(VIEW_URL, "header.payload.signature")
+
+
+@benchmark("streamlit_app.safe_b64[landing]")
+def _safe_b64():
+    app = _app()
+    return lambda: app.safe_b64(LANDING)
+
+
+@benchmark("streamlit_app.dashboard_page")
+def _dashboard_page():
+    # one full rerun of the logged-in page: every element built + serialized
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(BASE_DIR, "streamlit_app.py"), default_timeout=60)
+    at.session_state["logged_in"] = True
+    at.session_state["username"] = "bench@example.com"
+    at.run()
+    _quiet_streamlit()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at.run
+
+
+@benchmark("token_server./new_jwt")
+def _new_jwt():
+    from async_http import Request
+    from token_server import TokenService, grant
+    service = TokenService()
+    loop = asyncio.new_event_loop()
+    service._loop = loop  # handler only; no socket
+    request = Request("GET", "/new_jwt", {"t": grant("bench")}, {}, b"", "HTTP/1.1")
+    return lambda: loop.run_until_complete(service.new_jwt(request))
+
+
+@benchmark("viewer.view")
+def _viewer():
+    import viewer
+    from token_server import grant
+    client = viewer.app.test_client()
+    query = {"url": VIEW_URL, "t": grant("bench")}
+    return lambda: client.get("/view", query_string=query)
+
+
+# -----------------------------------
+# Runner
+# -----------------------------------
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(op: Callable[[], object], seconds: float) -> Dict:
+    op()  # warm caches / lazy imports
+    batch = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(batch):
+            op()
+        if time.perf_counter() - t0 >= MIN_BATCH_S:
+            break
+        batch *= 2
+
+    # several rounds; p50 is the median of the round medians, so a burst of
+    # machine noise in one round (or one lucky round) does not move it
+    samples, medians = [], []
+    ops = 0
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        deadline = time.perf_counter() + seconds / ROUNDS
+        round_samples = []
+        while time.perf_counter() < deadline or len(round_samples) < MIN_SAMPLES:
+            t0 = time.perf_counter()
+            for _ in range(batch):
+                op()
+            round_samples.append((time.perf_counter() - t0) / batch)
+            ops += batch
+        medians.append(_percentile(sorted(round_samples), 50))
+        samples += round_samples
+    elapsed = time.perf_counter() - started
+    samples.sort()
+
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(3):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            op()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        calls = min(ops, 200)
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            op()
+        retained = (tracemalloc.get_traced_memory()[0] - before) / calls
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_s": round(ops / elapsed, 1),
+        "p50_us": round(_percentile(sorted(medians), 50) * 1e6, 2),
+        "p99_us": round(_percentile(samples, 99) * 1e6, 2),
+        "peak_kib": round(peak / 1024, 1),
+        "retained_b": round(max(retained, 0.0)),
+    }
+
+
+def regressions(result: Dict, base: Optional[Dict], threshold: float) -> List[str]:
+    if not base:
+        return []
+    problems = []
+    # p50 rather than ops/s: a few slow batches (GC, a noisy neighbour)
+    # move the mean far more than the median; sub-microsecond ops also get
+    # a little absolute slack
+    if result["p50_us"] > base["p50_us"] * (1 + threshold) + 0.5:
+        problems.append(f"p50 {base['p50_us']:,} -> {result['p50_us']:,} us")
+    # small absolute slack: a few hundred bytes move with the interpreter
+    if result["peak_kib"] > base["peak_kib"] * (1 + threshold) + 1:
+        problems.append(f"peak {base['peak_kib']} -> {result['peak_kib']} KiB")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Portal micro-benchmarks")
+    parser.add_argument("-k", metavar="TEXT", help="only benchmarks whose name contains TEXT")
+    parser.add_argument("--seconds", type=float, default=1.0, help="timing budget per benchmark")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed regression as a fraction (default 0.25)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="write results as the new baseline")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    base_results = baseline.get("results", {})
+
+    names = [n for n in BENCHMARKS if not args.k or args.k in n]
+    results, failed = {}, []
+    print(f"{'benchmark':<38} {'ops/s':>11} {'p50 us':>10} {'p99 us':>10} "
+          f"{'peak KiB':>9} {'held B':>7} {'p50 vs base':>12}")
+    for name in names:
+        result = results[name] = measure(BENCHMARKS[name](), args.seconds)
+        base = base_results.get(name)
+        change = f"{result['p50_us'] / base['p50_us'] - 1:+.0%}" if base else "new"
+        problems = regressions(result, base, args.threshold)
+        print(f"{name:<38} {result['ops_per_s']:>11,.0f} {result['p50_us']:>10,.1f} "
+              f"{result['p99_us']:>10,.1f} {result['peak_kib']:>9,.1f} "
+              f"{result['retained_b']:>7,} {change:>12}", flush=True)
+        for problem in problems:
+            print(f"    REGRESSION: {problem}")
+        if problems:
+            failed.append(name)
+
+    if args.update:
+        merged = dict(base_results, **results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": {"python": platform.python_version(),
+                                "machine": platform.machine(),
+                                "system": platform.system(),
+                                "recorded": datetime.date.today().isoformat()},
+                       "results": merged}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {os.path.relpath(args.baseline)}")
+        return 0
+    if failed:
+        print(f"{len(failed)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
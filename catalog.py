@@ -0,0 +1,236 @@
+# ================================
+# catalog.py
+# ================================
+#
+# Local, indexed copy of the site's workbooks and views (SQLite), kept up
+# to date through the REST API:
+#
+#   python catalog.py sync            # incremental (updatedAt >= watermark)
+#   python catalog.py sync --full     # full listing; also drops deleted items
+#   python catalog.py sync --every 600
+#   python catalog.py stats
+#
+# Readers never query SQLite per rerun: config_store loads the catalog
+# once per change into dicts (see load_index), so every lookup is O(1).
+# With PORTAL_DASHBOARD_SOURCE=catalog the sidebar lists catalog views
+# instead of dashboards.json.
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.environ.get("PORTAL_CATALOG_PATH", os.path.join(BASE_DIR, "catalog.db"))
+
+# A full listing (which also notices deletions) at least this often.
+FULL_SYNC_EVERY = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    content_url TEXT,
+    project_id TEXT,
+    project_name TEXT,
+    updated_at TEXT,
+    seen REAL
+);
+CREATE TABLE IF NOT EXISTS views (
+    id TEXT PRIMARY KEY,
+    workbook_id TEXT,
+    name TEXT NOT NULL,
+    content_url TEXT,
+    url TEXT,
+    total_views INTEGER,
+    updated_at TEXT,
+    seen REAL
+);
+CREATE INDEX IF NOT EXISTS views_workbook ON views (workbook_id);
+CREATE INDEX IF NOT EXISTS views_url ON views (url);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def connect(path: str = CATALOG_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value) -> None:
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def normalize_url(url: str) -> str:
+    """host/t/<site>/views/<workbook>/<view>: no scheme, query or #/ routing."""
+    url = re.sub(r"^https?://", "", url.split("?", 1)[0])
+    return url.replace("/#/site/", "/t/", 1).replace("/#/", "/", 1).rstrip("/")
+
+
+def view_url(host: str, site: str, content_url: str) -> str:
+    """Embed URL of a view from its REST contentUrl ("Workbook/sheets/View")."""
+    workbook, _, view = content_url.partition("/sheets/")
+    prefix = f"{host}/t/{site}" if site else host
+    return f"{prefix}/views/{workbook}/{view or workbook}"
+
+
+# -----------------------------------
+# Sync
+# -----------------------------------
+def sync(client=None, path: str = CATALOG_PATH, full: bool = False) -> Dict[str, int]:
+    """
+    Pull workbooks + views changed since the last sync (or everything with
+    full=True, or when the last full sync is older than FULL_SYNC_EVERY).
+    """
+    if client is None:
+        from tableau_client import get_client
+        client = get_client()
+
+    conn = connect(path)
+    started = time.time()
+    watermark = _meta(conn, "watermark")
+    last_full = float(_meta(conn, "last_full") or 0)
+    full = full or watermark is None or started - last_full > FULL_SYNC_EVERY
+    flt = None if full else f"updatedAt:gte:{watermark}"
+
+    t0 = time.perf_counter()
+    workbooks = list(client.workbooks(filter=flt))
+    views = list(client.views(filter=flt, includeUsageStatistics="true"))
+    fetch_s = time.perf_counter() - t0
+
+    newest = watermark or ""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO workbooks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(w["id"], w["name"], w.get("contentUrl"), (w.get("project") or {}).get("id"),
+              (w.get("project") or {}).get("name"), w.get("updatedAt"), started)
+             for w in workbooks])
+        conn.executemany(
+            "INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(v["id"], (v.get("workbook") or {}).get("id"), v["name"], v.get("contentUrl"),
+              view_url(client.host, client.site, v.get("contentUrl") or ""),
+              int((v.get("usage") or {}).get("totalViewCount") or 0),
+              v.get("updatedAt"), started)
+             for v in views])
+        newest = max([newest] + [x.get("updatedAt") or "" for x in workbooks + views])
+
+        removed = 0
+        if full:
+            removed += conn.execute("DELETE FROM workbooks WHERE seen < ?", (started,)).rowcount
+            removed += conn.execute("DELETE FROM views WHERE seen < ?", (started,)).rowcount
+            _set_meta(conn, "last_full", started)
+        if newest:
+            _set_meta(conn, "watermark", newest)
+        _set_meta(conn, "version", int(_meta(conn, "version") or 0) + 1)
+    conn.close()
+
+    result = {"full": int(full), "workbooks": len(workbooks), "views": len(views),
+              "removed": removed, "fetch_ms": round(fetch_s * 1000)}
+    log.info("catalog sync: %s", result)
+    return result
+
+
+# -----------------------------------
+# In-memory index (what sessions read)
+# -----------------------------------
+class CatalogIndex:
+    """Read-only dict views of the catalog. Never mutate."""
+
+    __slots__ = ("version", "views", "by_id", "by_url")
+
+    def __init__(self, version: int, views: List[Dict]):
+        self.version = version
+        self.views = views
+        self.by_id = {v["id"]: v for v in views}
+        self.by_url = {normalize_url(v["url"]): v for v in views if v["url"]}
+
+    def view_for_url(self, url: str) -> Optional[Dict]:
+        return self.by_url.get(normalize_url(url))
+
+    def dashboards(self) -> List[Dict]:
+        """dashboards.json-shaped entries (unique names), by project/workbook/view."""
+        counts: Dict[str, int] = {}
+        for v in self.views:
+            counts[v["name"]] = counts.get(v["name"], 0) + 1
+        dashboards, seen = [], set()
+        for v in self.views:
+            name = v["name"] if counts[v["name"]] == 1 else f"{v['name']} ({v['workbook']})"
+            if name in seen:
+                name = f"{name} [{v['id'][:8]}]"
+            seen.add(name)
+            dashboards.append({"name": name, "url": v["url"], "view_id": v["id"],
+                               "project": v["project"]})
+        return dashboards
+
+
+def load_index(path: str = CATALOG_PATH) -> Optional[CatalogIndex]:
+    """
+    The whole catalog as a CatalogIndex, or None if it was never synced.
+    Any other SQLite error (locked, corrupt) is raised, not taken for "empty".
+    """
+    if not os.path.isfile(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=10.0)
+    try:
+        version = int(_meta(conn, "version") or 0)
+        rows = conn.execute(
+            "SELECT v.id, v.name, v.url, v.total_views, w.name, w.project_name"
+            " FROM views v LEFT JOIN workbooks w ON w.id = v.workbook_id"
+            " ORDER BY w.project_name, w.name, v.name").fetchall()
+    except sqlite3.OperationalError as exc:
+        if "no such table" in str(exc):
+            return None  # created but never synced
+        raise
+    finally:
+        conn.close()
+    views = [{"id": r[0], "name": r[1], "url": r[2], "total_views": r[3],
+              "workbook": r[4] or "", "project": r[5] or ""} for r in rows]
+    return CatalogIndex(version, views)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tableau workbook/view catalog")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sync = sub.add_parser("sync")
+    p_sync.add_argument("--full", action="store_true")
+    p_sync.add_argument("--every", type=float, metavar="SECONDS",
+                        help="keep running, syncing every SECONDS")
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "stats":
+        index = load_index()
+        if index is None:
+            print("catalog is empty; run: python catalog.py sync")
+            return 1
+        projects = {v["project"] for v in index.views}
+        print(f"version {index.version}: {len(index.views)} views in {len(projects)} projects")
+        return 0
+
+    while True:
+        try:
+            print(sync(full=args.full))
+        except Exception:
+            if not args.every:
+                raise
+            log.exception("catalog sync failed")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,247 @@
+# ================================
+# config_store.py
+# ================================
+#
+# One parsed copy of secrets.json + dashboards.json (+ the synced catalog,
+# see catalog.py) per process. Files are re-stat'ed at most once per
+# CHECK_INTERVAL and re-parsed only when their mtime/size/inode change, so
+# every rerun / token request reads a pre-indexed in-memory snapshot
+# instead of opening and parsing JSON.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# -----------------------------------
+# Paths
+# -----------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# (fake_tableau.py points these at copies aimed at its local server)
+SECRETS_PATH = os.environ.get("PORTAL_SECRETS_PATH", os.path.join(BASE_DIR, "secrets.json"))
+DASHBOARDS_PATH = os.environ.get("PORTAL_DASHBOARDS_PATH", os.path.join(BASE_DIR, "dashboards.json"))
+CATALOG_PATH = os.environ.get("PORTAL_CATALOG_PATH", os.path.join(BASE_DIR, "catalog.db"))
+
+# "file": the sidebar lists dashboards.json; "catalog": every synced view.
+DASHBOARD_SOURCE = os.environ.get("PORTAL_DASHBOARD_SOURCE", "file")
+
+# How often (seconds) the files are stat'ed for changes.
+CHECK_INTERVAL = float(os.environ.get("PORTAL_CONFIG_CHECK_INTERVAL", "1.0"))
+
+# Query string appended to every view URL for the iframe embed.
+EMBED_PARAMS = ":embed=y&:showVizHome=n&:toolbar=n&:api_token="
+
+# Shortest accepted per-dashboard "refresh_interval" (seconds).
+MIN_REFRESH_INTERVAL = 30
+
+
+# -----------------------------------
+# Parsing + schema checks
+# -----------------------------------
+def _read_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_secrets(raw) -> Dict[str, Optional[str]]:
+    """Normalise secrets.json (flat or nested under "tableau")."""
+    if not isinstance(raw, dict):
+        raise ValueError("secrets.json must contain a JSON object")
+
+    cfg = raw.get("tableau", raw)
+    if not isinstance(cfg, dict):
+        raise ValueError('secrets.json "tableau" entry must be a JSON object')
+
+    secrets = {
+        "client_id": cfg.get("client_id"),
+        "secret_id": cfg.get("secret_id"),
+        "secret_value": cfg.get("secret_value"),
+        "site_id": cfg.get("site_guid") or cfg.get("site_id"),
+        "site_content_url": cfg.get("site_content_url") or cfg.get("site_name"),
+        "host": cfg.get("host") or cfg.get("tableau_host"),
+        "tableau_user": cfg.get("tableau_user") or raw.get("tableau_user"),
+        "admin_user": cfg.get("admin_user") or raw.get("admin_user"),
+        "admin_password": cfg.get("admin_password") or raw.get("admin_password"),
+    }
+
+    for key, value in secrets.items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"secrets.json field {key!r} must be a string")
+
+    if secrets["secret_value"]:
+        secrets["secret_value"] = secrets["secret_value"].strip()
+    if secrets["host"]:
+        secrets["host"] = secrets["host"].rstrip("/")
+
+    return secrets
+
+
+def parse_dashboards(raw) -> List[Dict]:
+    """
+    Validate dashboards.json (list of {name, url} or {name: url} mapping).
+    Entries may set "refresh_interval" (seconds) to auto-refresh their data.
+    """
+    if isinstance(raw, dict):
+        raw = [{"name": n, "url": u} for n, u in raw.items()]
+    if not isinstance(raw, list):
+        raise ValueError("dashboards.json must be a list or a mapping")
+
+    dashboards = []
+    seen = set()
+    for i, d in enumerate(raw):
+        if not isinstance(d, dict):
+            raise ValueError(f"dashboards.json entry #{i} must be an object")
+        name, url = d.get("name"), d.get("url")
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"dashboards.json entry #{i} has no name")
+        if not isinstance(url, str) or not url.startswith(("https://", "http://")):
+            raise ValueError(f"dashboards.json entry {name!r} has an invalid url")
+        if name in seen:
+            raise ValueError(f"dashboards.json has a duplicate name {name!r}")
+        interval = d.get("refresh_interval")
+        if interval is not None and (isinstance(interval, bool)
+                                     or not isinstance(interval, (int, float))
+                                     or interval < MIN_REFRESH_INTERVAL):
+            raise ValueError(f"dashboards.json entry {name!r} refresh_interval must be "
+                             f"a number of seconds >= {MIN_REFRESH_INTERVAL}")
+        seen.add(name)
+        dashboards.append(dict(d))
+
+    return dashboards
+
+
+# -----------------------------------
+# Snapshot
+# -----------------------------------
+class ConfigSnapshot:
+    """Read-only, pre-indexed view of both config files. Never mutate."""
+
+    __slots__ = ("version", "secrets", "dashboards", "catalog", "names", "by_name", "urls",
+                 "view_ids", "refresh_intervals", "iframe_prefixes")
+
+    def __init__(self, version: int, secrets: Dict, dashboards: List[Dict], catalog=None):
+        self.version = version
+        self.secrets = secrets
+        self.dashboards = dashboards
+        self.catalog = catalog
+        self.names = tuple(d["name"] for d in dashboards)
+        self.by_name = {d["name"]: d for d in dashboards}
+        self.urls = {d["name"]: d["url"] for d in dashboards}
+        self.view_ids = {d["name"]: d.get("view_id") for d in dashboards}
+        self.refresh_intervals = {d["name"]: d.get("refresh_interval") for d in dashboards}
+        self.iframe_prefixes = {
+            d["name"]: d["url"] + ("&" if "?" in d["url"] else "?") + EMBED_PARAMS
+            for d in dashboards
+        }
+
+    def dashboard(self, name: str) -> Optional[Dict]:
+        return self.by_name.get(name)
+
+    def iframe_url(self, name: str, token: str) -> str:
+        return self.iframe_prefixes[name] + token
+
+
+# -----------------------------------
+# Store
+# -----------------------------------
+class ConfigStore:
+    """Thread-safe, stat-invalidated cache of secrets.json + dashboards.json."""
+
+    def __init__(self, secrets_path: str = SECRETS_PATH,
+                 dashboards_path: str = DASHBOARDS_PATH,
+                 check_interval: float = CHECK_INTERVAL,
+                 catalog_path: str = CATALOG_PATH,
+                 dashboard_source: str = DASHBOARD_SOURCE):
+        self.secrets_path = secrets_path
+        self.dashboards_path = dashboards_path
+        self.check_interval = check_interval
+        self.catalog_path = catalog_path
+        self.dashboard_source = dashboard_source
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._stamps: Optional[Tuple] = None
+        self._next_check = 0.0
+
+    @staticmethod
+    def _stamp(path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @metrics.timed("config_store", "json_load")
+    def _load(self, version: int) -> ConfigSnapshot:
+        if not os.path.isfile(self.secrets_path):
+            raise FileNotFoundError(f"secrets.json not found at {self.secrets_path}")
+        secrets = parse_secrets(_read_json(self.secrets_path))
+
+        import catalog
+        index = catalog.load_index(self.catalog_path)
+
+        if self.dashboard_source == "catalog" and index is not None:
+            dashboards = index.dashboards()
+        elif os.path.isfile(self.dashboards_path):
+            dashboards = parse_dashboards(_read_json(self.dashboards_path))
+            if index is not None:
+                for d in dashboards:
+                    view = index.view_for_url(d["url"])
+                    if view is not None:
+                        d.setdefault("view_id", view["id"])
+        else:
+            dashboards = []
+
+        return ConfigSnapshot(version, secrets, dashboards, index)
+
+    def get(self) -> ConfigSnapshot:
+        """Return the current snapshot, reloading if either file changed."""
+        snap = self._snapshot
+        if snap is not None and time.monotonic() < self._next_check:
+            return snap
+
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now < self._next_check:
+                return self._snapshot
+            self._next_check = now + self.check_interval
+
+            stamps = (self._stamp(self.secrets_path), self._stamp(self.dashboards_path),
+                      self._stamp(self.catalog_path), self._stamp(self.catalog_path + "-wal"))
+            if self._snapshot is not None and stamps == self._stamps:
+                return self._snapshot
+
+            version = self._snapshot.version + 1 if self._snapshot else 1
+            try:
+                snap = self._load(version)
+            except (OSError, ValueError, sqlite3.DatabaseError):
+                # A half-written file or a locked / corrupt catalog must not
+                # take the portal down (nor drop every view_id): keep serving
+                # the last good snapshot and retry next interval.
+                if self._snapshot is None:
+                    raise
+                log.exception("config reload failed; keeping version %s", self._snapshot.version)
+                return self._snapshot
+
+            self._snapshot, self._stamps = snap, stamps
+            return snap
+
+    def invalidate(self) -> None:
+        """Force a stat check on the next get()."""
+        self._next_check = 0.0
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+STORE = ConfigStore()
+
+
+def get_config() -> ConfigSnapshot:
+    return STORE.get()
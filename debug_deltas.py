@@ -0,0 +1,132 @@
+# debug_deltas.py — per-interaction report: websocket bytes + server CPU
+#
+#   python debug_deltas.py                 # current streamlit_app.py
+#   python debug_deltas.py --before HEAD~1 # side by side with an older revision
+#
+# Drives the app through Streamlit's AppTest and sums the serialized size of
+# the delta ForwardMsgs each rerun produces, i.e. what goes over the websocket,
+# plus the CPU time of the script thread for that rerun.
+#
+# AppTest always reruns the whole script; for widgets inside a keyed
+# @st.fragment the report replays what the browser does and reruns only
+# that fragment (apps without the fragment get a full run, as before).
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import streamlit.testing.v1.local_script_runner as local_script_runner
+from streamlit.errors import StreamlitAPIException
+from streamlit.testing.v1 import AppTest
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+
+_sizes = []
+_cpu = []
+_fragment_ids = []
+_parse_tree = local_script_runner.parse_tree_from_messages
+_rerun_data = local_script_runner.RerunData
+_run_script = local_script_runner.LocalScriptRunner._run_script
+
+
+def _recording_parse(msgs):
+    _sizes.append(sum(m.ByteSize() for m in msgs if m.HasField("delta")))
+    return _parse_tree(msgs)
+
+
+def _scoped_rerun_data(**kwargs):
+    if _fragment_ids:
+        kwargs["fragment_id_queue"] = list(_fragment_ids)
+    return _rerun_data(**kwargs)
+
+
+def _timed_run_script(self, rerun_data):
+    start = time.thread_time()
+    try:
+        return _run_script(self, rerun_data)
+    finally:
+        _cpu.append(time.thread_time() - start)
+
+
+local_script_runner.parse_tree_from_messages = _recording_parse
+local_script_runner.RerunData = _scoped_rerun_data
+local_script_runner.LocalScriptRunner._run_script = _timed_run_script
+
+
+def measure(script):
+    """Return [(step, delta bytes, cpu ms)] for a login -> dashboard session."""
+    at = AppTest.from_file(script, default_timeout=60)
+    steps = []
+
+    def step(label, action, fragment=None):
+        _sizes.clear()
+        _cpu.clear()
+        _fragment_ids.clear()
+        if fragment:
+            try:
+                _fragment_ids.extend(at._fragment_storage.resolve_target(fragment))
+            except StreamlitAPIException:
+                pass  # no such fragment in this revision: full rerun
+        tree = at._tree
+        action()
+        steps.append((label, _sizes[-1] if _sizes else 0, sum(_cpu) * 1000))
+        if _fragment_ids:
+            # AppTest's tree now holds only the fragment. Put the full page
+            # back (it carries the new widget values) and drop spent clicks,
+            # like the browser does, so later steps see every widget.
+            _fragment_ids.clear()
+            at._tree = tree
+            for button in at.button:
+                button.set_value(False)
+
+    step("login: first paint", at.run)
+    step("login: rerun (typing)", lambda: at.text_input[0].input("someone@example.com").run())
+
+    def login():
+        at.session_state["logged_in"] = True
+        at.session_state["username"] = "someone@example.com"
+        at.run()
+
+    step("dashboard: first paint", login)
+    step("dashboard: refresh click",
+         lambda: at.button(key="refresh_btn").click().run(), fragment="header")
+    radio = at.sidebar.radio[0]
+    step("dashboard: switch view",
+         lambda: radio.set_value(radio.options[1]).run(), fragment="sidebar")
+    step("dashboard: plain rerun", at.run)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--app", default=os.path.join(BASE, "streamlit_app.py"))
+    parser.add_argument("--before", metavar="REV",
+                        help="git revision of streamlit_app.py to compare against")
+    args = parser.parse_args()
+
+    os.chdir(BASE)
+    measure(args.app)  # warm-up: imports + asset builds would skew the first CPU column
+    after = measure(args.app)
+
+    before = None
+    if args.before:
+        src = subprocess.check_output(["git", "show", f"{args.before}:streamlit_app.py"])
+        tmp = os.path.join(BASE, "_deltas_before.py")
+        with open(tmp, "wb") as f:
+            f.write(src)
+        try:
+            before = {label: (size, cpu) for label, size, cpu in measure(tmp)}
+        finally:
+            os.remove(tmp)
+
+    print(f"\n{'step':<28}{'bytes before':>14}{'after':>10}{'cpu ms before':>16}{'after':>8}")
+    for label, size, cpu in after:
+        old_size, old_cpu = before.get(label, ("-", "-")) if before else ("-", "-")
+        if old_size != "-":
+            old_size, old_cpu = f"{old_size:,}", f"{old_cpu:.1f}"
+        print(f"{label:<28}{old_size:>14}{size:>10,}{old_cpu:>16}{cpu:>8.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
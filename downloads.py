@@ -0,0 +1,167 @@
+# ================================
+# downloads.py
+# ================================
+#
+# "Download data": the active view's data as CSV (REST "Query View Data"),
+# relayed chunk by chunk from Tableau to the browser by the token service.
+# Nothing is buffered whole, in the Streamlit process or here, so memory
+# stays flat however large the extract is.
+#
+# The page only builds a link: /download/<name>.csv?t=<signed payload>,
+# signed when "Download CSV" is clicked (start) and opened right away.
+# The payload (view, filters, gzip, expiry) is HMAC-signed, so the link
+# cannot be edited to fetch another view, and it expires after LINK_TTL.
+# With gzip the body is compressed on the fly (Content-Encoding: gzip);
+# the browser saves the plain CSV.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import zlib
+from functools import partial
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import token_server
+from async_http import NO_STORE, Response, StreamResponse, json_response
+from config_store import get_config
+
+log = logging.getLogger(__name__)
+
+ROUTE = "/download/"
+LINK_TTL = int(os.environ.get("PORTAL_DOWNLOAD_LINK_TTL", "900"))
+CHUNK_SIZE = 64 * 1024
+
+
+# -----------------------------------
+# Signed links
+# -----------------------------------
+def _key() -> bytes:
+    key = os.environ.get("PORTAL_DOWNLOAD_KEY")
+    if key:
+        return key.encode("utf-8")
+    # every worker and the shared daemon read the same secrets.json
+    return hashlib.sha256(b"portal-download:" + get_config().secrets["secret_value"].encode()).digest()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def sign(payload: Dict) -> str:
+    body = _b64(json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    sig = _b64(hmac.new(_key(), body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{sig}"
+
+
+def verify(token: str) -> Dict:
+    """The signed payload; ValueError if the token is forged or expired."""
+    body, _, sig = token.partition(".")
+    expected = _b64(hmac.new(_key(), body.encode("ascii"), hashlib.sha256).digest())
+    if not sig or not hmac.compare_digest(sig, expected):
+        raise ValueError("invalid download link")
+    payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    if payload["exp"] < time.time():
+        raise ValueError("download link expired; reopen it from the portal")
+    return payload
+
+
+def link(name: str, url: str, view_id: Optional[str] = None,
+         filters: Optional[Dict[str, str]] = None, gzip: bool = True) -> str:
+    """Signed, short-lived download URL for dashboard `name` (view `url`)."""
+    service = token_server.ensure_started()
+    if service is not None:
+        serve_on(service.http)
+    token = sign({"n": name, "u": url, "v": view_id, "f": filters or {}, "z": int(gzip),
+                  "exp": int(time.time()) + LINK_TTL})
+    return f"{token_server.public_url()}{ROUTE}{quote(name, safe='')}.csv?t={token}"
+
+
+def start(name: str, url: str, view_id: Optional[str] = None,
+          filters: Optional[Dict[str, str]] = None, gzip: bool = True) -> None:
+    """Sign a link now and have the browser fetch it (call on a button click)."""
+    import streamlit as st
+
+    href = link(name, url, view_id, filters, gzip)
+    # the frame navigates itself to the attachment: a download, no new tab;
+    # the nonce makes every click a new frame, even for an identical link
+    st.components.v1.html(f"<!-- {time.time_ns()} --><script>location.href = "
+                          f"{json.dumps(href)};</script>", height=0)
+
+
+def parse_filters(text: str) -> Dict[str, str]:
+    """Lines of "Field=value" -> {field: value}; blank lines are ignored."""
+    filters = {}
+    for line in text.splitlines():
+        field, sep, value = line.partition("=")
+        if sep and field.strip():
+            filters[field.strip()] = value.strip()
+    return filters
+
+
+# -----------------------------------
+# Serving
+# -----------------------------------
+async def _relay(resp, gzip: bool):
+    """Upstream body chunks (read on a worker thread), optionally gzipped."""
+    loop = asyncio.get_running_loop()
+    chunks = resp.iter_content(CHUNK_SIZE)
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            yield z.compress(chunk) if z else chunk
+        if z:
+            yield z.flush()
+    finally:
+        resp.close()
+
+
+async def serve_download(request) -> Response:
+    try:
+        payload = verify(request.arg("t", ""))
+    except (ValueError, KeyError) as exc:
+        return json_response({"error": str(exc)}, 403, NO_STORE)
+
+    import requests
+
+    from tableau_client import EXPORT_TIMEOUT, TableauError, get_client
+
+    loop = asyncio.get_running_loop()
+    params = {f"vf_{k}": v for k, v in payload["f"].items()}
+    try:
+        client = await loop.run_in_executor(None, get_client)
+        view_id = payload["v"] or await loop.run_in_executor(None, client.view_id_for, payload["u"])
+        resp = await loop.run_in_executor(None, partial(
+            client.request, "GET", f"views/{view_id}/data", params=params, stream=True,
+            timeout=EXPORT_TIMEOUT))
+        if resp.status_code >= 400:
+            try:
+                await loop.run_in_executor(None, client._json, resp)
+            finally:
+                resp.close()
+    except (TableauError, requests.RequestException) as exc:
+        log.warning("download of %s failed: %s", payload["n"], exc)
+        return json_response({"error": str(exc)}, 502, NO_STORE)
+
+    gzip = bool(payload["z"]) and "gzip" in request.headers.get("accept-encoding", "")
+    headers = dict(NO_STORE, **{
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(payload['n'])}.csv",
+        "X-Content-Type-Options": "nosniff",
+    })
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamResponse(_relay(resp, gzip), 200, "text/csv; charset=utf-8", headers)
+
+
+def serve_on(http) -> None:
+    """Serve ROUTE on an async_http server (once)."""
+    if not any(prefix == ROUTE for _, prefix, _ in http.prefix_routes):
+        http.route_prefix(ROUTE)(serve_download)
@@ -1,9 +1,11 @@
 // frontend/embed_auto_refresh.js
 // Not required — included inline by streamlit_app.py.
 // Example usage shown only.
+// tokenEndpoint: token_server.public_url() + "/new_jwt?t=" + a session grant (token_server.grant).
 
-(async function embed(viewUrl, tokenEndpoint, containerId, height) {
-  const moduleUrl = "https://prod-in-a.online.tableau.com/javascripts/api/tableau.embedding.3.latest.min.js";
+// moduleUrl: assets.tableau_embedding()["url"] (pinned, vendored copy when available).
+
+(async function embed(viewUrl, tokenEndpoint, containerId, height, moduleUrl) {
   await import(moduleUrl);
 
   const container = document.getElementById(containerId);
@@ -0,0 +1,312 @@
+# ================================
+# exporter.py
+# ================================
+#
+# Bulk PDF/PNG export of dashboards through the REST export endpoints
+# (month-end packs instead of printing each dashboard from the portal):
+#
+#   python exporter.py                                 # every dashboard, PDF
+#   python exporter.py "Balance Sheet" "P&L Sheet" --format png
+#   python exporter.py --filter Period=2025-09 --orientation Portrait
+#   python exporter.py --pack month_end.json           # per-dashboard filters
+#   python exporter.py --at 06:00 --every 86400        # scheduled
+#
+# Jobs run on a bounded worker pool, with at most PER_HOST exports in
+# flight against any one Tableau host. Files are streamed to disk
+# (exports/<date>/<name>.<ext>) and failed exports are retried with
+# backoff. Progress lines and a final report give views exported per
+# minute; the report is also written next to the files.
+#
+# A pack file is a JSON list of dashboards.json names or
+# {"name": ..., "filters": {"Field": "value"}} objects.
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import requests
+
+from auth import load_secrets
+from config_store import get_config
+from tableau_client import TableauClient, TableauError, site_content_url
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.environ.get("PORTAL_EXPORT_DIR", os.path.join(BASE_DIR, "exports"))
+EXPORT_WORKERS = int(os.environ.get("PORTAL_EXPORT_WORKERS", "6"))
+PER_HOST = int(os.environ.get("PORTAL_EXPORT_PER_HOST", "3"))
+RETRIES = 3                 # per export, on top of the client's 429/5xx retries
+RETRY_DELAY = 5.0           # seconds, doubled per attempt
+
+FORMATS = {"pdf": "pdf", "png": "image"}    # --format -> REST endpoint
+PAGE_TYPES = ("A3", "A4", "A5", "B5", "Executive", "Folio", "Ledger", "Legal",
+              "Letter", "Note", "Quarto", "Tabloid")
+
+
+class ExportJob:
+    __slots__ = ("name", "url", "view_id", "fmt", "filters", "dest",
+                 "attempts", "size", "seconds", "error")
+
+    def __init__(self, name: str, url: str, view_id: Optional[str], fmt: str,
+                 filters: Dict[str, str], dest: str):
+        self.name = name
+        self.url = url
+        self.view_id = view_id
+        self.fmt = fmt
+        self.filters = filters
+        self.dest = dest
+        self.attempts = 0
+        self.size = 0
+        self.seconds = 0.0
+        self.error: Optional[str] = None
+
+
+def file_name(name: str, filters: Dict[str, str], ext: str) -> str:
+    suffix = "".join(f" [{k}={v}]" for k, v in sorted(filters.items()))
+    return re.sub(r'[\\/:*?"<>|]+', "_", name + suffix) + "." + ext
+
+
+def make_jobs(pack: Sequence, fmt: str = "pdf", filters: Optional[Dict[str, str]] = None,
+              out_dir: Optional[str] = None) -> List[ExportJob]:
+    """Jobs for `pack` (names or {"name", "filters"}); an empty pack means every dashboard."""
+    cfg = get_config()
+    out_dir = out_dir or os.path.join(EXPORT_DIR, datetime.date.today().isoformat())
+    jobs = []
+    for item in pack or cfg.names:
+        if isinstance(item, str):
+            item = {"name": item}
+        name = item["name"]
+        if name not in cfg.urls:
+            raise KeyError(f"unknown dashboard {name!r} (see dashboards.json)")
+        job_filters = dict(filters or {}, **item.get("filters", {}))
+        dest = os.path.join(out_dir, file_name(name, job_filters, fmt))
+        jobs.append(ExportJob(name, cfg.urls[name], cfg.view_ids.get(name), fmt,
+                              job_filters, dest))
+    return jobs
+
+
+def retryable(exc: Exception) -> bool:
+    if isinstance(exc, TableauError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (requests.RequestException, OSError))
+
+
+# -----------------------------------
+# Progress / throughput
+# -----------------------------------
+class Progress:
+    def __init__(self, total: int, stream=sys.stdout):
+        self.total = total
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.times: List[float] = []
+        self._lock = threading.Lock()
+
+    def per_minute(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done * 60 / elapsed if elapsed else 0.0
+
+    def finished(self, job: ExportJob) -> None:
+        with self._lock:
+            if job.error:
+                self.failed += 1
+            else:
+                self.done += 1
+                self.bytes += job.size
+                self.times.append(job.seconds)
+            n = self.done + self.failed
+            status = f"FAILED ({job.error})" if job.error else f"{job.size / 1024:,.0f} KB"
+            print(f"[{n:>{len(str(self.total))}}/{self.total}] {os.path.basename(job.dest)}: "
+                  f"{status} in {job.seconds:.1f}s, {job.attempts} attempt(s) "
+                  f"| {self.per_minute():.1f} views/min", file=self.stream, flush=True)
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        times = sorted(self.times)
+        return {
+            "exported": self.done,
+            "failed": self.failed,
+            "seconds": round(elapsed, 1),
+            "views_per_min": round(self.per_minute(), 1),
+            "mb": round(self.bytes / 1048576, 2),
+            "p50_s": round(times[len(times) // 2], 2) if times else None,
+            "max_s": round(times[-1], 2) if times else None,
+        }
+
+
+# -----------------------------------
+# Engine
+# -----------------------------------
+class Exporter:
+    """Reusable across runs (scheduled mode keeps clients and sign-ins)."""
+
+    def __init__(self, workers: int = EXPORT_WORKERS, per_host: int = PER_HOST,
+                 retries: int = RETRIES, page_type: str = "A4",
+                 orientation: str = "Landscape", resolution: str = "high"):
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.page_type = page_type
+        self.orientation = orientation
+        self.resolution = resolution
+        self._secrets = load_secrets()
+        self._clients: Dict[tuple, TableauClient] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, url: str):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        site = site_content_url(self._secrets, [url])
+        with self._lock:
+            client = self._clients.get((host, site))
+            if client is None:
+                client = self._clients[(host, site)] = TableauClient(host=host, site=site)
+            slot = self._slots.setdefault(host, threading.BoundedSemaphore(self.per_host))
+            return client, slot
+
+    def _params(self, job: ExportJob) -> Dict[str, str]:
+        params = {f"vf_{k}": v for k, v in job.filters.items()}
+        if job.fmt == "pdf":
+            params.update(type=self.page_type, orientation=self.orientation)
+        else:
+            params.update(resolution=self.resolution)
+        return params
+
+    def export(self, job: ExportJob) -> ExportJob:
+        client, slot = self._client(job.url)
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            job.attempts = attempt + 1
+            try:
+                with slot:
+                    view_id = job.view_id or client.view_id_for(job.url)
+                    job.size = client.download(f"views/{view_id}/{FORMATS[job.fmt]}", job.dest,
+                                               **self._params(job))
+                job.error = None
+                break
+            except Exception as exc:
+                job.error = str(exc)
+                if attempt == self.retries or not retryable(exc):
+                    log.warning("export of %s failed: %s", job.name, exc)
+                    break
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+        job.seconds = time.perf_counter() - started
+        return job
+
+    def run(self, jobs: List[ExportJob], stream=sys.stdout) -> Dict:
+        """Export every job; returns (and writes next to the files) the report."""
+        for job in jobs:
+            os.makedirs(os.path.dirname(job.dest), exist_ok=True)
+        progress = Progress(len(jobs), stream)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(jobs))),
+                                thread_name_prefix="export") as pool:
+            for future in as_completed([pool.submit(self.export, job) for job in jobs]):
+                progress.finished(future.result())
+
+        report = dict(progress.summary(), jobs=[
+            {"name": j.name, "file": j.dest, "bytes": j.size, "seconds": round(j.seconds, 2),
+             "attempts": j.attempts, "error": j.error} for j in jobs])
+        for out_dir in {os.path.dirname(j.dest) for j in jobs}:
+            with open(os.path.join(out_dir, "export_report.json"), "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+
+# -----------------------------------
+# CLI / scheduled mode
+# -----------------------------------
+def next_run(at: Optional[str], every: Optional[float], last: Optional[float]) -> float:
+    """Epoch of the next scheduled run."""
+    now = time.time()
+    if last is not None and every:
+        return max(now, last + every)
+    if at:
+        hour, minute = (int(x) for x in at.split(":"))
+        target = datetime.datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target.timestamp() <= now:
+            target += datetime.timedelta(days=1)
+        return target.timestamp()
+    return now
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk dashboard export (PDF/PNG)")
+    parser.add_argument("dashboards", nargs="*", help="dashboards.json names (default: all)")
+    parser.add_argument("--pack", metavar="FILE", help="JSON list of names or {name, filters}")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="pdf")
+    parser.add_argument("--filter", action="append", default=[], metavar="FIELD=VALUE",
+                        help="view filter applied to every export (repeatable)")
+    parser.add_argument("--page-type", choices=PAGE_TYPES, default="A4")
+    parser.add_argument("--orientation", choices=("Landscape", "Portrait"), default="Landscape")
+    parser.add_argument("--out", metavar="DIR", help="output directory (default: exports/<date>)")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS)
+    parser.add_argument("--per-host", type=int, default=PER_HOST)
+    parser.add_argument("--retries", type=int, default=RETRIES)
+    parser.add_argument("--at", metavar="HH:MM", help="scheduled: first run at this local time")
+    parser.add_argument("--every", type=float, metavar="SECONDS",
+                        help="scheduled: keep running, exporting every SECONDS")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pack = list(args.dashboards)
+    if args.pack:
+        with open(args.pack, encoding="utf-8") as f:
+            pack += json.load(f)
+    from downloads import parse_filters
+    filters = {}
+    for text in args.filter:
+        parsed = parse_filters(text)
+        if not parsed:
+            parser.error(f"--filter expects FIELD=VALUE, got {text!r}")
+        filters.update(parsed)
+    every = args.every or (86400 if args.at else None)
+
+    exporter = Exporter(args.workers, args.per_host, args.retries,
+                        page_type=args.page_type, orientation=args.orientation)
+    last = None
+    try:
+        while True:
+            if every:
+                wait = next_run(args.at, every, last) - time.time()
+                if wait > 0:
+                    log.info("next export at %s", time.strftime("%Y-%m-%d %H:%M",
+                                                               time.localtime(time.time() + wait)))
+                    time.sleep(wait)
+            last = time.time()
+            try:
+                report = exporter.run(make_jobs(pack, args.format, filters, args.out))
+                print({k: v for k, v in report.items() if k != "jobs"}, flush=True)
+            except Exception:
+                if not every:
+                    raise
+                log.exception("scheduled export failed")
+                continue
+            if not every:
+                return 1 if report["failed"] else 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        exporter.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,711 @@
+# ================================
+# fake_tableau.py
+# ================================
+#
+# Local stand-in for Tableau Cloud, so the benchmarks, the cache warmer
+# and the load harness run end to end with no network access:
+#
+#   python fake_tableau.py                                     # serve on 127.0.0.1:8765
+#   python fake_tableau.py --latency 80 --render-latency 1500 --error-rate 0.02
+#   python fake_tableau.py run -- python warmer.py             # run one command against it
+#   python fake_tableau.py run --latency 200 -- python load_test.py --sessions 1,4
+#
+# What it serves (the parts of Tableau the portal uses):
+#
+#   /javascripts/api/tableau.embedding.3.*.js      stub library: <tableau-viz>
+#   /t/<site>/views/<workbook>/<view>              view page (:api_token=<embed JWT>)
+#   POST /api/<v>/auth/signin, /auth/signout       Connected App JWT sign-in
+#   /api/<v>/sites/<id>/views|workbooks|jobs       paged listings (filter=field:op:value)
+#   /api/<v>/sites/<id>/views/<id>/image|pdf|data  renders (data streamed as CSV)
+#   GET /fake/stats, POST /fake/config             counters; change latency / faults live
+#
+# JWTs are checked the way Tableau checks what auth.generate_tableau_jwt
+# signs: HS256 with the Connected App secret, kid, iss, aud "tableau",
+# sub, jti, exp (at most MAX_JWT_LIFETIME ahead), site.id and the scope
+# the endpoint needs. The views are the ones in dashboards.json, plus
+# --extra-views synthetic ones to exercise pagination.
+#
+# Latency (base + jitter, renders slower) and faults (503s, 429s with
+# Retry-After) apply to every request except /fake/*.
+#
+# `run` writes copies of secrets.json / dashboards.json whose host and
+# view URLs point here, and starts the command with PORTAL_SECRETS_PATH
+# and PORTAL_DASHBOARDS_PATH set to them (and scratch catalog, warmer,
+# snapshot and export locations), so real files and databases are left
+# alone. The scratch catalog is synced from the fake first, so dashboards
+# have view ids (snapshots, sidebar thumbnails) as on a synced portal.
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import html
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from async_http import NO_STORE, HTTPServer, Request, Response, StreamResponse, json_response
+from config_store import DASHBOARDS_PATH, SECRETS_PATH, parse_dashboards, parse_secrets
+from tableau_client import site_content_url
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HOST = "127.0.0.1"
+PORT = int(os.environ.get("PORTAL_FAKE_TABLEAU_PORT", "8765"))
+
+MAX_JWT_LIFETIME = 600      # Tableau rejects exp more than 10 minutes ahead
+CLOCK_SKEW = 30
+SESSION_TTL = 120 * 60      # X-Tableau-Auth lifetime reported by sign-in
+PAGE_SIZE_MAX = 1000
+DATA_ROWS = 1000
+DATA_CHUNK_ROWS = 500
+
+REST_ENDPOINTS = ("signin", "signout", "views", "workbooks", "jobs", "image", "pdf", "data")
+
+EMBED_SCOPE = "tableau:views:embed"
+READ_SCOPE = "tableau:content:read"
+DOWNLOAD_SCOPE = "tableau:views:download"
+
+
+# -----------------------------------
+# Connected App JWTs
+# -----------------------------------
+class JWTError(ValueError):
+    """Why a token was rejected (the reason is counted in /fake/stats)."""
+
+
+def _b64decode(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + "=" * (-len(part) % 4))
+
+
+def verify_jwt(token: str, app: Dict, scope: Optional[str], now: Optional[float] = None,
+               max_lifetime: int = MAX_JWT_LIFETIME) -> Dict:
+    """Claims of a valid Connected App JWT (for `scope`, if given); raises JWTError otherwise."""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, AttributeError, TypeError):
+        raise JWTError("malformed token")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise JWTError("malformed token")
+
+    if header.get("alg") != "HS256":
+        raise JWTError("unsupported alg")
+    if app.get("secret_id") and header.get("kid") != app["secret_id"]:
+        raise JWTError("unknown kid")
+    expected = hmac.new(app["secret_value"].encode(), f"{header_b64}.{payload_b64}".encode(),
+                        hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise JWTError("bad signature")
+
+    now = time.time() if now is None else now
+    exp = claims.get("exp")
+    if claims.get("iss") != app["client_id"]:
+        raise JWTError("wrong iss")
+    if claims.get("aud") != "tableau":
+        raise JWTError("wrong aud")
+    if not isinstance(claims.get("sub"), str) or not claims["sub"]:
+        raise JWTError("missing sub")
+    if not isinstance(claims.get("jti"), str) or not claims["jti"]:
+        raise JWTError("missing jti")
+    if not isinstance(exp, int) or isinstance(exp, bool):
+        raise JWTError("missing exp")
+    if exp <= now - CLOCK_SKEW:
+        raise JWTError("expired")
+    if exp > now + max_lifetime + CLOCK_SKEW:
+        raise JWTError("exp too far ahead")
+    if (claims.get("site") or {}).get("id") != app["site_id"]:
+        raise JWTError("wrong site")
+    if not isinstance(claims.get("scp"), list) or not claims["scp"]:
+        raise JWTError("missing scp")
+    if scope is not None and scope not in claims["scp"]:
+        raise JWTError(f"missing scope {scope}")
+    return claims
+
+
+# -----------------------------------
+# Content
+# -----------------------------------
+def _solid_png(width: int, height: int, rgb: Tuple[int, int, int]) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height, 9))
+            + chunk(b"IEND", b""))
+
+
+def _pdf(title: str) -> bytes:
+    text = re.sub(r"[()\\]", "", title)
+    stream = f"BT /F1 24 Tf 72 720 Td ({text}) Tj ET".encode("latin-1", "replace")
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+               b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+               b"/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+               b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def build_views(dashboards: List[Dict], extra: int = 0) -> List[Dict]:
+    """REST view records for dashboards.json (+ `extra` synthetic ones)."""
+    views = []
+    seen = set()
+    for d in dashboards:
+        match = re.search(r"/views/([^/?#]+)/([^/?#]+)", d["url"])
+        if not match or match.groups() in seen:
+            continue
+        seen.add(match.groups())
+        views.append((d["name"], match.group(1), match.group(2), d.get("view_id")))
+    views += [(f"Synthetic {i}", f"Synthetic{i // 10}", f"View{i}", None) for i in range(extra)]
+
+    records = []
+    for i, (name, workbook, view, view_id) in enumerate(views):
+        content_url = f"{workbook}/sheets/{view}"
+        records.append({
+            "id": view_id or str(uuid.uuid5(uuid.NAMESPACE_URL, content_url)),
+            "name": name,
+            "contentUrl": content_url,
+            "viewUrlName": view,
+            "workbook": {"id": str(uuid.uuid5(uuid.NAMESPACE_URL, workbook)), "name": workbook},
+            "usage": {"totalViewCount": str(1000 - i if i < 1000 else 0)},
+            "createdAt": "2025-01-01T00:00:00Z",
+            "updatedAt": "2025-06-01T00:00:00Z",
+        })
+    return records
+
+
+_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "in": lambda a, b: a in b.strip("[]").split(","),
+}
+
+
+def matches(item: Dict, flt: Optional[str]) -> bool:
+    """REST filter expression: field:op:value[,field:op:value...] (all must hold)."""
+    if not flt:
+        return True
+    for expr in re.split(r",(?![^\[]*\])", flt):
+        field, op, value = (expr.split(":", 2) + ["", ""])[:3]
+        actual = item.get(field)
+        if actual is None or op not in _OPERATORS or not _OPERATORS[op](str(actual), value):
+            return False
+    return True
+
+
+STUB_LIBRARY = """\
+// Stub of the Tableau embedding library served by fake_tableau.py.
+// <tableau-viz> loads the fake view page in an iframe with the token from
+// its token callback, and re-dispatches the page's firstinteractive /
+// vizloaderror events. refreshDataAsync() is one more round trip.
+(() => {
+  if (customElements.get("tableau-viz")) return;
+
+  class TableauViz extends HTMLElement {
+    get src() { return this._src || this.getAttribute("src"); }
+    set src(value) { this._src = value; }
+
+    async viewUrl(extra = "") {
+      const token = typeof this.token === "function" ? await this.token()
+        : (this.token || this.getAttribute("token") || "");
+      const sep = this.src.includes("?") ? "&" : "?";
+      return `${this.src}${sep}:embed=y&:api_token=${encodeURIComponent(token)}${extra}`;
+    }
+
+    async connectedCallback() {
+      if (this.frame) return;
+      const frame = this.frame = document.createElement("iframe");
+      frame.style.cssText = "border:0;width:100%;height:100%";
+      this.appendChild(frame);
+      this.onMessage = (event) => {
+        if (event.source !== frame.contentWindow || !(event.data || {}).fakeTableau) return;
+        this.dispatchEvent(new CustomEvent(event.data.fakeTableau, { detail: event.data }));
+      };
+      window.addEventListener("message", this.onMessage);
+      try {
+        frame.src = await this.viewUrl();
+      } catch (err) {
+        this.dispatchEvent(new CustomEvent("vizloaderror", { detail: { message: String(err) } }));
+      }
+    }
+
+    disconnectedCallback() {
+      window.removeEventListener("message", this.onMessage);
+    }
+
+    async refreshDataAsync() {
+      const resp = await fetch(await this.viewUrl("&:refresh=y"), { cache: "no-store" });
+      if (!resp.ok) throw new Error(`refresh failed: HTTP ${resp.status}`);
+    }
+  }
+
+  customElements.define("tableau-viz", TableauViz);
+})();
+"""
+
+VIEW_PAGE = """<!DOCTYPE html>
+<html><body style="margin:0;font:14px sans-serif;background:{background}">
+<div style="padding:24px">{body}</div>
+<script>parent.postMessage({{fakeTableau: {event}, view: {view}}}, "*");</script>
+</body></html>
+"""
+
+
+# -----------------------------------
+# Latency + fault injection
+# -----------------------------------
+class Faults:
+    """Per-request delay and injected failures; fields can change while serving."""
+
+    FIELDS = ("latency_ms", "jitter_ms", "render_latency_ms", "error_rate", "throttle_rate")
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, render_latency_ms: float = 0,
+                 error_rate: float = 0, throttle_rate: float = 0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.render_latency_ms = render_latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+
+    def update(self, values: Dict) -> None:
+        for key, value in values.items():
+            if key not in self.FIELDS or isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"unknown or invalid setting {key!r}")
+            if value < 0 or (key.endswith("_rate") and value > 1):
+                raise ValueError(f"{key} out of range")
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def settings(self) -> Dict:
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    async def delay(self, render: bool = False) -> None:
+        ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        if render:
+            ms += self.render_latency_ms
+        if ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+    def inject(self) -> Optional[int]:
+        """429 or 503 for this request (by the configured rates), else None."""
+        roll = self._random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+
+# -----------------------------------
+# Server
+# -----------------------------------
+def _error(status: int, code: str, summary: str, detail: str = "",
+           headers: Optional[Dict[str, str]] = None) -> Response:
+    return json_response({"error": {"code": code, "summary": summary, "detail": detail or summary}},
+                         status, dict(NO_STORE, **(headers or {})))
+
+
+class FakeTableau:
+    """Tableau Cloud stand-in on its own event-loop thread (see module docs)."""
+
+    def __init__(self, secrets: Dict, dashboards: List[Dict], faults: Optional[Faults] = None,
+                 host: str = HOST, port: int = PORT, extra_views: int = 0,
+                 data_rows: int = DATA_ROWS, session_ttl: int = SESSION_TTL,
+                 max_jwt_lifetime: int = MAX_JWT_LIFETIME, single_use_jti: bool = False):
+        if not all(secrets.get(k) for k in ("client_id", "secret_value", "site_id")):
+            raise ValueError("secrets.json needs client_id, secret_value and site_id")
+        self.app = secrets
+        self.site_id = secrets["site_id"]
+        self.site = site_content_url(secrets, [d["url"] for d in dashboards])
+        self.views = build_views(dashboards, extra_views)
+        self.views_by_id = {v["id"]: v for v in self.views}
+        self.views_by_path = {(v["workbook"]["name"], v["viewUrlName"]): v for v in self.views}
+        self.workbooks = list({v["workbook"]["id"]: dict(v["workbook"], contentUrl=v["workbook"]["name"],
+                                                         updatedAt=v["updatedAt"])
+                               for v in self.views}.values())
+        self.faults = faults or Faults()
+        self.host = host
+        self.port = port
+        self.data_rows = data_rows
+        self.session_ttl = session_ttl
+        self.max_jwt_lifetime = max_jwt_lifetime
+        self.single_use_jti = single_use_jti
+        self.url: Optional[str] = None
+
+        self._sessions: Dict[str, Tuple[float, frozenset]] = {}   # X-Tableau-Auth -> (expires, scopes)
+        self._jtis: Dict[str, int] = {}                            # seen jti -> exp
+        self._images: Dict[str, bytes] = {}
+        self.counts: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+        self.http = HTTPServer()
+        self.http.route_prefix("/javascripts/api/")(self.library)
+        self.http.route_prefix("/t/")(self.view_page)
+        self.http.route_prefix("/views/")(self.view_page)
+        self.http.route_prefix("/api/", methods=("GET", "POST"))(self.rest)
+        self.http.route("/fake/stats")(self.stats)
+        self.http.route("/fake/config", methods=("POST",))(self.configure)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _count(self, key: str, table: Optional[Dict[str, int]] = None) -> None:
+        table = self.counts if table is None else table
+        table[key] = table.get(key, 0) + 1
+
+    def check_jwt(self, token: str, scope: Optional[str]) -> Dict:
+        try:
+            claims = verify_jwt(token, self.app, scope, max_lifetime=self.max_jwt_lifetime)
+        except JWTError as exc:
+            self._count(str(exc), self.rejected)
+            raise
+        now = time.time()
+        if claims["jti"] in self._jtis:
+            self._count("jti reused")
+            if self.single_use_jti:
+                self._count("jti reused", self.rejected)
+                raise JWTError("jti reused")
+        if len(self._jtis) > 10000:
+            self._jtis = {j: e for j, e in self._jtis.items() if e > now - CLOCK_SKEW}
+        self._jtis[claims["jti"]] = claims["exp"]
+        return claims
+
+    # ---- embedding ----
+    async def library(self, request: Request) -> Response:
+        self._count("library")
+        await self.faults.delay()
+        return Response(STUB_LIBRARY, 200, "text/javascript; charset=utf-8",
+                        {"Cache-Control": "public, max-age=300"})
+
+    def _page(self, status: int, event: str, view: str, body: str) -> Response:
+        page = VIEW_PAGE.format(background="#fff" if status == 200 else "#fee",
+                                body=html.escape(body), event=json.dumps(event),
+                                view=json.dumps(view).replace("</", "<\\/"))
+        return Response(page, status, "text/html; charset=utf-8", NO_STORE)
+
+    async def view_page(self, request: Request) -> Response:
+        refresh = request.arg(":refresh") == "y"
+        self._count("refresh" if refresh else "view page")
+        match = re.fullmatch(r"(?:/t/([^/]+))?/views/([^/]+)/([^/]+)/?", request.path)
+        view = self.views_by_path.get(match.group(2, 3)) if match else None
+        await self.faults.delay(render=True)
+        name = view["name"] if view else request.path
+        if view is None or (match.group(1) or "") != self.site:
+            return self._page(404, "vizloaderror", name, "View not found")
+        status = self.faults.inject()
+        if status:
+            self._count(f"injected {status}")
+            return self._page(status, "vizloaderror", name, f"Injected HTTP {status}")
+        try:
+            claims = self.check_jwt(request.arg(":api_token") or "", EMBED_SCOPE)
+        except JWTError as exc:
+            return self._page(401, "vizloaderror", name, f"Sign-in failed: {exc}")
+        if refresh:
+            return json_response({"refreshed": view["id"]}, headers=NO_STORE)
+        return self._page(200, "firstinteractive", name,
+                          f"{view['name']}: {view['contentUrl']} as {claims['sub']}")
+
+    # ---- REST ----
+    async def rest(self, request: Request) -> Response:
+        parts = request.path.strip("/").split("/")[2:]   # drop "api/<version>"
+        endpoint = parts[-1] if parts else ""
+        render = endpoint in ("image", "pdf", "data")
+        self._count("rest " + (endpoint if endpoint in REST_ENDPOINTS else "other"))
+        await self.faults.delay(render=render)
+        status = self.faults.inject()
+        if status == 429:
+            self._count("injected 429")
+            return _error(429, "429000", "Too many requests", headers={"Retry-After": "1"})
+        if status:
+            self._count(f"injected {status}")
+            return _error(status, f"{status}000", "Service unavailable")
+
+        if parts == ["auth", "signin"] and request.method == "POST":
+            return self.sign_in(request)
+        if parts == ["auth", "signout"] and request.method == "POST":
+            self._sessions.pop(request.headers.get("x-tableau-auth"), None)
+            return Response(b"", 204, headers=NO_STORE)
+
+        session = self._sessions.get(request.headers.get("x-tableau-auth") or "")
+        if session is None or session[0] < time.monotonic():
+            return _error(401, "401002", "Unauthorized Access",
+                          "Invalid authentication credentials were provided.")
+        if len(parts) < 3 or parts[0] != "sites" or parts[1] != self.site_id or request.method != "GET":
+            return _error(404, "404000", "Resource Not Found", request.path)
+        resource = parts[2:]
+        needed = DOWNLOAD_SCOPE if render else READ_SCOPE
+        if needed not in session[1]:
+            return _error(403, "403157", "Forbidden", f"Sign-in JWT lacks scope {needed}")
+
+        if resource == ["views"]:
+            return self.paged(request, self.views, "views", "view")
+        if resource == ["workbooks"]:
+            return self.paged(request, self.workbooks, "workbooks", "workbook")
+        if resource == ["jobs"]:
+            return self.paged(request, [], "backgroundJobs", "backgroundJob")
+        view = self.views_by_id.get(resource[1]) if len(resource) >= 2 else None
+        if resource[0] != "views" or view is None:
+            return _error(404, "404011", "Resource Not Found", f"View {resource[1:2]} not found")
+        if len(resource) == 2:
+            return json_response({"view": view}, headers=NO_STORE)
+        if resource[2] == "image":
+            return Response(self.image(view["id"]), 200, "image/png", NO_STORE)
+        if resource[2] == "pdf":
+            return Response(_pdf(view["name"]), 200, "application/pdf", NO_STORE)
+        if resource[2] == "data":
+            filters = {k[3:]: v for k, v in request.query.items() if k.startswith("vf_")}
+            return StreamResponse(self.rows(view, filters), 200, "text/csv; charset=utf-8",
+                                  dict(NO_STORE, **{"Content-Disposition":
+                                                    f'attachment; filename="{view["viewUrlName"]}.csv"'}))
+        return _error(404, "404000", "Resource Not Found", request.path)
+
+    def sign_in(self, request: Request) -> Response:
+        try:
+            creds = request.json()["credentials"]
+            jwt, content_url = creds["jwt"], (creds.get("site") or {}).get("contentUrl", "")
+        except (ValueError, KeyError, TypeError):
+            return _error(400, "400000", "Bad Request", "expected credentials.jwt")
+        if content_url != self.site:
+            return _error(401, "401001", "Signin Error", f"unknown site {content_url!r}")
+        try:
+            claims = self.check_jwt(jwt, None)   # endpoints check their own scope
+        except JWTError as exc:
+            return _error(401, "401001", "Signin Error", str(exc))
+        token = base64.urlsafe_b64encode(os.urandom(24)).decode()
+        self._sessions[token] = (time.monotonic() + self.session_ttl, frozenset(claims["scp"]))
+        h, rest = divmod(self.session_ttl, 3600)
+        return json_response({"credentials": {
+            "token": token,
+            "site": {"id": self.site_id, "contentUrl": self.site},
+            "user": {"id": str(uuid.uuid5(uuid.NAMESPACE_URL, claims["sub"]))},
+            "estimatedTimeToExpiration": f"{h:02d}:{rest // 60:02d}:{rest % 60:02d}",
+        }}, headers=NO_STORE)
+
+    def paged(self, request: Request, items: List[Dict], collection: str, item: str) -> Response:
+        try:
+            size = max(1, min(int(request.arg("pageSize", "100")), PAGE_SIZE_MAX))
+            number = max(1, int(request.arg("pageNumber", "1")))
+        except ValueError:
+            return _error(400, "400006", "Bad Request", "pageSize/pageNumber must be integers")
+        selected = [i for i in items if matches(i, request.arg("filter"))]
+        page = selected[(number - 1) * size:number * size]
+        return json_response({
+            "pagination": {"pageNumber": str(number), "pageSize": str(size),
+                           "totalAvailable": str(len(selected))},
+            collection: {item: page},
+        }, headers=NO_STORE)
+
+    def image(self, view_id: str) -> bytes:
+        png = self._images.get(view_id)
+        if png is None:
+            digest = hashlib.sha256(view_id.encode()).digest()
+            png = self._images[view_id] = _solid_png(800, 600, (digest[0], digest[1], digest[2]))
+        return png
+
+    async def rows(self, view: Dict, filters: Dict[str, str]) -> AsyncIterator[bytes]:
+        regions = ("North", "South", "East", "West")
+        yield b"Workbook,View,Region,Month,Value\r\n"
+        lines = []
+        for i in range(self.data_rows):
+            region = regions[i % 4]
+            month = f"2025-{i % 12 + 1:02d}"
+            if filters.get("Region", region) != region or filters.get("Month", month) != month:
+                continue
+            lines.append(f"{view['workbook']['name']},{view['viewUrlName']},{region},{month},"
+                         f"{(i * 7919) % 100000 / 100:.2f}\r\n")
+            if len(lines) == DATA_CHUNK_ROWS:
+                yield "".join(lines).encode()
+                lines = []
+                await asyncio.sleep(0)
+        if lines:
+            yield "".join(lines).encode()
+
+    # ---- control ----
+    async def stats(self, request: Request) -> Response:
+        return json_response({"requests": self.http.requests, "counts": self.counts,
+                              "rejected_jwts": self.rejected, "faults": self.faults.settings(),
+                              "views": len(self.views)}, headers=NO_STORE)
+
+    async def configure(self, request: Request) -> Response:
+        try:
+            self.faults.update(request.json() or {})
+        except (ValueError, AttributeError) as exc:
+            return json_response({"error": str(exc)}, 400, NO_STORE)
+        return json_response(self.faults.settings(), headers=NO_STORE)
+
+    # ---- lifecycle ----
+    def start(self) -> "FakeTableau":
+        ready = threading.Event()
+        error = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._loop = loop
+            try:
+                server = loop.run_until_complete(self.http.start(self.host, self.port))
+                sock_host, sock_port = server.sockets[0].getsockname()[:2]
+                self.url = f"http://{sock_host}:{sock_port}"
+            except Exception as exc:
+                error.append(exc)
+                ready.set()
+                loop.close()
+                return
+            ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-tableau", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if error:
+            raise RuntimeError("fake Tableau server failed to start") from error[0]
+        log.info("fake Tableau listening on %s (site %r, %d views)", self.url, self.site,
+                 len(self.views))
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.http.close(), loop).result(timeout)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join(timeout)
+
+
+# -----------------------------------
+# Pointing the portal at it
+# -----------------------------------
+def write_config(fake: FakeTableau, secrets: Dict, dashboards: List[Dict],
+                 directory: str) -> Dict[str, str]:
+    """Copies of both config files aimed at `fake`; returns the env vars to use them."""
+    secrets_path = os.path.join(directory, "secrets.json")
+    dashboards_path = os.path.join(directory, "dashboards.json")
+    with open(secrets_path, "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in dict(secrets, host=fake.url, site_content_url=fake.site).items()
+                   if v is not None}, f, indent=2)
+    with open(dashboards_path, "w", encoding="utf-8") as f:
+        json.dump([dict(d, url=re.sub(r"^https?://[^/]+", fake.url, d["url"]))
+                   for d in dashboards], f, indent=2)
+    return {"PORTAL_SECRETS_PATH": secrets_path, "PORTAL_DASHBOARDS_PATH": dashboards_path}
+
+
+def run_command(fake: FakeTableau, secrets: Dict, dashboards: List[Dict],
+                command: List[str], sync_catalog: bool = True) -> int:
+    scratch = tempfile.mkdtemp(prefix="fake-tableau-")
+    try:
+        env = dict(os.environ, **write_config(fake, secrets, dashboards, scratch))
+        for key, name in (("PORTAL_CATALOG_PATH", "catalog.db"), ("PORTAL_WARMER_DB", "warmer.db"),
+                          ("PORTAL_SNAPSHOT_DIR", "snapshots"), ("PORTAL_EXPORT_DIR", "exports")):
+            env.setdefault(key, os.path.join(scratch, name))
+        if sync_catalog and env["PORTAL_CATALOG_PATH"].startswith(scratch):
+            # dashboards get view ids (snapshots, thumbnails), as on a synced portal
+            subprocess.run([sys.executable, os.path.join(BASE_DIR, "catalog.py"), "sync", "--full"],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+        return subprocess.run(command, env=env).returncode
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command: List[str] = []
+    if "--" in argv:
+        at = argv.index("--")
+        argv, command = argv[:at], argv[at + 1:]
+
+    parser = argparse.ArgumentParser(description="Local Tableau stand-in for offline testing")
+    parser.add_argument("mode", nargs="?", default="serve", choices=("serve", "run"),
+                        help='"run" starts the command after -- against the fake server')
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, help=f"default {PORT} (serve), any free port (run)")
+    parser.add_argument("--latency", type=float, default=0, metavar="MS", help="added to every request")
+    parser.add_argument("--jitter", type=float, default=0, metavar="MS", help="random extra, 0..MS")
+    parser.add_argument("--render-latency", type=float, default=0, metavar="MS",
+                        help="extra for view pages, refreshes and image/pdf/data renders")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0,
+                        help="fraction answered with 429 + Retry-After")
+    parser.add_argument("--seed", type=int, help="seed for jitter and faults (reproducible runs)")
+    parser.add_argument("--extra-views", type=int, default=0, help="synthetic views beyond dashboards.json")
+    parser.add_argument("--data-rows", type=int, default=DATA_ROWS, help="rows per data export")
+    parser.add_argument("--session-ttl", type=int, default=SESSION_TTL, metavar="SECONDS",
+                        help="X-Tableau-Auth lifetime (short values exercise re-auth)")
+    parser.add_argument("--single-use-jti", action="store_true", help="reject a JWT id seen before")
+    parser.add_argument("--no-catalog", action="store_true",
+                        help="run: skip syncing the fake's views into the scratch catalog")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help="Connected App credentials to accept")
+    parser.add_argument("--dashboards", default=DASHBOARDS_PATH, help="views to serve")
+    args = parser.parse_args(argv)
+    if args.mode == "run" and not command:
+        parser.error("run needs a command after --")
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.secrets, encoding="utf-8") as f:
+        secrets = parse_secrets(json.load(f))
+    with open(args.dashboards, encoding="utf-8") as f:
+        dashboards = parse_dashboards(json.load(f))
+    faults = Faults(args.latency, args.jitter, args.render_latency, args.error_rate,
+                    args.throttle_rate, args.seed)
+    port = args.port if args.port is not None else (PORT if args.mode == "serve" else 0)
+    fake = FakeTableau(secrets, dashboards, faults, args.host, port, args.extra_views,
+                       args.data_rows, args.session_ttl, single_use_jti=args.single_use_jti).start()
+
+    if args.mode == "run":
+        try:
+            code = run_command(fake, secrets, dashboards, command, not args.no_catalog)
+        finally:
+            fake.stop()
+        print(f"fake Tableau: {fake.http.requests} requests {json.dumps(fake.counts)}"
+              + (f", rejected JWTs {json.dumps(fake.rejected)}" if fake.rejected else ""),
+              file=sys.stderr)
+        return code
+
+    print(f"Fake Tableau on {fake.url} (Ctrl+C to stop)", flush=True)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    fake.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
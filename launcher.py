@@ -0,0 +1,416 @@
+# ================================
+# launcher.py
+# ================================
+#
+# Runs N Streamlit workers behind one local TCP (L4) proxy, plus one
+# shared token daemon on a Unix socket, so the portal uses every core:
+#
+#   python launcher.py                      # one worker per core, :8501
+#   python launcher.py --workers 4 -- --server.enableXsrfProtection false
+#   python launcher.py --public             # every interface (0.0.0.0)
+#
+#   :8501  -> least-connections over healthy workers (websockets included)
+#   :5001  -> token daemon (token_server.py --unix), JWTs + static assets
+#
+# Both listen on 127.0.0.1 unless --public is given: only then may --host
+# be a non-loopback address. /new_jwt answers session grants only (see
+# token_server.py), but /metrics, /rum, /snapshots, /assets stay open,
+# so expose the ports deliberately (PORTAL_TOKEN_PUBLIC_URL and
+# PORTAL_ALLOWED_ORIGINS then name the public addresses).
+#
+# Workers are health-checked (/_stcore/health) and restarted with backoff
+# when they crash or stop answering. SIGHUP does a rolling restart (start
+# replacement, wait until healthy, drain the old worker); SIGTERM/SIGINT
+# drain everything and exit. Drained users reconnect to another worker and
+# keep their login through session_store.
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+from typing import List, Optional, Set
+
+import session_store
+
+log = logging.getLogger("launcher")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HEALTH_INTERVAL = 2.0
+HEALTH_FAILURES = 3          # consecutive failed checks before a restart
+STARTUP_TIMEOUT = 60.0
+DRAIN_TIMEOUT = 30.0
+MAX_BACKOFF = 30.0
+PIPE_CHUNK = 64 * 1024
+
+
+# -----------------------------------
+# Helpers
+# -----------------------------------
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # a host name may resolve to anything
+
+
+async def http_get(path: str, port: Optional[int] = None, unix_path: Optional[str] = None,
+                   timeout: float = 2.0) -> int:
+    """Status code of a tiny HTTP/1.0 GET (0 if it failed)."""
+    try:
+        if unix_path:
+            opened = asyncio.open_unix_connection(unix_path)
+        else:
+            opened = asyncio.open_connection("127.0.0.1", port)
+        reader, writer = await asyncio.wait_for(opened, timeout)
+        try:
+            writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+            status = await asyncio.wait_for(reader.readline(), timeout)
+        finally:
+            writer.close()
+        return int(status.split()[1])
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        return 0
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(PIPE_CHUNK)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        if writer.can_write_eof():
+            try:
+                writer.write_eof()
+            except OSError:
+                pass
+
+
+async def splice(client_r, client_w, upstream_r, upstream_w) -> None:
+    """Copy both directions until both sides are done, then close."""
+    try:
+        await asyncio.gather(pipe(client_r, upstream_w), pipe(upstream_r, client_w))
+    finally:
+        upstream_w.close()
+        client_w.close()
+
+
+# -----------------------------------
+# Supervised processes
+# -----------------------------------
+class Process:
+    """A child process that is restarted (with backoff) until stopped."""
+
+    name = "process"
+
+    def __init__(self):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.state = "stopped"     # starting -> ready -> draining -> stopped
+        self.failures = 0          # consecutive failed health checks
+        self.restarts = 0
+        self.started_at = 0.0
+        self._stopping = False
+
+    def command(self) -> List[str]:
+        raise NotImplementedError
+
+    def env(self) -> dict:
+        return dict(os.environ)
+
+    async def healthy(self) -> bool:
+        raise NotImplementedError
+
+    async def spawn(self) -> None:
+        self.proc = await asyncio.create_subprocess_exec(*self.command(), env=self.env(),
+                                                         cwd=BASE_DIR)
+        self.state = "starting"
+        self.failures = 0
+        self.started_at = time.monotonic()
+        log.info("%s started (pid %s)", self.name, self.proc.pid)
+
+    async def supervise(self) -> None:
+        """Spawn, health-check and respawn until stop() is called."""
+        backoff = 1.0
+        while not self._stopping:
+            await self.spawn()
+            exited = asyncio.ensure_future(self.proc.wait())
+            while not exited.done() and not self._stopping:
+                await asyncio.wait([exited], timeout=HEALTH_INTERVAL)
+                if exited.done() or self._stopping:
+                    break
+                await self.check()
+            if self._stopping:
+                await exited
+                break
+
+            uptime = time.monotonic() - self.started_at
+            self.state = "stopped"
+            self.restarts += 1
+            backoff = 1.0 if uptime > 60 else min(backoff * 2, MAX_BACKOFF)
+            log.warning("%s exited (code %s) after %.0fs; restarting in %.0fs",
+                        self.name, self.proc.returncode, uptime, backoff)
+            await asyncio.sleep(backoff)
+        self.state = "stopped"
+
+    async def check(self) -> None:
+        if await self.healthy():
+            if self.state == "starting":
+                log.info("%s ready after %.1fs", self.name, time.monotonic() - self.started_at)
+                self.state = "ready"
+            self.failures = 0
+            return
+        if self.state == "starting":
+            if time.monotonic() - self.started_at > STARTUP_TIMEOUT:
+                log.error("%s did not become healthy in %.0fs; killing it", self.name, STARTUP_TIMEOUT)
+                self.kill()
+            return
+        if self.state == "ready":
+            self.failures += 1
+            if self.failures >= HEALTH_FAILURES:
+                log.error("%s failed %d health checks; killing it", self.name, self.failures)
+                self.kill()
+
+    def kill(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        self._stopping = True
+        self.state = "stopped"
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        self.proc.terminate()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+
+
+class TokenDaemon(Process):
+    name = "token daemon"
+
+    def __init__(self, socket_path: str):
+        super().__init__()
+        self.socket_path = socket_path
+
+    def command(self) -> List[str]:
+        return [sys.executable, os.path.join(BASE_DIR, "token_server.py"), "--unix", self.socket_path]
+
+    async def healthy(self) -> bool:
+        return await http_get("/healthz", unix_path=self.socket_path) == 200
+
+
+class Worker(Process):
+    def __init__(self, port: int, app: str, extra_args: List[str], env: dict):
+        super().__init__()
+        self.port = port
+        self.app = app
+        self.extra_args = extra_args
+        self.extra_env = env
+        self.active = 0            # proxied connections
+        self.name = f"worker :{port}"
+
+    def command(self) -> List[str]:
+        return [sys.executable, "-m", "streamlit", "run", self.app,
+                "--server.port", str(self.port),
+                "--server.address", "127.0.0.1",
+                "--server.headless", "true",
+                *self.extra_args]
+
+    def env(self) -> dict:
+        return dict(os.environ, **self.extra_env)
+
+    async def healthy(self) -> bool:
+        return await http_get("/_stcore/health", port=self.port) == 200
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Take out of rotation, let open connections finish, then stop."""
+        self.state = "draining"
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.25)
+        if self.active:
+            log.info("%s: closing %d connections after %.0fs drain", self.name, self.active, timeout)
+        await self.stop()
+
+
+# -----------------------------------
+# Launcher
+# -----------------------------------
+class Launcher:
+    def __init__(self, args):
+        self.args = args
+        self.socket_path = args.token_socket or os.path.join(
+            tempfile.gettempdir(), f"portal-token-{os.getpid()}.sock")
+        self.token_public_url = (os.environ.get("PORTAL_TOKEN_PUBLIC_URL")
+                                 or f"http://localhost:{args.token_port}")
+        self.daemon = TokenDaemon(self.socket_path)
+        self.workers: List[Worker] = []
+        self.connections = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._servers = []
+        self._done = asyncio.Event()
+
+    def _worker_env(self) -> dict:
+        return {"PORTAL_TOKEN_SOCKET": self.socket_path,
+                "PORTAL_TOKEN_PUBLIC_URL": self.token_public_url}
+
+    def _free_port(self) -> int:
+        used = {w.port for w in self.workers}
+        port = self.args.base_port
+        while port in used:
+            port += 1
+        return port
+
+    def _run(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def add_worker(self) -> Worker:
+        worker = Worker(self._free_port(), self.args.app, self.args.streamlit_args,
+                        self._worker_env())
+        self.workers.append(worker)
+        self._run(worker.supervise())
+        return worker
+
+    # ---- proxy ----
+    async def _pick(self) -> Optional[Worker]:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline and not self._done.is_set():
+            ready = [w for w in self.workers if w.state == "ready"]
+            if ready:
+                return min(ready, key=lambda w: w.active)
+            await asyncio.sleep(0.1)
+        return None
+
+    async def _proxy_app(self, client_r, client_w) -> None:
+        self.connections += 1
+        worker = await self._pick()
+        if worker is None:
+            client_w.close()
+            return
+        try:
+            upstream_r, upstream_w = await asyncio.open_connection("127.0.0.1", worker.port)
+        except OSError:
+            client_w.close()
+            return
+        worker.active += 1
+        try:
+            await splice(client_r, client_w, upstream_r, upstream_w)
+        finally:
+            worker.active -= 1
+
+    async def _proxy_token(self, client_r, client_w) -> None:
+        try:
+            upstream_r, upstream_w = await asyncio.open_unix_connection(self.socket_path)
+        except OSError:
+            client_w.close()
+            return
+        await splice(client_r, client_w, upstream_r, upstream_w)
+
+    # ---- lifecycle ----
+    async def rolling_restart(self) -> None:
+        """Replace workers one at a time; capacity never drops below N-1."""
+        log.info("rolling restart of %d workers", len(self.workers))
+        for old in list(self.workers):
+            new = self.add_worker()
+            while new.state != "ready" and not self._done.is_set():
+                await asyncio.sleep(0.25)
+            await old.drain(self.args.drain_timeout)
+            self.workers.remove(old)
+        log.info("rolling restart done")
+
+    async def shutdown(self) -> None:
+        if self._done.is_set():
+            return
+        self._done.set()
+        log.info("draining %d workers", len(self.workers))
+        for server in self._servers:
+            server.close()
+        await asyncio.gather(*(w.drain(self.args.drain_timeout) for w in self.workers))
+        await self.daemon.stop()
+
+    def status(self) -> str:
+        workers = ", ".join(f"{w.port}:{w.state}/{w.active}" for w in self.workers)
+        return (f"daemon {self.daemon.state}, {self.connections} connections, "
+                f"workers [{workers}]")
+
+    async def run(self) -> None:
+        if session_store.BACKEND_URL.startswith("memory"):
+            log.warning("PORTAL_SESSION_BACKEND is per-process; logins will not "
+                        "follow users across workers")
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, lambda: self._run(self.shutdown()))
+        loop.add_signal_handler(signal.SIGINT, lambda: self._run(self.shutdown()))
+        loop.add_signal_handler(signal.SIGHUP, lambda: self._run(self.rolling_restart()))
+        loop.add_signal_handler(signal.SIGUSR1, lambda: log.info(self.status()))
+
+        self._run(self.daemon.supervise())
+        for _ in range(self.args.workers):
+            self.add_worker()
+
+        self._servers.append(await asyncio.start_server(
+            self._proxy_app, self.args.host, self.args.port, reuse_address=True))
+        self._servers.append(await asyncio.start_server(
+            self._proxy_token, self.args.host, self.args.token_port, reuse_address=True))
+        log.info("portal on http://%s:%s (%d workers), tokens on %s via %s",
+                 self.args.host, self.args.port, self.args.workers,
+                 self.token_public_url, self.socket_path)
+
+        await self._done.wait()
+        while any(w.state != "stopped" for w in self.workers) or self.daemon.state != "stopped":
+            await asyncio.sleep(0.1)
+        for task in list(self._tasks):
+            task.cancel()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the portal on N Streamlit workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", help="bind address (default 127.0.0.1, or 0.0.0.0 with --public)")
+    parser.add_argument("--public", action="store_true",
+                        help="allow binding a non-loopback address")
+    parser.add_argument("--port", type=int, default=8501)
+    parser.add_argument("--token-port", type=int, default=5001)
+    parser.add_argument("--token-socket", help="Unix socket of the token daemon")
+    parser.add_argument("--base-port", type=int, default=8600,
+                        help="first internal port for workers")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--app", default=os.path.join(BASE_DIR, "streamlit_app.py"))
+    parser.add_argument("streamlit_args", nargs=argparse.REMAINDER,
+                        help="extra `streamlit run` options, after --")
+    args = parser.parse_args(argv)
+    if args.streamlit_args[:1] == ["--"]:
+        args.streamlit_args = args.streamlit_args[1:]
+    if args.host is None:
+        args.host = "0.0.0.0" if args.public else "127.0.0.1"
+    elif not args.public and not is_loopback(args.host):
+        parser.error(f"--host {args.host} is not a loopback address; add --public to expose the portal")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if args.public:
+        for name in ("PORTAL_TOKEN_PUBLIC_URL", "PORTAL_ALLOWED_ORIGINS"):
+            if not os.environ.get(name):
+                log.warning("--public without %s: browsers elsewhere will not get tokens", name)
+    asyncio.run(Launcher(args).run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
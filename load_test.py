@@ -0,0 +1,306 @@
+# ================================
+# load_test.py
+# ================================
+#
+# Concurrent-session load harness: N simulated users in ONE portal
+# process, each an AppTest session driven through main():
+#
+#   log in (login_screen form) -> switch dashboard (dashboard_selector)
+#   -> refresh (refresh_btn) ... -> log out
+#
+#   python load_test.py                          # N = 1, 2, 4, 8, 16
+#   python load_test.py --sessions 1,4,16,32 --rounds 5
+#   python load_test.py --out curve.json         # save the curve
+#   python load_test.py --compare old.json       # side by side with a saved one
+#
+# For every N: rerun latency percentiles (wall time of each interaction),
+# server CPU per rerun (script thread time), resident memory per
+# logged-in session, and websocket bytes per delta rerun. Each N runs in
+# a fresh process so memory numbers do not inherit the previous level.
+# Widgets inside keyed fragments rerun only their fragment, as in the
+# browser (same approach as debug_deltas.py).
+#
+# Sessions use an in-memory session store and throwaway warmer/snapshot
+# files, so a run leaves nothing behind.
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(BASE_DIR, "streamlit_app.py")
+LEVELS = (1, 2, 4, 8, 16)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1048576
+
+
+# -----------------------------------
+# One level (runs in a child process)
+# -----------------------------------
+def run_level(sessions: int, rounds: int) -> Dict:
+    from unittest.mock import MagicMock
+
+    import streamlit.testing.v1.app_test as app_test
+    import streamlit.testing.v1.local_script_runner as local_script_runner
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.errors import StreamlitAPIException
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.util import patch_config_options
+
+    from config_store import get_config
+
+    # Per driving thread: the fragments to scope the next run to, and the
+    # delta bytes + script CPU of the last run.
+    local = threading.local()
+    parse_tree = local_script_runner.parse_tree_from_messages
+    rerun_data = local_script_runner.RerunData
+    run_script = local_script_runner.LocalScriptRunner._run_script
+    runner_run = local_script_runner.LocalScriptRunner.run
+
+    def recording_parse(msgs):
+        local.bytes = sum(m.ByteSize() for m in msgs if m.HasField("delta"))
+        return parse_tree(msgs)
+
+    def scoped_rerun_data(**kwargs):
+        fragments = getattr(local, "fragments", None)
+        if fragments:
+            kwargs["fragment_id_queue"] = list(fragments)
+        return rerun_data(**kwargs)
+
+    def timed_run_script(self, data):
+        start = time.thread_time()
+        try:
+            return run_script(self, data)
+        finally:
+            self.cpu_s = getattr(self, "cpu_s", 0.0) + time.thread_time() - start
+
+    def timed_run(self, *args, **kwargs):
+        try:
+            return runner_run(self, *args, **kwargs)
+        finally:
+            local.cpu = getattr(self, "cpu_s", 0.0)
+
+    # AppTest assumes one test at a time; give every session what the
+    # server shares between sessions instead:
+    # - one script cache (AppTest compiles per run, and parallel compiles
+    #   trip a CPython 3.11 AST race);
+    # - one Runtime, installed once (AppTest sets and clears the global per
+    #   run, pulling it from under the other sessions);
+    # - the appTest config flag, set once for the whole level.
+    shared_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared_cache
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    Runtime._instance = runtime
+    app_test.Runtime = type("Runtime", (Runtime,), {})  # per-run set/clear lands here
+    config_patch = patch_config_options({"global.appTest": True})
+    config_patch.__enter__()
+    app_test.patch_config_options = lambda options: contextlib.nullcontext()
+
+    local_script_runner.parse_tree_from_messages = recording_parse
+    local_script_runner.RerunData = scoped_rerun_data
+    local_script_runner.LocalScriptRunner._run_script = timed_run_script
+    local_script_runner.LocalScriptRunner.run = timed_run
+
+    secrets = get_config().secrets
+    names = get_config().names
+    samples: List[Dict] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+    logged_in = threading.Barrier(sessions + 1)
+    release = threading.Event()
+
+    def session(index: int) -> None:
+        at = AppTest.from_file(APP, default_timeout=120)
+
+        def step(kind, action, fragment=None):
+            local.fragments = []
+            local.bytes = local.cpu = 0
+            if fragment:
+                try:
+                    local.fragments = at._fragment_storage.resolve_target(fragment)
+                except StreamlitAPIException:
+                    pass
+            tree = at._tree
+            start = time.perf_counter()
+            action()
+            wall = time.perf_counter() - start
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            with lock:
+                samples.append({"kind": kind, "ms": wall * 1000, "cpu_ms": local.cpu * 1000,
+                                "bytes": local.bytes})
+            if local.fragments:
+                # restore the full page, drop spent clicks (as the browser does)
+                local.fragments = []
+                at._tree = tree
+                for button in at.button:
+                    button.set_value(False)
+
+        try:
+            step("login page", at.run)
+            at.text_input[0].input(secrets["admin_user"])
+            at.text_input[1].input(secrets["admin_password"])
+            step("login", lambda: at.button(key="login_submit").click().run())
+        except Exception as exc:
+            errors.append(f"session {index}: {exc}")
+            logged_in.abort()
+            return
+        try:
+            logged_in.wait()
+        except threading.BrokenBarrierError:
+            return
+        release.wait()
+        try:
+            for r in range(rounds):
+                radio = at.sidebar.radio(key="dashboard_selector")
+                target = names[(index + r + 1) % len(names)]
+                step("switch", lambda: radio.set_value(target).run(), fragment="sidebar")
+                step("refresh", lambda: at.button(key="refresh_btn").click().run(),
+                     fragment="header")
+            step("logout", lambda: at.button(key="logout_btn").click().run())
+        except Exception as exc:
+            errors.append(f"session {index}: {exc}")
+
+    # warm-up session: imports, asset builds and first-run caches would
+    # otherwise be charged to the first level
+    def warm_up():
+        at = AppTest.from_file(APP, default_timeout=120)
+        at.session_state["logged_in"] = True
+        at.session_state["username"] = secrets["admin_user"]
+        at.run()
+        at.run()
+
+    warm = threading.Thread(target=warm_up)
+    warm.start()
+    warm.join()
+
+    rss_before = rss_mib()
+    threads = [threading.Thread(target=session, args=(i,), name=f"session-{i}")
+               for i in range(sessions)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        logged_in.wait()
+        rss_logged_in = rss_mib()
+    except threading.BrokenBarrierError:
+        rss_logged_in = rss_mib()
+    release.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    reruns = [s for s in samples if s["kind"] != "login page"]
+    ms = [s["ms"] for s in reruns] or [0.0]
+    return {
+        "sessions": sessions,
+        "reruns": len(reruns),
+        "errors": errors,
+        "reruns_per_s": round(len(samples) / elapsed, 1),
+        "p50_ms": round(_percentile(ms, 50), 1),
+        "p95_ms": round(_percentile(ms, 95), 1),
+        "p99_ms": round(_percentile(ms, 99), 1),
+        "cpu_ms_per_rerun": round(sum(s["cpu_ms"] for s in reruns) / max(1, len(reruns)), 2),
+        "bytes_per_delta": round(sum(s["bytes"] for s in reruns) / max(1, len(reruns))),
+        "rss_mib_per_session": round((rss_logged_in - rss_before) / sessions, 2),
+        "rss_mib": round(rss_logged_in, 1),
+        "by_step": {kind: round(_percentile([s["ms"] for s in samples if s["kind"] == kind], 50), 1)
+                    for kind in dict.fromkeys(s["kind"] for s in samples)},
+    }
+
+
+# -----------------------------------
+# Curve (parent process)
+# -----------------------------------
+COLUMNS = (("sessions", "N", 4), ("reruns_per_s", "reruns/s", 9), ("p50_ms", "p50 ms", 8),
+           ("p95_ms", "p95 ms", 8), ("p99_ms", "p99 ms", 8), ("cpu_ms_per_rerun", "cpu ms", 8),
+           ("rss_mib_per_session", "MiB/sess", 9), ("bytes_per_delta", "B/delta", 8))
+
+
+def print_curve(curve: List[Dict], previous: Optional[Dict[int, Dict]] = None) -> None:
+    print("  ".join(f"{title:>{width}}" for _, title, width in COLUMNS))
+    for row in curve:
+        print("  ".join(f"{row[key]:>{width},}" for key, _, width in COLUMNS))
+        old = (previous or {}).get(row["sessions"])
+        if old:
+            print("  ".join(f"{'was':>{width}}" if key == "sessions" else f"{old[key]:>{width},}"
+                            for key, _, width in COLUMNS))
+        for error in row["errors"][:3]:
+            print(f"      error: {error}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent-session load harness")
+    parser.add_argument("--sessions", default=",".join(map(str, LEVELS)),
+                        help="comma-separated session counts (default 1,2,4,8,16)")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="switch + refresh rounds per session")
+    parser.add_argument("--out", metavar="FILE", help="write the curve as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="earlier curve to show alongside")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)  # child process mode
+    args = parser.parse_args(argv)
+
+    if args.level:
+        print(json.dumps(run_level(args.level, args.rounds)))
+        return 0
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = {row["sessions"]: row for row in json.load(f)["curve"]}
+
+    scratch = tempfile.mkdtemp(prefix="portal-load-")
+    env = dict(os.environ,
+               PORTAL_SESSION_BACKEND="memory://",
+               PORTAL_WARMER_DB=os.path.join(scratch, "warmer.db"),
+               PORTAL_SNAPSHOT_DIR=os.path.join(scratch, "snapshots"),
+               STREAMLIT_LOGGER_LEVEL="error")
+    curve = []
+    for n in (int(x) for x in args.sessions.split(",")):
+        print(f"running {n} session(s)...", file=sys.stderr, flush=True)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--level", str(n),
+                              "--rounds", str(args.rounds)],
+                             cwd=BASE_DIR, env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(out.stderr[-2000:], file=sys.stderr)
+            return 1
+        curve.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print_curve(curve, previous)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"recorded": time.strftime("%Y-%m-%d %H:%M"), "rounds": args.rounds,
+                       "curve": curve}, f, indent=2)
+            f.write("\n")
+    return 1 if any(row["errors"] for row in curve) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
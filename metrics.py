@@ -0,0 +1,327 @@
+# ================================
+# metrics.py
+# ================================
+#
+# In-process counters and phase timers, exposed in Prometheus text format:
+#
+#   GET /metrics  (token service; under launcher.py the shared daemon)
+#
+#   portal_phase_seconds{fn, phase}       histogram: where a rerun / request goes
+#   portal_logins_total                   successful logins
+#   portal_login_failures_total           rejected credentials
+#   portal_token_mints_total              tokens handed out by /new_jwt
+#   portal_dashboard_opens_total{dashboard}
+#   portal_jwt_cache_{hits,misses}_total  auth.TOKEN_CACHE, read at scrape time
+#
+# Recording is a perf_counter pair, a bisect and one locked update (a
+# couple of microseconds), so a rerun's dozen phases stay well under 1% of
+# its time. Nothing is formatted until a scrape. PORTAL_METRICS=0 turns every
+# timer and counter into a no-op.
+#
+# launcher.py workers have no HTTP port of their own: each serves its
+# metrics on <token socket>.metrics/<pid>.sock and the daemon's /metrics
+# merges them in, with a worker="<pid>" label.
+
+import asyncio
+import atexit
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from async_http import HTTPServer, Response
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("PORTAL_METRICS", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; reruns are milliseconds, signing microseconds, renders seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCRAPE_TIMEOUT = 1.0
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# -----------------------------------
+# Metric types
+# -----------------------------------
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {(): 0} if not labels else {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {value:g}" for key, value in values]
+
+
+class CallbackCounter(Counter):
+    """Counter whose value is read from `fn` at scrape time (zero recording cost)."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def collect(self) -> List[str]:
+        return [f"{self.name} {self.fn():g}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "key", "start")
+
+    def __init__(self, histogram: "Histogram", key: Tuple):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe_key(self.key, time.perf_counter() - self.start)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # key -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe_key(self, key: Tuple, seconds: float) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def observe(self, seconds: float, *label_values) -> None:
+        if ENABLED:
+            self.observe_key(label_values, seconds)
+
+    def time(self, *label_values):
+        """Context manager recording the wall time of its block."""
+        return _Timer(self, label_values) if ENABLED else _NO_TIMER
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total:.6g}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List = []
+
+
+# -----------------------------------
+# Portal metrics
+# -----------------------------------
+PHASES = Histogram("portal_phase_seconds", "Wall time per phase of a rerun or request.",
+                   ("fn", "phase"))
+LOGINS = Counter("portal_logins_total", "Successful portal logins.")
+LOGIN_FAILURES = Counter("portal_login_failures_total", "Login attempts with bad credentials.")
+TOKEN_MINTS = Counter("portal_token_mints_total", "Tokens handed out by /new_jwt.")
+TOKEN_ERRORS = Counter("portal_token_errors_total", "Failed /new_jwt requests.")
+DASHBOARD_OPENS = Counter("portal_dashboard_opens_total", "Dashboard opens per dashboard.",
+                          ("dashboard",))
+
+
+def _token_cache_stat(key: str) -> Callable[[], float]:
+    def read() -> float:
+        from auth import TOKEN_CACHE
+        return TOKEN_CACHE.stats()[key]
+    return read
+
+
+CallbackCounter("portal_jwt_cache_hits_total", "auth.TOKEN_CACHE hits.", _token_cache_stat("hits"))
+CallbackCounter("portal_jwt_cache_misses_total", "auth.TOKEN_CACHE misses (tokens signed).",
+                _token_cache_stat("misses"))
+
+
+def phase(fn: str, name: str):
+    """with phase("dashboard_page", "viz"): ... -> portal_phase_seconds{fn, phase}"""
+    return PHASES.time(fn, name)
+
+
+def timed(fn: str, name: str = "total"):
+    """Decorator form of phase()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PHASES.time(fn, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# -----------------------------------
+# Exposition
+# -----------------------------------
+def render(extra: Optional[Dict[str, List[str]]] = None) -> str:
+    """Prometheus text format; `extra` adds sample lines (e.g. workers') per family."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+        if extra:
+            lines.extend(extra.get(metric.name, ()))
+    return "\n".join(lines) + "\n"
+
+
+def relabel(text: str, worker: str) -> Dict[str, List[str]]:
+    """A worker's exposition -> {family: sample lines with worker="..." added}."""
+    families: Dict[str, List[str]] = {}
+    samples: Optional[List[str]] = None
+    label = f'worker="{_escape(worker)}"'
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            samples = families.setdefault(line.split()[2], [])
+        elif line and not line.startswith("#") and samples is not None:
+            name, brace, rest = line.partition("{")
+            if brace:
+                samples.append(f"{name}{{{label},{rest}")
+            else:
+                name, _, value = line.partition(" ")
+                samples.append(f"{name}{{{label}}} {value}")
+    return families
+
+
+async def _scrape(path: str) -> Optional[str]:
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path),
+                                                SCRAPE_TIMEOUT)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # the worker is gone (crashed or drained): drop its socket
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        data = await asyncio.wait_for(reader.read(), SCRAPE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return body.decode("utf-8") if head.startswith(b"HTTP/1.1 200") else None
+
+
+def handler(workers_dir: Optional[str] = None):
+    """GET /metrics handler; with `workers_dir`, worker sockets there are merged in."""
+    async def serve_metrics(request) -> Response:
+        extra: Dict[str, List[str]] = {}
+        if workers_dir and os.path.isdir(workers_dir):
+            names = sorted(n for n in os.listdir(workers_dir) if n.endswith(".sock"))
+            texts = await asyncio.gather(*(_scrape(os.path.join(workers_dir, n)) for n in names))
+            for name, text in zip(names, texts):
+                if text:
+                    for family, lines in relabel(text, name[:-5]).items():
+                        extra.setdefault(family, []).extend(lines)
+        return Response(render(extra), 200, CONTENT_TYPE, {"Cache-Control": "no-store"})
+    return serve_metrics
+
+
+def workers_dir(token_socket: str) -> str:
+    return token_socket + ".metrics"
+
+
+# -----------------------------------
+# launcher.py workers
+# -----------------------------------
+_worker_started = False
+_lock = threading.Lock()
+
+
+def serve_worker(token_socket: Optional[str]) -> None:
+    """Under launcher.py: serve this worker's /metrics next to the token socket (once)."""
+    global _worker_started
+    if not token_socket or not ENABLED or _worker_started:
+        return
+    with _lock:
+        if _worker_started:
+            return
+        _worker_started = True
+        directory = workers_dir(token_socket)
+        path = os.path.join(directory, f"{os.getpid()}.sock")
+        http = HTTPServer(cors_origin=None)
+        http.route("/metrics")(handler())
+        loop = asyncio.new_event_loop()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            loop.run_until_complete(http.start(unix_path=path))
+        except OSError as exc:
+            log.warning("worker metrics socket %s unavailable: %s", path, exc)
+            loop.close()
+            return
+        threading.Thread(target=loop.run_forever, name="metrics", daemon=True).start()
+
+        @atexit.register
+        def _remove() -> None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
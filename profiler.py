@@ -0,0 +1,348 @@
+# ================================
+# profiler.py
+# ================================
+#
+# On-demand sampling profiler for one slow rerun or request, switched on
+# by the portal admin only:
+#
+#   next main() rerun   sidebar "Profiler" -> "Profile next rerun" (or ?profile=1)
+#   next /new_jwt       sidebar button -> /profile/arm?target=new_jwt&t=<signed>
+#   one /view request   viewer.py /view?url=...&profile=<signed>
+#
+# Signed links are short-lived and single-use: the process they target
+# records each link's id once it has been honoured. The sidebar signs
+# them only when its buttons are clicked, so other reruns resend nothing.
+#
+# A sampler thread reads the profiled thread's stack every INTERVAL
+# seconds (sys._current_frames; the GIL switch interval is lowered to
+# match while it runs). Each profile is written to PROFILE_DIR as an
+# SVG flame graph and a call-tree text report. Every process writes
+# there: launcher workers, the token daemon and the viewer. The sidebar
+# lists the newest ones for download.
+#
+# Nothing runs unless armed: a rerun or request checks one flag.
+
+import contextlib
+import functools
+import html
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.environ.get("PORTAL_PROFILE_DIR", os.path.join(BASE_DIR, ".profiles"))
+INTERVAL = 0.0005           # seconds between samples
+MAX_PROFILES = 20           # oldest are deleted beyond this
+LINK_TTL = 900
+VIEWER_URL = os.environ.get("PORTAL_VIEWER_URL", "http://localhost:8502")
+
+SESSION_KEY = "profile_next_rerun"
+TARGETS = ("new_jwt",)      # armable over HTTP
+
+# request targets whose next request is profiled (checked per request)
+ARMED = set()
+_lock = threading.Lock()
+
+
+def arm(target: str) -> None:
+    with _lock:
+        ARMED.add(target)
+
+
+def take(target: str) -> bool:
+    """True once per arm(): the caller profiles this request."""
+    with _lock:
+        if target in ARMED:
+            ARMED.discard(target)
+            return True
+        return False
+
+
+# -----------------------------------
+# Sampler
+# -----------------------------------
+class Sampler:
+    """
+    Samples the calling thread's stack until exit. Stacks are cut at
+    `root` (default: the frame that enters the sampler), so they start at
+    the profiled function rather than at the thread's entry point.
+    """
+
+    def __init__(self, label: str, interval: float = INTERVAL, root=None):
+        self.label = label
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.seconds = 0.0
+        self.error: Optional[str] = None
+        self._thread_id = threading.get_ident()
+        self._root = root
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._switch = sys.getswitchinterval()
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            if frame is self._root:
+                break
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _run(self) -> None:
+        frames = sys._current_frames
+        while not self._stop.wait(self.interval):
+            frame = frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[self._stack(frame)] += 1
+                self.samples += 1
+
+    def __enter__(self) -> "Sampler":
+        if self._root is None:
+            self._root = sys._getframe(1)
+        sys.setswitchinterval(min(self._switch, self.interval))
+        self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.seconds = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        sys.setswitchinterval(self._switch)
+        self._root = None  # do not keep the frame (and its locals) alive
+        if exc_type is not None:
+            self.error = exc_type.__name__
+
+
+# -----------------------------------
+# Reports
+# -----------------------------------
+def _tree(stacks: Counter) -> Dict:
+    root = {"name": "all", "total": 0, "self": 0, "children": {}}
+    for stack, n in stacks.items():
+        node = root
+        node["total"] += n
+        for name in stack:
+            node = node["children"].setdefault(name, {"name": name, "total": 0, "self": 0,
+                                                      "children": {}})
+            node["total"] += n
+        node["self"] += n
+    return root
+
+
+def call_tree(sampler: Sampler, min_pct: float = 0.5) -> str:
+    """Indented call tree: total % / self % / est. ms per frame, heaviest first."""
+    root = _tree(sampler.stacks)
+    total = root["total"] or 1
+    ms_per_sample = sampler.seconds * 1000 / total
+    lines = [f"{sampler.label}: {sampler.seconds * 1000:.1f} ms, {sampler.samples} samples "
+             f"every {sampler.interval * 1000:g} ms"
+             + (f", ended with {sampler.error}" if sampler.error else ""),
+             "", f"{'total%':>7} {'self%':>6} {'ms':>8}  frame"]
+
+    def walk(node, depth):
+        for child in sorted(node["children"].values(), key=lambda c: -c["total"]):
+            pct = 100 * child["total"] / total
+            if pct < min_pct:
+                continue
+            lines.append(f"{pct:>6.1f}% {100 * child['self'] / total:>5.1f}% "
+                         f"{child['total'] * ms_per_sample:>8.1f}  {'  ' * depth}{child['name']}")
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines) + "\n"
+
+
+def flame_graph(sampler: Sampler, width: int = 1200, row: int = 17) -> str:
+    """Self-contained SVG flame graph (root at the bottom; hover for details)."""
+    root = _tree(sampler.stacks)
+    total = root["total"] or 1
+    rects: List[Tuple[float, int, float, Dict]] = []
+
+    def walk(node, x, depth):
+        rects.append((x, depth, node["total"] / total * width, node))
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            walk(child, x, depth + 1)
+            x += child["total"] / total * width
+
+    walk(root, 0.0, 0)
+    depth = max(d for _, d, _, _ in rects) + 1
+    height = depth * row + 40
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+           f'font-family="monospace" font-size="11">',
+           f'<text x="4" y="14">{html.escape(sampler.label)}: {sampler.seconds * 1000:.1f} ms, '
+           f'{sampler.samples} samples</text>']
+    for x, d, w, node in rects:
+        if w < 0.5:
+            continue
+        y = height - (d + 1) * row
+        hue = 20 + zlib.crc32(node["name"].encode()) % 40
+        title = (f'{node["name"]}: {100 * node["total"] / total:.1f}% '
+                 f'({node["total"]} samples, {node["self"]} self)')
+        label = node["name"][:int(w / 7)] if w > 21 else ""
+        out.append(f'<g><title>{html.escape(title)}</title>'
+                   f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                   f'fill="hsl({hue},85%,60%)" rx="2"/>'
+                   f'<text x="{x + 3:.1f}" y="{y + row - 5}">{html.escape(label)}</text></g>')
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def save(sampler: Sampler) -> str:
+    """Write <id>.svg + <id>.txt to PROFILE_DIR; returns the id."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = time.time()
+    profile_id = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+                  f"{int(now * 1000) % 1000:03d}-{sampler.label}-{os.getpid()}")
+    for ext, text in (("svg", flame_graph(sampler)), ("txt", call_tree(sampler))):
+        tmp = os.path.join(PROFILE_DIR, f"{profile_id}.{ext}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, os.path.join(PROFILE_DIR, f"{profile_id}.{ext}"))
+    for old in recent(limit=None)[MAX_PROFILES:]:
+        for ext in ("svg", "txt"):
+            try:
+                os.unlink(os.path.join(PROFILE_DIR, f"{old}.{ext}"))
+            except OSError:
+                pass
+    log.info("profile %s written (%d samples)", profile_id, sampler.samples)
+    return profile_id
+
+
+def recent(limit: Optional[int] = 5) -> List[str]:
+    """Newest profile ids first."""
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    ids = sorted((n[:-4] for n in names if n.endswith(".txt")), reverse=True)
+    return ids[:limit] if limit else ids
+
+
+def read(profile_id: str, ext: str) -> bytes:
+    with open(os.path.join(PROFILE_DIR, f"{os.path.basename(profile_id)}.{ext}"), "rb") as f:
+        return f.read()
+
+
+@contextlib.contextmanager
+def profile(label: str):
+    """with profile("main"): ... -> sample the block, then save() it."""
+    # frame 2: the function holding the `with` (1 is contextlib's __enter__)
+    sampler = Sampler(label, root=sys._getframe(2))
+    try:
+        with sampler:
+            yield sampler
+    finally:
+        try:
+            save(sampler)
+        except OSError:
+            log.exception("could not write profile")
+
+
+# -----------------------------------
+# Admin links (HMAC-signed, short-lived)
+# -----------------------------------
+_spent: Dict[str, int] = {}     # jti -> exp of grants already used in this process
+_spent_lock = threading.Lock()
+
+
+def grant() -> str:
+    """Signed token allowing one profiled request; give it to the admin only."""
+    from downloads import sign
+    return sign({"p": "profile", "j": secrets.token_hex(8), "exp": int(time.time()) + LINK_TTL})
+
+
+def allowed(token: Optional[str]) -> bool:
+    """True once per grant: its jti is spent (each link targets one service process)."""
+    from downloads import verify
+    try:
+        payload = verify(token) if token else {}
+    except (ValueError, KeyError):
+        return False
+    jti = payload.get("j")
+    if payload.get("p") != "profile" or not jti:
+        return False
+    now = time.time()
+    with _spent_lock:
+        for old in [j for j, exp in _spent.items() if exp < now]:
+            del _spent[old]
+        if jti in _spent:
+            return False
+        _spent[jti] = payload["exp"]
+    return True
+
+
+def arm_url(target: str) -> str:
+    """Token service link arming `target` (the service routes /profile/arm)."""
+    import token_server
+    token_server.ensure_started()
+    return f"{token_server.public_url()}/profile/arm?" + urlencode({"target": target,
+                                                                    "t": grant()})
+
+
+def view_url(dashboard_url: str, token_grant: str) -> str:
+    """viewer.py link rendering one /view under the profiler."""
+    return f"{VIEWER_URL}/view?" + urlencode({"url": dashboard_url, "t": token_grant,
+                                             "profile": grant()})
+
+
+async def serve_arm(request):
+    from async_http import NO_STORE, json_response
+    target = request.arg("target")
+    if target not in TARGETS:
+        return json_response({"error": f"target must be one of {', '.join(TARGETS)}"}, 400,
+                             NO_STORE)
+    if not allowed(request.arg("t")):
+        return json_response({"error": "invalid, expired or used profiler link"}, 403, NO_STORE)
+    arm(target)
+    return json_response({"armed": target, "pid": os.getpid(), "dir": PROFILE_DIR},
+                         headers=NO_STORE)
+
+
+def serve_on(http) -> None:
+    """Serve /profile/arm on an async_http server (once)."""
+    if ("GET", "/profile/arm") not in http.routes:
+        http.route("/profile/arm")(serve_arm)
+
+
+# -----------------------------------
+# Portal sidebar (admin only)
+# -----------------------------------
+def sidebar_panel(dashboard_url: str) -> None:
+    """Arm a rerun / request for profiling and download the newest results."""
+    import streamlit as st
+    import token_server
+
+    with st.expander("Profiler"):
+        if st.button("Profile next rerun", key="profile_rerun_btn"):
+            st.session_state[SESSION_KEY] = True
+            st.rerun()
+        if st.button("Profile next /new_jwt", key="profile_jwt_btn", use_container_width=True):
+            # as downloads.start: the frame fetches the link (and shows the answer)
+            st.components.v1.html(f"<!-- {time.time_ns()} --><script>location.href = "
+                                  f"{json.dumps(arm_url('new_jwt'))};</script>", height=60)
+        if st.button("Profile viewer /view", key="profile_view_btn", use_container_width=True):
+            viewer_link = view_url(dashboard_url, token_server.session_grant(st.session_state))
+            st.link_button("Open profiled /view", viewer_link, use_container_width=True)
+        for profile_id in recent():
+            st.caption(profile_id)
+            col1, col2 = st.columns(2)
+            col1.download_button("Flame graph", functools.partial(read, profile_id, "svg"),
+                                 f"{profile_id}.svg", "image/svg+xml", key=f"profile_svg_{profile_id}")
+            col2.download_button("Call tree", functools.partial(read, profile_id, "txt"),
+                                 f"{profile_id}.txt", "text/plain", key=f"profile_txt_{profile_id}")
@@ -0,0 +1,314 @@
+# ================================
+# rum.py
+# ================================
+#
+# Real-user monitoring of the embedded vizzes. The browser side
+# (tableau_viz/frontend/rum.js, used by the viz frame and viewer.py)
+# beacons batches of events to the token service:
+#
+#   POST /rum         {"events": [{"d": dashboard, "k": kind, "ms": 1234} | {..., "err": ...}]}
+#   GET  /rum/report  ?hours=24&by=dashboard|hour[&dashboard=NAME]
+#
+# and reports what the server never sees: embedding library load,
+# first interactive, token callback latency, in-place refresh, failures.
+#
+# Storage is a rolling set of small histograms, one per (hour,
+# dashboard, kind): log-spaced buckets (about 7% apart), so
+# p50/p95/p99 come from counts without keeping samples. Events are
+# merged in memory and written to SQLite every FLUSH_INTERVAL; hours
+# older than RETENTION_DAYS are dropped.
+#
+#   python rum.py                       # slowest dashboards, last 24 h
+#   python rum.py --by hour --hours 72  # per hour (all dashboards)
+#   python rum.py --by hour --dashboard "P&L Sheet"
+
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from async_http import NO_STORE, Response, json_response
+from config_store import get_config
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUM_DB = os.environ.get("PORTAL_RUM_DB", os.path.join(BASE_DIR, "rum.db"))
+ENABLED = os.environ.get("PORTAL_RUM", "1") != "0"
+RETENTION_DAYS = int(os.environ.get("PORTAL_RUM_RETENTION_DAYS", "30"))
+FLUSH_INTERVAL = 30.0
+
+ROUTE = "/rum"
+KINDS = ("script", "interactive", "token", "refresh")
+MAX_EVENTS = 200            # per beacon
+MAX_MS = 600_000
+
+# bucket i holds durations up to MIN_MS * RATIO**i; the last one is open
+MIN_MS = 10
+RATIO = 1.15
+N_BUCKETS = 1 + math.ceil(math.log(MAX_MS / MIN_MS, RATIO))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rum (
+    hour INTEGER NOT NULL,
+    dashboard TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    counts BLOB NOT NULL,
+    errors INTEGER NOT NULL,
+    PRIMARY KEY (hour, dashboard, kind)
+);
+"""
+
+
+def bucket(ms: float) -> int:
+    if ms <= MIN_MS:
+        return 0
+    return min(N_BUCKETS - 1, math.ceil(math.log(ms / MIN_MS, RATIO)))
+
+
+def bucket_ms(index: int) -> float:
+    """Representative (geometric middle) duration of bucket `index`."""
+    return MIN_MS * RATIO ** max(0, index - 0.5)
+
+
+def percentile(counts, pct: float) -> Optional[int]:
+    total = sum(counts)
+    if not total:
+        return None
+    rank = pct / 100 * total
+    seen = 0
+    for i, n in enumerate(counts):
+        seen += n
+        if seen >= rank:
+            return round(bucket_ms(i))
+    return round(bucket_ms(len(counts) - 1))
+
+
+def _new_counts() -> array:
+    return array("I", bytes(4 * N_BUCKETS))
+
+
+# -----------------------------------
+# Store
+# -----------------------------------
+class RumStore:
+    """In-memory pending histograms, merged into SQLite on flush()."""
+
+    def __init__(self, path: str = RUM_DB, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.accepted = 0
+        self.dropped = 0
+        self._pending: Dict[Tuple[int, str, str], list] = {}   # key -> [counts, errors]
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._flushed = time.monotonic()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def add(self, events: List[Dict], now: Optional[float] = None) -> int:
+        """Merge valid events; returns how many were kept."""
+        known = get_config().urls
+        hour = int((now or time.time()) // 3600)
+        kept = 0
+        with self._lock:
+            for event in events[:MAX_EVENTS]:
+                if not isinstance(event, dict):
+                    continue
+                name, kind, ms = event.get("d"), event.get("k"), event.get("ms")
+                if name not in known or kind not in KINDS:
+                    continue  # unknown names would grow the store without bound
+                failed = event.get("err") is not None
+                if not failed and not (isinstance(ms, (int, float)) and 0 <= ms <= MAX_MS):
+                    continue
+                slot = self._pending.get((hour, name, kind))
+                if slot is None:
+                    slot = self._pending[(hour, name, kind)] = [_new_counts(), 0]
+                if failed:
+                    slot[1] += 1
+                else:
+                    slot[0][bucket(ms)] += 1
+                kept += 1
+            self.accepted += kept
+            self.dropped += len(events) - kept
+            due = time.monotonic() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+        return kept
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        with self._db_lock:
+            conn = self._db()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for (hour, name, kind), (counts, errors) in pending.items():
+                    row = conn.execute(
+                        "SELECT counts, errors FROM rum WHERE hour = ? AND dashboard = ? AND kind = ?",
+                        (hour, name, kind)).fetchone()
+                    if row is not None:
+                        stored = array("I", row[0])
+                        counts = array("I", (a + b for a, b in zip(stored, counts)))
+                        errors += row[1]
+                    conn.execute("INSERT OR REPLACE INTO rum VALUES (?, ?, ?, ?, ?)",
+                                 (hour, name, kind, counts.tobytes(), errors))
+                cutoff = int(time.time() // 3600) - RETENTION_DAYS * 24
+                conn.execute("DELETE FROM rum WHERE hour < ?", (cutoff,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                log.exception("RUM flush failed; %d histograms lost", len(pending))
+
+    def report(self, hours: int = 24, by: str = "dashboard",
+               dashboard: Optional[str] = None) -> List[Dict]:
+        """
+        Percentiles per dashboard (highest first-interactive p95 first)
+        or per hour (oldest first) over the last `hours`.
+        """
+        self.flush()
+        since = int(time.time() // 3600) - hours + 1
+        sql = "SELECT hour, dashboard, kind, counts, errors FROM rum WHERE hour >= ?"
+        params: list = [since]
+        if dashboard:
+            sql += " AND dashboard = ?"
+            params.append(dashboard)
+        with self._db_lock:
+            rows = self._db().execute(sql, params).fetchall()
+
+        groups: Dict = {}
+        for hour, name, kind, blob, errors in rows:
+            group = groups.setdefault(name if by == "dashboard" else hour, {})
+            slot = group.setdefault(kind, [_new_counts(), 0])
+            for i, n in enumerate(array("I", blob)):
+                slot[0][i] += n
+            slot[1] += errors
+
+        report = []
+        for key in sorted(groups):
+            if by == "dashboard":
+                entry = {"dashboard": key}
+            else:
+                entry = {"hour": time.strftime("%Y-%m-%d %H:00", time.localtime(key * 3600))}
+            for kind, (counts, errors) in groups[key].items():
+                entry[kind] = {"n": sum(counts), "errors": errors,
+                               "p50_ms": percentile(counts, 50),
+                               "p95_ms": percentile(counts, 95),
+                               "p99_ms": percentile(counts, 99)}
+            report.append(entry)
+        if by == "dashboard":
+            report.sort(key=lambda e: -((e.get("interactive") or {}).get("p95_ms") or 0))
+        return report
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+_store: Optional[RumStore] = None
+_lock = threading.Lock()
+
+
+def get_store() -> RumStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = RumStore()
+                atexit.register(_store.flush)
+    return _store
+
+
+# -----------------------------------
+# HTTP
+# -----------------------------------
+async def collect(request) -> Response:
+    try:
+        events = json.loads(request.body or b"{}").get("events") or []
+        if not isinstance(events, list):
+            raise ValueError("events must be a list")
+    except (ValueError, AttributeError) as exc:
+        return json_response({"error": str(exc)}, 400, NO_STORE)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, get_store().add, events)
+    return Response(b"", 204, headers=NO_STORE)
+
+
+async def serve_report(request) -> Response:
+    try:
+        hours = max(1, min(int(request.arg("hours", "24")), RETENTION_DAYS * 24))
+    except ValueError:
+        return json_response({"error": "hours must be an integer"}, 400, NO_STORE)
+    by = "hour" if request.arg("by") == "hour" else "dashboard"
+    loop = asyncio.get_running_loop()
+    report = await loop.run_in_executor(None, get_store().report, hours, by,
+                                        request.arg("dashboard"))
+    return json_response({"hours": hours, "by": by, "rows": report}, headers=NO_STORE)
+
+
+def serve_on(http) -> None:
+    """Serve the collector and report on an async_http server (once)."""
+    if ("POST", ROUTE) not in http.routes:
+        http.route(ROUTE, methods=("POST",))(collect)
+        http.route(ROUTE + "/report")(serve_report)
+
+
+def collector_url() -> Optional[str]:
+    """Where browsers send beacons (None when RUM is off)."""
+    if not ENABLED:
+        return None
+    import token_server
+
+    service = token_server.ensure_started()
+    if service is not None:
+        serve_on(service.http)
+    return token_server.public_url() + ROUTE
+
+
+# -----------------------------------
+# CLI
+# -----------------------------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Viz load times reported by browsers")
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--by", choices=("dashboard", "hour"), default="dashboard")
+    parser.add_argument("--dashboard", help="only this dashboard")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    rows = RumStore().report(args.hours, args.by, args.dashboard)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+    print(f"{args.by:<32} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+          f"   {'token p95':>9} {'script p95':>10}")
+    for row in rows:
+        interactive = row.get("interactive") or {}
+        errors = sum(v["errors"] for k, v in row.items() if isinstance(v, dict))
+        print(f"{str(row[args.by])[:32]:<32} {interactive.get('n', 0):>5} "
+              f"{interactive.get('p50_ms') or '-':>8} {interactive.get('p95_ms') or '-':>8} "
+              f"{interactive.get('p99_ms') or '-':>8} {errors:>6}   "
+              f"{(row.get('token') or {}).get('p95_ms') or '-':>9} "
+              f"{(row.get('script') or {}).get('p95_ms') or '-':>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
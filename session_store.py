@@ -0,0 +1,656 @@
+# ================================
+# session_store.py
+# ================================
+#
+# Portal login state outside the Streamlit process, so a restart does not
+# log everyone out and several replicas can serve the same users without
+# sticky sessions. The session id travels in a browser cookie (COOKIE),
+# never in the page URL: it is a bearer credential. The cookie is HttpOnly,
+# so page scripts cannot read it: the token service sets it, on a one-time,
+# short-lived signed link (COOKIE_ROUTE) the page's frame navigates to.
+# Cookies are per host, not per port, so the token service must be reached
+# on the portal's host name (PORTAL_TOKEN_PUBLIC_URL behind a proxy).
+#
+#   PORTAL_SESSION_BACKEND=memory                   # per process (old behaviour)
+#   PORTAL_SESSION_BACKEND=sqlite:///path/to.db     # default: ./sessions.db
+#   PORTAL_SESSION_BACKEND=redis://host:6379/0      # any RESP server
+#
+# Records are stored as compact JSON with short keys and expire after
+# PORTAL_SESSION_TTL seconds (sliding: every load or save renews it).
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BACKEND = "sqlite:///" + os.path.join(BASE_DIR, "sessions.db")
+
+BACKEND_URL = os.environ.get("PORTAL_SESSION_BACKEND", DEFAULT_BACKEND)
+SESSION_TTL = int(os.environ.get("PORTAL_SESSION_TTL", str(8 * 3600)))
+COOKIE = os.environ.get("PORTAL_SESSION_COOKIE", "portal_sid")
+COOKIE_ROUTE = "/session/cookie"
+COOKIE_LINK_TTL = 60
+
+# field name -> stored key
+FIELDS = {"username": "u", "dashboard": "d", "logged_in_at": "t"}
+_NAMES = {short: name for name, short in FIELDS.items()}
+
+
+class SessionStoreError(RuntimeError):
+    """The backend could not be reached or answered with an error."""
+
+
+# What a backend may raise; callers degrade to per-process state on these.
+ERRORS = (OSError, sqlite3.Error, SessionStoreError)
+
+
+# -----------------------------------
+# Serialized form
+# -----------------------------------
+def encode(data: Dict) -> bytes:
+    record = {FIELDS[k]: v for k, v in data.items() if k in FIELDS and v is not None}
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def decode(raw: bytes) -> Dict:
+    return {_NAMES[k]: v for k, v in json.loads(raw).items() if k in _NAMES}
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+# -----------------------------------
+# Backends
+# -----------------------------------
+class SessionBackend:
+    """get/set/delete of raw records by session id, with expiry."""
+
+    def get(self, sid: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, sid: str, value: bytes, ttl: int) -> None:
+        raise NotImplementedError
+
+    def touch(self, sid: str, ttl: int) -> None:
+        """Restart the expiry of an existing record."""
+        raise NotImplementedError
+
+    def delete(self, sid: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBackend(SessionBackend):
+    """Per-process dict; sessions do not survive a restart or span replicas."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def get(self, sid: str) -> Optional[bytes]:
+        item = self._data.get(sid)
+        if item is None or item[0] <= time.time():
+            return None
+        return item[1]
+
+    def set(self, sid: str, value: bytes, ttl: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._data[sid] = (now + ttl, value)
+            if now >= self._next_purge:
+                self._next_purge = now + 60
+                for key in [k for k, (exp, _) in self._data.items() if exp <= now]:
+                    del self._data[key]
+
+    def touch(self, sid: str, ttl: int) -> None:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(sid)
+            if item is not None and item[0] > now:
+                self._data[sid] = (now + ttl, item[1])
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteBackend(SessionBackend):
+    """
+    One SQLite file (WAL) shared by every worker on the host.
+    Connections are per thread; expired rows are filtered on read and
+    purged at most once a minute.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._next_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires > ?", (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid: str, value: bytes, ttl: int) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+                     (sid, value, now + ttl))
+        if now >= self._next_purge:
+            self._next_purge = now + 60
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def touch(self, sid: str, ttl: int) -> None:
+        now = time.time()
+        self._connect().execute("UPDATE sessions SET expires = ? WHERE sid = ? AND expires > ?",
+                                (now + ttl, sid, now))
+
+    def delete(self, sid: str) -> None:
+        self._connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisBackend(SessionBackend):
+    """
+    Minimal RESP2 client (GET / SET EX / EXPIRE / DEL) with a small connection
+    pool. Works with Redis, Valkey, KeyDB or the local stand-in below.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, prefix: str = "portal:session:",
+                 pool_size: int = 8, timeout: float = 2.0):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._pool: "queue.LifoQueue" = queue.LifoQueue(pool_size)
+
+    # ---- protocol ----
+    @staticmethod
+    def _pack(*args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    @classmethod
+    def _read(cls, f):
+        line = f.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise SessionStoreError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = f.read(n + 2)
+            if len(data) != n + 2:
+                raise ConnectionError("connection closed by server")
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [cls._read(f) for _ in range(n)]
+        raise SessionStoreError(f"unexpected reply {line!r}")
+
+    # ---- connections ----
+    def _open(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._call(conn, "AUTH", self.password)
+        if self.db:
+            self._call(conn, "SELECT", self.db)
+        return conn
+
+    def _call(self, conn, *args):
+        conn[0].sendall(self._pack(*args))
+        return self._read(conn[1])
+
+    def execute(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+        try:
+            if conn is None:
+                conn = self._open()
+            reply = self._call(conn, *args)
+        except OSError as exc:
+            # includes ConnectionError/timeouts: drop the socket, surface one error
+            if conn is not None:
+                conn[0].close()
+            raise SessionStoreError(f"session backend {self.address[0]}:{self.address[1]}: {exc}") from exc
+        except SessionStoreError:
+            self._release(conn)
+            raise
+        self._release(conn)
+        return reply
+
+    def _release(self, conn) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    # ---- backend API ----
+    def get(self, sid: str) -> Optional[bytes]:
+        return self.execute("GET", self.prefix + sid)
+
+    def set(self, sid: str, value: bytes, ttl: int) -> None:
+        self.execute("SET", self.prefix + sid, value, "EX", ttl)
+
+    def touch(self, sid: str, ttl: int) -> None:
+        self.execute("EXPIRE", self.prefix + sid, ttl)
+
+    def delete(self, sid: str) -> None:
+        self.execute("DEL", self.prefix + sid)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait()[0].close()
+            except queue.Empty:
+                return
+
+
+def backend_from_url(url: str) -> SessionBackend:
+    """memory:// | sqlite:///path | redis://[:password@]host[:port][/db]"""
+    parts = urlsplit(url)
+    if parts.scheme in ("", "memory"):
+        return MemoryBackend()
+    if parts.scheme == "sqlite":
+        return SQLiteBackend(unquote(parts.path) or DEFAULT_BACKEND[len("sqlite:///"):])
+    if parts.scheme == "redis":
+        db = parts.path.strip("/")
+        return RedisBackend(parts.hostname or "127.0.0.1", parts.port or 6379,
+                            int(db) if db else 0,
+                            unquote(parts.password) if parts.password else None)
+    raise ValueError(f"unknown session backend {url!r}")
+
+
+# -----------------------------------
+# Store
+# -----------------------------------
+class SessionStore:
+    """Typed session records (see FIELDS) on top of a backend."""
+
+    def __init__(self, backend: SessionBackend, ttl_seconds: int = SESSION_TTL):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, sid: Optional[str]) -> Optional[Dict]:
+        """The record, or None if there is none; raises ERRORS when the backend fails."""
+        if not sid:
+            return None
+        raw = self.backend.get(sid)
+        if not raw:
+            return None
+        self.backend.touch(sid, self.ttl_seconds)  # sliding expiry: reads renew it too
+        return decode(raw)
+
+    def save(self, sid: str, data: Dict) -> None:
+        self.backend.set(sid, encode(data), self.ttl_seconds)
+
+    def create(self, username: str, **fields) -> str:
+        sid = new_session_id()
+        self.save(sid, dict(fields, username=username, logged_in_at=int(time.time())))
+        return sid
+
+    def update(self, sid: str, **fields) -> None:
+        data = self.load(sid)
+        if data is not None:
+            data.update(fields)
+            self.save(sid, data)
+
+    def delete(self, sid: Optional[str]) -> None:
+        if sid:
+            self.backend.delete(sid)
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+_store: Optional[SessionStore] = None
+_lock = threading.Lock()
+
+
+def get_store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = SessionStore(backend_from_url(BACKEND_URL))
+    return _store
+
+
+# -----------------------------------
+# Streamlit pages
+# -----------------------------------
+# Login state of the running Streamlit session (st.session_state), kept in
+# the store under the id in the browser's COOKIE.
+def safe_call(method: str, *args, **kwargs):
+    """A store call; an outage degrades to per-process sessions (None), never to a failed page."""
+    try:
+        return getattr(get_store(), method)(*args, **kwargs)
+    except ERRORS:
+        log.exception("session store %s failed", method)
+        return None
+
+
+def restore_session() -> None:
+    """Pick up a stored login (cookie) after a reload, a restart or on another replica."""
+    import streamlit as st
+    from config_store import get_config
+
+    state = st.session_state
+    sid = st.context.cookies.get(COOKIE)
+    if not sid or state.get("logged_in") or sid == state.get("ended_sid"):
+        return
+    try:
+        data = get_store().load(sid)
+    except ERRORS:
+        log.exception("session store load failed")  # keep the cookie; a later run retries
+        return
+    if data is None:
+        # expired or logged out: only now is the cookie dropped
+        state["ended_sid"] = sid
+        state["session_cookie"] = None
+        return
+    state["logged_in"] = True
+    state["username"] = data.get("username")
+    state["session_id"] = sid
+    if data.get("dashboard") in get_config().urls:
+        state["dashboard_selector"] = data["dashboard"]
+
+
+def start_session(username: str) -> None:
+    import streamlit as st
+
+    st.session_state["logged_in"] = True
+    st.session_state["username"] = username
+    sid = safe_call("create", username)
+    if sid:
+        st.session_state["session_id"] = sid
+        st.session_state["session_cookie"] = sid
+
+
+def end_session() -> None:
+    import streamlit as st
+
+    sid = st.session_state.get("session_id")
+    safe_call("delete", sid)
+    st.session_state.clear()
+    # this connection still presents the old cookie until a reload
+    st.session_state["ended_sid"] = st.context.cookies.get(COOKIE) or sid
+    st.session_state["session_cookie"] = None
+
+
+def write_cookie() -> None:
+    """Set (or clear) the cookie through the token service, once per change."""
+    import streamlit as st
+
+    if "session_cookie" in st.session_state:
+        href = cookie_url(st.session_state.pop("session_cookie"), st.context.headers.get("host"))
+        # as downloads.start: the frame navigates itself; the 204 only sets the cookie
+        st.components.v1.html(f"<!-- {time.time_ns()} --><script>location.href = "
+                              f"{json.dumps(href)};</script>", height=0)
+
+
+# -----------------------------------
+# Cookie links (token service)
+# -----------------------------------
+_spent: Dict[str, int] = {}     # jti -> exp of links already used in this process
+_spent_lock = threading.Lock()
+
+
+def cookie_url(sid: Optional[str], page_host: Optional[str] = None) -> str:
+    """One-time link setting COOKIE to `sid` (clearing it for None)."""
+    import token_server
+    from downloads import sign
+    from launcher import is_loopback
+
+    base = token_server.public_url()
+    parts = urlsplit(base)
+    page_name = (page_host or "").rsplit(":", 1)[0].strip("[]")
+    if not token_server.PUBLIC_URL and is_loopback(parts.hostname or "") and is_loopback(page_name):
+        # the local service binds 127.0.0.1; the page may be on "localhost"
+        host = f"[{page_name}]" if ":" in page_name else page_name
+        base = parts._replace(netloc=f"{host}:{parts.port}").geturl()
+    token = sign({"p": "sid", "s": sid or "", "j": secrets.token_hex(8),
+                  "exp": int(time.time()) + COOKIE_LINK_TTL})
+    return f"{base}{COOKIE_ROUTE}?t={token}"
+
+
+def _spend(token: str) -> Optional[Dict]:
+    """The link's payload, once; None if invalid, expired or already used."""
+    from downloads import verify
+    try:
+        payload = verify(token) if token else {}
+    except (ValueError, KeyError):
+        return None
+    jti = payload.get("j")
+    if payload.get("p") != "sid" or not jti:
+        return None
+    now = time.time()
+    with _spent_lock:
+        for old in [j for j, exp in _spent.items() if exp < now]:
+            del _spent[old]
+        if jti in _spent:
+            return None
+        _spent[jti] = payload["exp"]
+    return payload
+
+
+async def serve_cookie(request):
+    from async_http import NO_STORE, Response, json_response
+    import token_server
+
+    payload = _spend(request.arg("t", ""))
+    if payload is None:
+        return json_response({"error": "invalid, expired or used link"}, 403, NO_STORE)
+    sid = payload["s"]
+    # a browser-session cookie: the store's TTL decides how long it is good
+    cookie = f"{COOKIE}={sid}" if sid else f"{COOKIE}=; Max-Age=0"
+    cookie += "; Path=/; HttpOnly; SameSite=Strict"
+    if token_server.public_url().startswith("https:"):
+        cookie += "; Secure"
+    return Response(b"", 204, headers={**NO_STORE, "Set-Cookie": cookie})
+
+
+def serve_on(http) -> None:
+    """Serve COOKIE_ROUTE on an async_http server (once)."""
+    if ("GET", COOKIE_ROUTE) not in http.routes:
+        http.route(COOKIE_ROUTE)(serve_cookie)
+
+
+# -----------------------------------
+# Local RESP stand-in
+# -----------------------------------
+class RespStandIn:
+    """
+    In-process RESP server (PING, GET, SET [EX|PX], DEL, EXPIRE, TTL) for
+    exercising RedisBackend without a Redis install. Not for production.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.data: Dict[bytes, Tuple[Optional[float], bytes]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._writers = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[0] is not None and item[0] <= time.monotonic():
+            del self.data[key]
+            return None
+        return item[1]
+
+    def command(self, args: List[bytes]) -> bytes:
+        name = args[0].upper()
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            value = self._live(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            expires = None
+            opts = [a.upper() for a in args[3:]]
+            if b"EX" in opts:
+                expires = time.monotonic() + int(args[3 + opts.index(b"EX") + 1])
+            elif b"PX" in opts:
+                expires = time.monotonic() + int(args[3 + opts.index(b"PX") + 1]) / 1000
+            self.data[args[1]] = (expires, args[2])
+            return b"+OK\r\n"
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.data.pop(k, None) is not None for k in args[1:])
+        if name == b"EXPIRE":
+            value = self._live(args[1])
+            if value is None:
+                return b":0\r\n"
+            self.data[args[1]] = (time.monotonic() + int(args[2]), value)
+            return b":1\r\n"
+        if name == b"TTL":
+            if self._live(args[1]) is None:
+                return b":-2\r\n"
+            expires = self.data[args[1]][0]
+            return b":%d\r\n" % (-1 if expires is None else round(expires - time.monotonic()))
+        return b"-ERR unknown command '%s'\r\n" % name.decode("latin-1", "replace").encode()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    writer.write(b"-ERR inline commands are not supported\r\n")
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self.command(args))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def start(self) -> "RespStandIn":
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            self._loop = loop
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._serve, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="resp-stand-in", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def _close(self) -> None:
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        await asyncio.sleep(0)  # let the connection handlers finish
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(5)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+            self._loop = None
+
+
+if __name__ == "__main__":
+    # Round-trip every backend (Redis through the local stand-in) and time it.
+    import tempfile
+
+    stand_in = RespStandIn().start()
+    tmp = tempfile.mkdtemp()
+    for url in ("memory://", f"sqlite:///{tmp}/sessions.db", stand_in.url):
+        store = SessionStore(backend_from_url(url), ttl_seconds=2)
+        sid = store.create("someone@example.com", dashboard="Balance Sheet")
+        store.update(sid, dashboard="P&L Sheet")
+        assert store.load(sid)["dashboard"] == "P&L Sheet"
+
+        n = 2000
+        start = time.perf_counter()
+        for _ in range(n):
+            store.load(sid)
+        per_op = (time.perf_counter() - start) / n * 1e6
+
+        record = store.backend.get(sid)
+        store.delete(sid)
+        assert store.load(sid) is None
+        print(f"{url.split(':')[0]:<8} {len(record):>3} B/record  {per_op:7.1f} us/load")
+        store.backend.close()
+    stand_in.stop()
@@ -0,0 +1,312 @@
+# ================================
+# snapshots.py
+# ================================
+#
+# Disk-backed LRU of view snapshots: a standard-resolution REST "Query
+# View Image" render, kept only as a WebP preview (PREVIEW_WIDTH) plus a
+# small thumbnail. They give the page something to show before a live
+# viz is interactive, and a "stale as of" fallback when the Tableau host
+# cannot be reached.
+#
+# Lookups never wait on Tableau: a missing or expired (TTL) snapshot, and
+# the view id of a dashboard that has none in dashboards.json or the
+# catalog (TableauClient.view_id_for), are fetched on a background thread
+# and the caller gets whatever is cached now. Total size is bounded;
+# least recently used files are evicted.
+# Files are content-hashed and served with immutable caching from the
+# token service (/snapshots/...).
+
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+import token_server
+from assets import IMMUTABLE, content_hash, write_atomic
+from async_http import Response
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.environ.get("PORTAL_SNAPSHOT_DIR", os.path.join(BASE_DIR, ".snapshots"))
+SNAPSHOT_TTL = int(os.environ.get("PORTAL_SNAPSHOT_TTL", "3600"))
+SNAPSHOT_MAX_MB = float(os.environ.get("PORTAL_SNAPSHOT_MAX_MB", "200"))
+
+ROUTE = "/snapshots/"
+THUMB_WIDTH = 240
+PREVIEW_WIDTH = 1280       # placeholder under the viz; never upscaled
+RETRY_AFTER = 300          # seconds before re-trying a view whose fetch failed
+TOUCH_EVERY = 60           # used_at is written at most this often per entry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    view_id TEXT PRIMARY KEY,
+    image TEXT NOT NULL,
+    thumb TEXT,
+    bytes INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_used ON snapshots (used_at);
+"""
+
+
+def make_thumbnail(png: bytes, width: int = THUMB_WIDTH, quality: int = 70) -> bytes:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(png)) as im:
+        im = im.convert("RGB")
+        width = min(width, im.width)
+        height = max(1, round(im.height * width / im.width))
+        buf = io.BytesIO()
+        im.resize((width, height), Image.LANCZOS).save(buf, "WEBP", quality=quality, method=4)
+    return buf.getvalue()
+
+
+class SnapshotCache:
+    """Shared by every worker on the host (files + a SQLite index in `root`)."""
+
+    def __init__(self, root: str = SNAPSHOT_DIR, ttl_seconds: int = SNAPSHOT_TTL,
+                 max_bytes: int = int(SNAPSHOT_MAX_MB * 1024 * 1024), fetch=None,
+                 lookup=None, workers: int = 2):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._fetch = fetch          # view_id -> PNG bytes (default: REST client)
+        self._lookup = lookup        # view URL -> view_id (default: REST client)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed: Dict[str, float] = {}
+        self._view_ids: Dict[str, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot")
+        self.fetches = 0
+        self.fetch_errors = 0
+        os.makedirs(root, exist_ok=True)
+        self._db().executescript(SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=5.0,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- lookups ----
+    def get_many(self, view_ids: Iterable[Optional[str]]) -> Dict[str, Dict]:
+        """
+        {view_id: {"image", "thumb", "fetched_at", "stale"}} for cached views.
+        Missing or expired ones are queued for a background fetch.
+        """
+        ids = [v for v in dict.fromkeys(view_ids) if v]
+        if not ids:
+            return {}
+        now = time.time()
+        rows = self._db().execute(
+            f"SELECT view_id, image, thumb, fetched_at, used_at FROM snapshots "
+            f"WHERE view_id IN ({','.join('?' * len(ids))})", ids).fetchall()
+
+        found, touch = {}, []
+        for view_id, image, thumb, fetched_at, used_at in rows:
+            stale = now - fetched_at > self.ttl_seconds
+            found[view_id] = {"image": image, "thumb": thumb, "fetched_at": fetched_at,
+                              "stale": stale}
+            if now - used_at > TOUCH_EVERY:
+                touch.append((now, view_id))
+        if touch:
+            self._db().executemany("UPDATE snapshots SET used_at = ? WHERE view_id = ?", touch)
+        for view_id in ids:
+            if view_id not in found or found[view_id]["stale"]:
+                self.refresh(view_id)
+        return found
+
+    def get(self, view_id: Optional[str]) -> Optional[Dict]:
+        return self.get_many([view_id]).get(view_id)
+
+    def view_id(self, url: str) -> Optional[str]:
+        """The view id behind `url` once resolved; until then None (lookup queued)."""
+        view_id = self._view_ids.get(url)
+        if view_id is None:
+            self._submit(url, self._resolve)
+        return view_id
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # ---- fetching ----
+    def refresh(self, view_id: str) -> None:
+        """Queue a background fetch (deduplicated, backed off after failures)."""
+        self._submit(view_id, self._refresh)
+
+    def _submit(self, key: str, job) -> None:
+        with self._lock:
+            if key in self._pending or time.time() < self._failed.get(key, 0):
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, key, job)
+
+    def _run(self, key: str, job) -> None:
+        try:
+            job(key)
+            self._failed.pop(key, None)
+        except Exception as exc:
+            self.fetch_errors += 1
+            self._failed[key] = time.time() + RETRY_AFTER
+            log.warning("snapshot job for %s failed: %s", key, exc)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _refresh(self, view_id: str) -> None:
+        self.store(view_id, self._fetch_png(view_id))
+
+    def _resolve(self, url: str) -> None:
+        if self._lookup is not None:
+            self._view_ids[url] = self._lookup(url)
+            return
+        from tableau_client import get_client
+        self._view_ids[url] = get_client().view_id_for(url)
+
+    def _fetch_png(self, view_id: str) -> bytes:
+        self.fetches += 1
+        if self._fetch is not None:
+            return self._fetch(view_id)
+        from tableau_client import get_client
+        # standard resolution: it is only ever shown downscaled
+        return get_client().view_image(view_id, resolution=None)
+
+    def _write(self, name: str, data: bytes) -> None:
+        path = self.path(name)
+        if not os.path.isfile(path):
+            # workers share SNAPSHOT_DIR and may store the same preview at once
+            write_atomic(path, data)
+
+    def store(self, view_id: str, png: bytes) -> None:
+        # the render itself is not kept: only the preview is ever served
+        image_data = make_thumbnail(png, PREVIEW_WIDTH, quality=60)
+        image = f"{view_id}.{content_hash(image_data)}.webp"
+        thumb_data = make_thumbnail(png)
+        thumb = f"{view_id}.{content_hash(thumb_data)}.thumb.webp"
+        self._write(image, image_data)
+        self._write(thumb, thumb_data)
+
+        now = time.time()
+        db = self._db()
+        old = db.execute("SELECT image, thumb FROM snapshots WHERE view_id = ?", (view_id,)).fetchone()
+        db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                   (view_id, image, thumb, len(image_data) + len(thumb_data), now, now))
+        if old:
+            self._unlink(*(f for f in old if f not in (image, thumb)))
+        self.evict()
+
+    # ---- eviction ----
+    def _unlink(self, *names: str) -> None:
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> int:
+        """Drop least recently used snapshots until the total fits max_bytes."""
+        db = self._db()
+        total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM snapshots").fetchone()[0]
+        evicted = 0
+        if total <= self.max_bytes:
+            return 0
+        for view_id, image, thumb, size in db.execute(
+                "SELECT view_id, image, thumb, bytes FROM snapshots ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM snapshots WHERE view_id = ?", (view_id,))
+            self._unlink(image, thumb)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def stats(self) -> Dict:
+        count, total = self._db().execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM snapshots").fetchone()
+        return {"entries": count, "bytes": total, "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors, "pending": len(self._pending)}
+
+
+# -----------------------------------
+# Serving
+# -----------------------------------
+async def serve_snapshot(request) -> Response:
+    name = request.path[len(ROUTE):]
+    if "/" in name or name.startswith(".") or not name.endswith((".png", ".webp")):
+        return Response(b"not found", 404)
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, name), "rb") as f:
+            body = f.read()
+    except OSError:
+        return Response(b"not found", 404)
+    ctype = "image/png" if name.endswith(".png") else "image/webp"
+    return Response(body, 200, ctype, {"Cache-Control": IMMUTABLE})
+
+
+def serve_on(http) -> None:
+    """Serve SNAPSHOT_DIR under ROUTE on an async_http server (once)."""
+    if not any(prefix == ROUTE for _, prefix, _ in http.prefix_routes):
+        http.route_prefix(ROUTE)(serve_snapshot)
+
+
+def url_for(name: str) -> str:
+    service = token_server.ensure_started()
+    if service is not None:
+        serve_on(service.http)
+    return f"{token_server.public_url()}{ROUTE}{name}"
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+_cache: Optional[SnapshotCache] = None
+_init_lock = threading.Lock()
+
+
+def get_cache() -> SnapshotCache:
+    global _cache
+    if _cache is None:
+        with _init_lock:
+            if _cache is None:
+                _cache = SnapshotCache()
+    return _cache
+
+
+# Page helpers: a broken or unwritable cache only costs the images.
+ERRORS = (OSError, sqlite3.Error)
+
+
+def thumbnail_urls(view_ids: Dict[str, Optional[str]], urls: Dict[str, str]) -> Dict[str, str]:
+    """{dashboard name: thumbnail URL} for the dashboards that have one cached."""
+    try:
+        cache = get_cache()
+        view_ids = {name: v or cache.view_id(urls[name]) for name, v in view_ids.items()}
+        found = cache.get_many(view_ids.values())
+    except ERRORS as exc:
+        log.warning("snapshot cache unavailable: %s", exc)
+        return {}
+    return {name: url_for(found[v]["thumb"]) for name, v in view_ids.items()
+            if v in found and found[v]["thumb"]}
+
+
+def placeholder(view_id: Optional[str], url: str) -> Optional[Dict]:
+    """{"url", "fetched_at"} of the view's last snapshot (preview), if any."""
+    try:
+        cache = get_cache()
+        snap = cache.get(view_id or cache.view_id(url))
+    except ERRORS as exc:
+        log.warning("snapshot cache unavailable: %s", exc)
+        return None
+    if snap is None:
+        return None
+    return {"url": url_for(snap["image"]), "fetched_at": snap["fetched_at"]}
@@ -1,92 +1,45 @@
 # frontend/streamlit_app.py
 import os
-import threading
-import time
-import json
 import html
 from typing import Dict
 
 import streamlit as st
 from auth import generate_tableau_jwt, load_secrets, authenticate_user
+from config_store import get_config
+import assets
+import token_server
 # load_dashboards helper will read dashboards.json
 BASE = os.path.dirname(__file__)
 DASH_FILE = os.path.join(BASE, "dashboards.json")
 
 
 # --------------------------
-# Small Flask token provider
+# Token provider
 # --------------------------
 def start_token_server(host="127.0.0.1", port=5001):
     """
-    Start a tiny Flask server that returns a fresh JWT at /new_jwt.
-    Runs in background thread.
+    Return the URL of the process-wide async token service (/new_jwt),
+    starting it on first use. Safe to call from every session: it no
+    longer spawns a server thread per session.
     """
-    try:
-        from flask import Flask, jsonify, make_response
-        from flask_cors import CORS
-    except Exception as e:
-        raise RuntimeError("Flask and flask-cors are required. pip install flask flask-cors") from e
-
-    app = Flask("token_provider")
-    CORS(app, resources={r"/new_jwt": {"origins": "*"}})
-
-    @app.route("/new_jwt")
-    def new_jwt():
-        """
-        Returns JSON: { "token": "<jwt>" }
-        """
-        try:
-            token = generate_tableau_jwt()
-            resp = make_response(jsonify({"token": token}), 200)
-            # allow local fetch from streamlit UI
-            resp.headers["Cache-Control"] = "no-store"
-            return resp
-        except Exception as exc:
-            resp = make_response(jsonify({"error": str(exc)}), 500)
-            return resp
-
-    # Run Flask in a background thread (daemon)
-    def run():
-        # suppress flask startup messages if you want
-        import logging
-        log = logging.getLogger('werkzeug')
-        log.setLevel(logging.ERROR)
-        app.run(host=host, port=port, threaded=True)
-
-    t = threading.Thread(target=run, daemon=True)
-    t.start()
-    # give server a moment
-    time.sleep(0.6)
-    return f"http://{host}:{port}"
+    return token_server.public_url()
 
 
 # --------------------------
 # Dashboard loader
 # --------------------------
 def load_dashboards():
-    if not os.path.isfile(DASH_FILE):
-        return []
-    with open(DASH_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if isinstance(data, dict):
-        # support mapping form: { "Executive Summary": "url", ... }
-        return [{"name": n, "url": u} for n, u in data.items()]
-    if isinstance(data, list):
-        return data
-    return []
+    # parsed once per process by config_store (list or mapping form)
+    return get_config().dashboards
 
 
 # --------------------------
 # Embedding with auto-refresh token
 # --------------------------
 def embed_tableau_auto_refresh(view_url: str, token_server_url: str, height: int = 900):
-    secrets = load_secrets()
-    host = secrets.get("host")
-    module = f"{host}/javascripts/api/tableau.embedding.3.latest.min.js"
-
     html_code = f"""
-    <!-- Load Tableau embedding v3 library -->
-    <script type="module" src="{module}"></script>
+    <!-- Load Tableau embedding v3 library (pinned + SRI when vendored) -->
+    {assets.tableau_script_tag()}
 
     <div id="viz_container" style="width:100%; height:{height}px;"></div>
 
@@ -263,7 +216,7 @@ def main():
             token_server_url = start_token_server(host="127.0.0.1", port=5001)
             st.session_state["token_server_url"] = token_server_url
         except Exception as e:
-            st.error("Failed to start token server. Please install flask and flask-cors.")
+            st.error("Failed to start token server.")
             st.error(str(e))
             return
 
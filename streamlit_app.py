@@ -1,69 +1,57 @@
 import streamlit as st
-import json
-import time
-import jwt
 import os
 import base64
 
+import assets
+import downloads
+import metrics
+import profiler
+import rum
+import session_store
+import snapshots
+import token_server
+import warmer
+from auth import TOKEN_CACHE
+from config_store import get_config
+from tableau_viz import tableau_viz
+
 # ======================================================
 # CONFIG
 # ======================================================
 st.set_page_config(page_title="Client Dashboard Portal", layout="wide")
 
-SECRETS_FILE = "secrets.json"
-DASHBOARDS_FILE = "dashboards.json"
+# Warm viz pool: hidden vizzes kept alive for instant switching back
+VIZ_POOL_SIZE = int(os.environ.get("PORTAL_VIZ_POOL_SIZE", "3"))
+
+# Resize/re-encode the landing image once per process, off the request path
+assets.prebuild()
+
+# Under launcher.py this worker's /metrics is merged into the daemon's.
+metrics.serve_worker(token_server.SOCKET)
+
+# Login state lives in session_store (shared by replicas, survives restarts);
+# a browser cookie (session_store.COOKIE) carries the session id.
 
 
 # ======================================================
 # HELPERS
 # ======================================================
-def load_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
 def safe_b64(path):
     if not os.path.exists(path):
         return ""
     return base64.b64encode(open(path, "rb").read()).decode()
 
 
-# ======================================================
-# LOAD LOGIN + TABLEAU USER
-# ======================================================
-secrets_cache = load_json(SECRETS_FILE)
-
-STREAMLIT_USERNAME = secrets_cache.get("admin_user")
-STREAMLIT_PASSWORD = secrets_cache.get("admin_password")
-TABLEAU_USER = secrets_cache.get("tableau_user")
-
-
 # ======================================================
 # JWT GENERATOR
 # ======================================================
 def generate_tableau_jwt(secrets, tableau_user_email, expiry=None):
-    now = int(time.time())
-
     if expiry is None:
         expiry = 7200  # 2 hours
 
-    payload = {
-        "iss": secrets["client_id"],
-        "sub": tableau_user_email,
-        "aud": "tableau",
-        "jti": str(now),
-        "exp": now + expiry,
-        "site": {"id": secrets["site_id"]},
-        "scp": ["tableau:views:embed"],
-    }
-
-    headers = {"kid": secrets["secret_id"]}
-    secret = secrets["secret_value"].strip()
-
-    token = jwt.encode(payload, secret, algorithm="HS256", headers=headers)
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
-    return token
+    # Shared process-wide cache: reruns reuse the same token until it is
+    # renewed in the background, and every signed token gets a unique jti.
+    return TOKEN_CACHE.get(tableau_user_email, expiry, secrets=secrets)
 
 
 # ======================================================
@@ -74,160 +62,213 @@ def build_iframe_url(view_url, token):
     return f"{view_url}{delim}:embed=y&:showVizHome=n&:toolbar=n&:api_token={token}"
 
 
+# ======================================================
+# DASHBOARD FRAGMENTS
+# ======================================================
+# Each part of the dashboard reruns on its own: an interaction re-executes
+# (and resends) only its fragment. Fragment reruns reuse the arguments of
+# the last full run, so the selection is read from session state instead.
+def selected_dashboard(cfg):
+    name = st.session_state.get("dashboard_selector")
+    return name if name in cfg.urls else cfg.names[0]
+
+
+def refresh_viz():
+    # a new nonce makes the mounted viz reload its data in place
+    st.session_state["viz_nonce"] = st.session_state.get("viz_nonce", 0) + 1
+    st.rerun("viz")
+
+
+def show_selected():
+    sid = st.session_state.get("session_id")
+    if sid:
+        session_store.safe_call("update", sid, dashboard=st.session_state["dashboard_selector"])
+    # a new selection reruns the header + viz, not the sidebar or the page
+    st.rerun(["header", "viz"])
+
+
+@st.fragment(key="sidebar")
+@metrics.timed("dashboard_page", "sidebar")
+def sidebar_fragment():
+    cfg = get_config()
+    st.title("Dashboards")
+
+    # cached snapshot thumbnails as option captions (missing ones are
+    # fetched in the background and appear on a later run)
+    with metrics.phase("dashboard_page", "sidebar.thumbnails"):
+        thumbs = snapshots.thumbnail_urls(cfg.view_ids, cfg.urls)
+    st.radio("Select dashboard", cfg.names, key="dashboard_selector",
+             on_change=show_selected,
+             captions=[f"![]({thumbs[n]})" if n in thumbs else None for n in cfg.names]
+             if thumbs else None)
+
+    st.markdown("---")
+    st.write("Logged in as:")
+    st.write(f"**{st.session_state.get('username')}**")
+
+    if st.button("Logout", key="logout_btn"):
+        session_store.end_session()
+        st.rerun()
+
+    if is_admin():
+        profiler.sidebar_panel(cfg.urls[selected_dashboard(cfg)])
+
+
+@st.fragment(key="header")
+@metrics.timed("dashboard_page", "header")
+def header_fragment():
+    cfg = get_config()
+    name = selected_dashboard(cfg)
+    col1, col2, col3 = st.columns([7, 2, 2])
+    with col1:
+        st.header(name)
+    with col2:
+        st.button("🔄 Refresh", key="refresh_btn", use_container_width=True,
+                  on_click=refresh_viz)
+    with col3:
+        # streamed by the token service straight from Tableau; the link is
+        # signed on click, so it is fresh and the markup stays the same
+        with st.popover("⬇ Download data", use_container_width=True):
+            filters = st.text_area("Filters (optional)", key="download_filters",
+                                   placeholder="Field=value, one per line")
+            gzip = st.checkbox("Compress in transit (gzip)", value=True, key="download_gzip")
+            if st.button("Download CSV", key="download_btn", use_container_width=True):
+                with metrics.phase("dashboard_page", "header.download_link"):
+                    downloads.start(name, cfg.urls[name], cfg.view_ids.get(name),
+                                    downloads.parse_filters(filters), gzip)
+
+
+@st.fragment(key="viz")
+@metrics.timed("dashboard_page", "viz")
+def viz_fragment():
+    # One frame, no token in the args: the viz stays mounted across reruns,
+    # recent dashboards stay warm in the pool, and tokens are renewed via the
+    # viz token callback. Reports from the frame rerun only this fragment.
+    cfg = get_config()
+    name = selected_dashboard(cfg)
+    if st.session_state.get("opened_dashboard") != name:
+        # open counts decide what warmer.py pre-loads first
+        st.session_state["opened_dashboard"] = name
+        metrics.DASHBOARD_OPENS.inc(name)
+        warmer.record_open(name)
+    lib = assets.tableau_embedding()
+    with metrics.phase("dashboard_page", "viz.snapshot"):
+        snap = snapshots.placeholder(cfg.view_ids.get(name), cfg.urls[name]) or {}
+    with metrics.phase("dashboard_page", "viz.render"):
+        state = tableau_viz(
+            name,
+            cfg.urls[name],
+            token_server.token_url(st.session_state),
+            script_url=lib["url"],
+            script_integrity=lib["integrity"],
+            css_url=assets.bundle_url("viz"),
+            pool_size=VIZ_POOL_SIZE,
+            height=1200,  # old stable component height
+            nonce=st.session_state.get("viz_nonce", 0),
+            refresh_interval=cfg.refresh_intervals.get(name),  # optional, dashboards.json
+            placeholder_url=snap.get("url"),  # last snapshot until the viz is interactive
+            placeholder_time=snap.get("fetched_at"),
+            rum_url=rum.collector_url(),  # browser-side load timings
+        )
+    if state:
+        st.session_state["viz_state"] = state
+
+
+@st.fragment(key="footer")
+@metrics.timed("dashboard_page", "footer")
+def footer_fragment():
+    st.markdown(
+        """
+        <div class="app-footer">
+            © 2025 <strong>Amigos Consultants</strong> — Confidential Analytics Portal | All Rights Reserved
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+
+
 # ======================================================
 # LOGIN SCREEN
 # ======================================================
+@metrics.timed("login_screen")
 def login_screen():
 
-    bg = None
-    for ext in ["png", "jpg", "jpeg"]:
-        path = f"landing_page.{ext}"
-        if os.path.exists(path):
-            bg = path
-            break
-
-    if bg:
-        b64 = safe_b64(bg)
-        st.markdown(
-            f"""
-            <style>
-                [data-testid="stAppViewContainer"] {{
-                    background-image: url("data:image/jpg;base64,{b64}");
-                    background-size: cover;
-                    background-position: center;
-                }}
-                input {{
-                    background: rgba(0,0,0,0.45) !important;
-                    color: white !important;
-                }}
-            </style>
-            """,
-            unsafe_allow_html=True,
-        )
+    # Styles + background (pre-built image variants) live in one hashed,
+    # immutable bundle; a rerun only resends this one-line @import.
+    with metrics.phase("login_screen", "styles"):
+        st.markdown(assets.css_import("login"), unsafe_allow_html=True)
 
-    st.markdown("<div style='padding-top:200px'></div>", unsafe_allow_html=True)
+    # Warm DNS/TLS to Tableau and the embedding library while the user types;
+    # the markup is constant, so reruns don't reload this frame.
+    with metrics.phase("login_screen", "preload"):
+        st.components.v1.html(assets.tableau_preload_tags(), height=0)
 
-    email = st.text_input("", placeholder="Email", label_visibility="collapsed")
-    password = st.text_input("", placeholder="Password", type="password", label_visibility="collapsed")
+    st.markdown("<div style='padding-top:200px'></div>", unsafe_allow_html=True)
 
-    if st.button("Login (Submit)", key="login_submit"):
-        if email == STREAMLIT_USERNAME and password == STREAMLIT_PASSWORD:
-            st.session_state["logged_in"] = True
-            st.session_state["username"] = email
+    with metrics.phase("login_screen", "form"):
+        email = st.text_input("", placeholder="Email", label_visibility="collapsed")
+        password = st.text_input("", placeholder="Password", type="password", label_visibility="collapsed")
+        submitted = st.button("Login (Submit)", key="login_submit")
+
+    if submitted:
+        secrets = get_config().secrets
+        if email == secrets["admin_user"] and password == secrets["admin_password"]:
+            metrics.LOGINS.inc()
+            with metrics.phase("login_screen", "session"):
+                session_store.start_session(email)
             st.rerun()
         else:
+            metrics.LOGIN_FAILURES.inc()
             st.error("Invalid credentials")
 
 
 # ======================================================
 # DASHBOARD PAGE (OLD FUNCTIONALITY PRESERVED 100%)
 # ======================================================
+@metrics.timed("dashboard_page")
 def dashboard_page():
 
-    # Light UI only (does NOT change layout height)
-    st.markdown(
-        """
-        <style>
-            [data-testid="stAppViewContainer"] {
-                background: #f5f6fa !important;
-            }
-
-            [data-testid="stSidebar"] {
-                background: #ffffffee !important;
-                border-right: 1px solid #e0e0e0 !important;
-                backdrop-filter: blur(6px);
-            }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
-
-    secrets = load_json(SECRETS_FILE)
-    dashboards = load_json(DASHBOARDS_FILE)
+    # Light UI + footer styles (styles/dashboard.css, hashed bundle); only
+    # sent on full runs, fragment reruns leave it in place.
+    with metrics.phase("dashboard_page", "styles"):
+        st.markdown(assets.css_import("dashboard"), unsafe_allow_html=True)
 
     # ---- SIDEBAR ----
-    st.sidebar.title("Dashboards")
-    names = [d["name"] for d in dashboards]
-
-    selected = st.sidebar.radio("Select dashboard", names, key="dashboard_selector")
-
-    st.sidebar.markdown("---")
-    st.sidebar.write("Logged in as:")
-    st.sidebar.write(f"**{st.session_state.get('username')}**")
-
-    if st.sidebar.button("Logout", key="logout_btn"):
-        st.session_state.clear()
-        st.rerun()
-
-    # ---- JWT + URL ----
-    token = generate_tableau_jwt(secrets, TABLEAU_USER)
-    view_url = next(d["url"] for d in dashboards if d["name"] == selected)
-    iframe_url = build_iframe_url(view_url, token)
+    with st.sidebar:
+        sidebar_fragment()
 
     # ---- TITLE + REFRESH ----
-    col1, col2 = st.columns([8, 2])
-    with col1:
-        st.header(selected)
-    with col2:
-        if st.button("🔄 Refresh", key="refresh_btn", use_container_width=True):
-            st.rerun()
-
-    # ---- EXACT OLD WORKING IFRAME LOGIC ----
-    tableau_script = (
-        '<script type="module" '
-        'src="https://prod-in-a.online.tableau.com/javascripts/api/tableau.embedding.3.latest.min.js">'
-        "</script>"
-    )
+    header_fragment()
 
-    html_block = f"""
-        {tableau_script}
-        <style>
-            html, body {{
-                margin: 0;
-                padding: 0;
-                height: 100%;
-                overflow: hidden;
-            }}
-            #vizframe {{
-                width: 100%;
-                height: calc(100vh - 70px); /* EXACT SAME AS OLD CODE */
-                border: none;
-            }}
-        </style>
-
-        <iframe id="vizframe" src="{iframe_url}" allowfullscreen></iframe>
-    """
-
-    # Old stable component height
-    st.components.v1.html(html_block, height=1200, scrolling=False)
+    # ---- TABLEAU VIZ ----
+    viz_fragment()
 
     # ---- FOOTER ----
-    st.markdown(
-        """
-        <style>
-            .app-footer {
-                margin-top: 40px;
-                padding: 25px 0;
-                border-top: 1px solid #d4d7dd;
-                font-size: 18px;      /* increased from 14px → 18px */
-                font-weight: 600;     /* bolder for premium feel */
-                color: #475569;
-                text-align: center;
-            }
-        </style>
-
-        <div class="app-footer">
-            © 2025 <strong>Amigos Consultants</strong> — Confidential Analytics Portal | All Rights Reserved
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
+    footer_fragment()
 
 
 # ======================================================
 # MAIN
 # ======================================================
+def is_admin():
+    return (st.session_state.get("logged_in")
+            and st.session_state.get("username") == get_config().secrets.get("admin_user"))
+
+
 def main():
+    session_store.restore_session()
+    # one rerun under the sampling profiler when the admin asked for it
+    # (sidebar "Profiler", or ?profile=1); otherwise a single dict lookup
+    if st.session_state.get(profiler.SESSION_KEY) or st.query_params.get("profile") == "1":
+        st.session_state.pop(profiler.SESSION_KEY, None)
+        st.query_params.pop("profile", None)
+        if is_admin():
+            with profiler.profile("main"):
+                return _main()
+    _main()
+
+
+def _main():
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
 
@@ -235,6 +276,7 @@ def main():
         login_screen()
     else:
         dashboard_page()
+    session_store.write_cookie()
 
 
 if __name__ == "__main__":
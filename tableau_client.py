@@ -0,0 +1,355 @@
+# ================================
+# tableau_client.py
+# ================================
+#
+# Shared Tableau REST API client for server-side jobs (catalog sync,
+# snapshots, exports, admin scripts).
+#
+#   - one pooled keep-alive requests.Session per client (TLS reused)
+#   - Connected App JWT sign-in (auth.generate_tableau_jwt); the
+#     X-Tableau-Auth token is cached until shortly before it expires and
+#     re-auth is single-flight (one sign-in however many threads need it)
+#   - retry with exponential backoff on 429/5xx (honours Retry-After);
+#     idempotent methods via urllib3, sign-in (a POST) explicitly
+#   - automatic pagination, later pages fetched in parallel (bounded)
+#   - binary exports streamed straight to disk
+#
+# Point `host` at a local mock server (fake_tableau.py) to test without Tableau.
+
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from auth import generate_tableau_jwt, load_secrets
+
+log = logging.getLogger(__name__)
+
+API_VERSION = os.environ.get("PORTAL_TABLEAU_API_VERSION", "3.22")
+
+# Connected App scopes needed by the REST features built on this client.
+REST_SCOPES = ("tableau:content:read", "tableau:views:download")
+
+# Tableau Cloud credentials tokens live 120 min by default (less if the
+# site is configured so); re-sign-in this long before they expire.
+AUTH_TTL = int(os.environ.get("PORTAL_TABLEAU_AUTH_TTL", str(120 * 60)))
+AUTH_MARGIN = 5 * 60
+
+PAGE_SIZE = 1000            # REST API maximum
+PAGE_WORKERS = 4            # parallel page fetches per paginated call
+POOL_SIZE = 16              # keep-alive connections per host
+TIMEOUT = (5, 60)           # connect, read
+EXPORT_TIMEOUT = (5, 300)   # PDF/PNG renders can take minutes on big views
+CHUNK_SIZE = 1 << 16
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF = 0.5               # 0.5, 1, 2, 4 ... seconds
+MAX_BACKOFF = 30.0          # sign-in retries
+
+
+class TableauError(RuntimeError):
+    """Non-success REST response (after retries)."""
+
+    def __init__(self, status: int, message: str, code: Optional[str] = None):
+        super().__init__(f"Tableau REST {status}{f' ({code})' if code else ''}: {message}")
+        self.status = status
+        self.code = code
+
+
+def site_content_url(secrets: Dict, urls: Sequence[str] = ()) -> str:
+    """The site's contentUrl: from secrets, else the /t/<site>/ part of a view URL."""
+    if secrets.get("site_content_url"):
+        return secrets["site_content_url"]
+    for url in urls:
+        match = re.search(r"/t/([^/]+)/", url)
+        if match:
+            return match.group(1)
+    return ""  # the Default site
+
+
+def _session(pool_size: int, retries: int) -> requests.Session:
+    retry = Retry(
+        total=retries,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,    # idempotent methods only (urllib3's default)
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept": "application/json", "Content-Type": "application/json"})
+    return session
+
+
+class TableauClient:
+    """Thread-safe; share one instance per process (see get_client())."""
+
+    def __init__(self, host: Optional[str] = None, subject: Optional[str] = None,
+                 site: Optional[str] = None, api_version: str = API_VERSION,
+                 scopes: Sequence[str] = REST_SCOPES, pool_size: int = POOL_SIZE,
+                 retries: int = 5, timeout=TIMEOUT):
+        secrets = load_secrets()
+        self.host = (host or secrets["host"]).rstrip("/")
+        self.subject = subject or secrets.get("tableau_user") or secrets.get("admin_user")
+        if site is None:
+            from config_store import get_config
+            site = site_content_url(secrets, get_config().urls.values())
+        self.site = site
+        self.api_version = api_version
+        self.scopes = tuple(scopes)
+        self.timeout = timeout
+        self.retries = retries
+        self.session = _session(pool_size, retries)
+
+        self._auth_lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._site_id: Optional[str] = None
+        self._user_id: Optional[str] = None
+        self._expires = 0.0
+        self._generation = 0
+        self._view_ids: Dict[str, str] = {}
+
+        self.signins = 0
+        self.requests = 0
+
+    @property
+    def base(self) -> str:
+        return f"{self.host}/api/{self.api_version}"
+
+    # ---- auth ----
+    def _sign_in(self) -> None:
+        # The session's Retry leaves 429/5xx answers to POSTs alone (failed
+        # connects it already retries); a repeated sign-in only opens another
+        # session, so those are retried here, each attempt with a fresh JWT
+        # (Tableau rejects a reused jti).
+        for attempt in range(self.retries + 1):
+            jwt = generate_tableau_jwt(self.subject, 300, self.scopes, use_cache=False)
+            body = {"credentials": {"jwt": jwt, "site": {"contentUrl": self.site}}}
+            resp = self.session.post(f"{self.base}/auth/signin", json=body, timeout=self.timeout)
+            if resp.status_code not in RETRY_STATUSES or attempt == self.retries:
+                break
+            delay = min(BACKOFF * 2 ** attempt, MAX_BACKOFF)
+            retry_after = resp.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = min(int(retry_after), MAX_BACKOFF)
+            resp.close()
+            log.warning("sign-in to %s answered %d, retrying in %.1fs",
+                        self.host, resp.status_code, delay)
+            time.sleep(delay)
+        data = self._json(resp)
+        creds = data["credentials"]
+        ttl = AUTH_TTL
+        remaining = creds.get("estimatedTimeToExpiration")  # "hh:mm:ss" on newer servers
+        if remaining:
+            h, m, s = (int(x) for x in remaining.split(":"))
+            ttl = min(ttl, h * 3600 + m * 60 + s)
+
+        self._token = creds["token"]
+        self._site_id = creds["site"]["id"]
+        self._user_id = creds.get("user", {}).get("id")
+        # a short-lived token (under 2 * AUTH_MARGIN) is kept for half its life
+        self._expires = time.monotonic() + ttl - min(AUTH_MARGIN, ttl / 2)
+        self._generation += 1
+        self.signins += 1
+        log.info("signed in to %s (site %r) as %s", self.host, self.site, self.subject)
+
+    def _auth(self, stale_generation: Optional[int] = None) -> Tuple[str, int]:
+        """(token, generation); signs in at most once for concurrent callers."""
+        token, generation = self._token, self._generation
+        if token and time.monotonic() < self._expires and generation != stale_generation:
+            return token, generation
+        with self._auth_lock:
+            if (not self._token or time.monotonic() >= self._expires
+                    or self._generation == stale_generation):
+                self._sign_in()
+            return self._token, self._generation
+
+    @property
+    def site_id(self) -> str:
+        self._auth()
+        return self._site_id
+
+    @property
+    def user_id(self) -> Optional[str]:
+        self._auth()
+        return self._user_id
+
+    def sign_out(self) -> None:
+        with self._auth_lock:
+            if self._token:
+                try:
+                    self.session.post(f"{self.base}/auth/signout", timeout=self.timeout,
+                                      headers={"X-Tableau-Auth": self._token})
+                except requests.RequestException:
+                    pass
+            self._token = None
+            self._expires = 0.0
+
+    # ---- requests ----
+    @staticmethod
+    def _json(resp: requests.Response) -> Dict:
+        if resp.status_code >= 400:
+            code, message = None, resp.text[:300]
+            try:
+                error = resp.json()["error"]
+                code, message = error.get("code"), error.get("detail") or error.get("summary")
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise TableauError(resp.status_code, message, code)
+        return resp.json() if resp.content else {}
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        `path` is relative to /sites/<site-id>/ unless it starts with "/".
+        A 401 (token revoked or expired early) triggers one re-auth + retry.
+        """
+        headers = kwargs.pop("headers", None) or {}
+        kwargs.setdefault("timeout", self.timeout)
+        stale = None
+        for attempt in range(2):
+            token, generation = self._auth(stale)
+            url = self.base + (path if path.startswith("/") else f"/sites/{self._site_id}/{path}")
+            self.requests += 1
+            resp = self.session.request(method, url, headers=dict(headers, **{"X-Tableau-Auth": token}),
+                                        **kwargs)
+            if resp.status_code != 401 or attempt:
+                return resp
+            resp.close()
+            stale = generation
+
+    def get(self, path: str, **params) -> Dict:
+        return self._json(self.request("GET", path, params=params))
+
+    def get_bytes(self, path: str, **params) -> bytes:
+        resp = self.request("GET", path, params=params)
+        if resp.status_code >= 400:
+            self._json(resp)
+        return resp.content
+
+    def download(self, path: str, dest: str, timeout=EXPORT_TIMEOUT, **params) -> int:
+        """
+        Stream a binary endpoint to `dest` (via dest.part, renamed when
+        complete, so readers never see a partial file). Returns the size.
+        """
+        part = dest + ".part"
+        resp = self.request("GET", path, params=params, stream=True, timeout=timeout)
+        try:
+            if resp.status_code >= 400:
+                self._json(resp)
+            size = 0
+            with open(part, "wb") as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(part, dest)
+            return size
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        finally:
+            resp.close()
+
+    def paginate(self, path: str, collection: str, item: str, page_size: int = PAGE_SIZE,
+                 workers: int = PAGE_WORKERS, **params) -> Iterator[Dict]:
+        """
+        Yield every item of a paged listing, in server order. The first
+        page gives the total; the remaining pages are fetched `workers` at
+        a time.
+        """
+        params["pageSize"] = page_size
+
+        def page(number: int) -> Tuple[Dict, List[Dict]]:
+            data = self.get(path, pageNumber=number, **params)
+            return data.get("pagination", {}), (data.get(collection) or {}).get(item, [])
+
+        pagination, items = page(1)
+        yield from items
+        total = int(pagination.get("totalAvailable", len(items)))
+        pages = -(-total // page_size)
+        if pages <= 1:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, pages - 1)),
+                                thread_name_prefix="tableau-page") as pool:
+            for _, items in pool.map(page, range(2, pages + 1)):
+                yield from items
+
+    # ---- resources ----
+    def workbooks(self, filter: Optional[str] = None, **params) -> Iterator[Dict]:
+        if filter:
+            params["filter"] = filter
+        return self.paginate("workbooks", "workbooks", "workbook", **params)
+
+    def views(self, filter: Optional[str] = None, **params) -> Iterator[Dict]:
+        if filter:
+            params["filter"] = filter
+        return self.paginate("views", "views", "view", **params)
+
+    def view_id_for(self, url: str) -> str:
+        """REST id of the view behind an embed URL (looked up once, then cached)."""
+        view_id = self._view_ids.get(url)
+        if view_id is None:
+            from catalog import normalize_url
+
+            path = normalize_url(url).split("/views/", 1)[-1]
+            workbook, _, view = path.partition("/")
+            for v in self.views(filter=f"viewUrlName:eq:{view}"):
+                if v.get("contentUrl") == f"{workbook}/sheets/{view}":
+                    view_id = self._view_ids[url] = v["id"]
+                    break
+            else:
+                raise TableauError(404, f"no view found for {url}")
+        return view_id
+
+    def view_image(self, view_id: str, resolution: Optional[str] = "high",
+                   max_age_minutes: Optional[int] = None) -> bytes:
+        """PNG of a view (REST "Query View Image"); resolution=None: standard density."""
+        params = {}
+        if resolution:
+            params["resolution"] = resolution
+        if max_age_minutes is not None:
+            params["maxAge"] = max_age_minutes
+        return self.get_bytes(f"views/{view_id}/image", **params)
+
+    def stats(self) -> Dict[str, int]:
+        return {"signins": self.signins, "requests": self.requests}
+
+    def close(self) -> None:
+        self.sign_out()
+        self.session.close()
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+_client: Optional[TableauClient] = None
+_lock = threading.Lock()
+
+
+def get_client() -> TableauClient:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = TableauClient()
+    return _client
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    client = TableauClient()
+    t0 = time.perf_counter()
+    n_workbooks = sum(1 for _ in client.workbooks())
+    n_views = sum(1 for _ in client.views())
+    print(f"{n_workbooks} workbooks, {n_views} views in {time.perf_counter() - t0:.2f}s "
+          f"({client.stats()})")
+    client.close()
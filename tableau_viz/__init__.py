@@ -0,0 +1,70 @@
+# ================================
+# tableau_viz — bidirectional Streamlit component
+# ================================
+#
+# Mounts <tableau-viz> directly in the component frame and keeps a small
+# LRU pool of recently used vizzes alive but hidden, so switching back to
+# a recent dashboard is a visibility toggle instead of a full view load.
+# Refreshes (manual or on a per-dashboard interval) reload data in place.
+# A snapshot image can stand in until the viz is interactive (or for as
+# long as it cannot load). The frame reports the active dashboard back to Python,
+# and load/token/refresh timings to the portal's RUM collector (rum.py).
+
+import os
+from typing import Dict, Optional
+
+import streamlit.components.v1 as components
+
+_FRONTEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+_component = components.declare_component("tableau_viz", path=_FRONTEND)
+
+
+def tableau_viz(name: str, url: str, token_url: str, *, script_url: str,
+                script_integrity: Optional[str] = None, css_url: Optional[str] = None,
+                pool_size: int = 3, height: int = 1200,
+                nonce: int = 0, refresh_interval: Optional[float] = None,
+                refresh_jitter: float = 0.2, placeholder_url: Optional[str] = None,
+                placeholder_time: Optional[float] = None, load_timeout: float = 30,
+                rum_url: Optional[str] = None, key: str = "tableau_viz") -> Optional[Dict]:
+    """
+    Show dashboard `name` (view `url`) in the pooled viz frame.
+
+    Returns the frame's last report, e.g.
+    {"active": name, "interactive": True, "load_ms": 2310, "warm": False,
+     "error": None, "pool": [...], "refresh": {"interval": 300, "done": 4, "failed": 0,
+     "skipped": 1, "merged": 0, "last_ms": 850}}, or None before the first
+    report. Keep `key` stable: it is what keeps the same frame (and its
+    pool) across reruns.
+
+    Bumping `nonce` refreshes the active viz's data in place (the viz is
+    rebuilt only if that fails). With `refresh_interval` (seconds) the
+    active viz also refreshes itself every interval +/- `refresh_jitter`,
+    backing off on failures and pausing while the tab is hidden.
+
+    `placeholder_url` (an image of the view taken at epoch
+    `placeholder_time`) is shown until the viz is interactive. If the viz
+    fails to load, or is not interactive within `load_timeout` seconds, it
+    stays up with a "stale as of" badge and the report carries the error.
+
+    With `rum_url` the frame beacons library load, first-interactive,
+    token callback and refresh timings (and failures) there; see rum.py.
+    """
+    return _component(
+        name=name,
+        url=url,
+        token_url=token_url,
+        script_url=script_url,
+        script_integrity=script_integrity,
+        css_url=css_url,
+        pool_size=pool_size,
+        height=height,
+        nonce=nonce,
+        refresh_interval=refresh_interval,
+        refresh_jitter=refresh_jitter,
+        placeholder_url=placeholder_url,
+        placeholder_time=placeholder_time,
+        load_timeout=load_timeout,
+        rum_url=rum_url,
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,349 @@
+// tableau_viz/frontend/main.js
+// One component frame holding an LRU pool of live <tableau-viz> elements.
+// Speaks the Streamlit component protocol directly (no build step).
+// Load, token and refresh timings go to the portal collector (rum.js).
+
+const Streamlit = {
+  send(type, data) {
+    window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type }, data), "*");
+  },
+  ready() { this.send("streamlit:componentReady", { apiVersion: 1 }); },
+  setHeight(height) { this.send("streamlit:setFrameHeight", { height }); },
+  setValue(value) { this.send("streamlit:setComponentValue", { value, dataType: "json" }); },
+};
+
+const pool = new Map();      // name -> {name, viz, url, usedAt, startedAt, interactive, loadMs,
+                             //          warm, refreshedAt, refreshing, error}
+let active = null;
+let tokenUrl = null;         // /new_jwt?t=<grant>; each response renews the grant
+let pageTokenUrl = null;     // the last one the page sent
+let lastNonce = null;
+let lastHeight = null;
+let lastReport = null;
+let library = null;
+let libraryError = null;
+let loadTimeoutMs = 30000;
+let snapshot = null;         // {url, time} of the active dashboard's last snapshot
+
+function loadOnce(tag, attrs) {
+  const el = document.createElement(tag);
+  Object.assign(el, attrs);
+  document.head.appendChild(el);
+  return el;
+}
+
+// `name`: the dashboard waiting for it (load timings are per dashboard)
+function loadLibrary(src, integrity, name) {
+  if (!library) {
+    const started = performance.now();
+    library = new Promise((resolve, reject) => {
+      const attrs = { type: "module", src, onload: resolve,
+                      onerror: () => reject(new Error("embedding library failed to load")) };
+      if (integrity) Object.assign(attrs, { integrity, crossOrigin: "anonymous" });
+      loadOnce("script", attrs);
+    });
+    library.then(() => PortalRUM.timing(name, "script", performance.now() - started),
+                 (err) => PortalRUM.failure(name, "script", err.message));
+    library.catch(() => { library = null; });  // retried on the next render
+  }
+  return library;
+}
+
+// ---- snapshot placeholder ----
+// The last snapshot of the active dashboard covers the frame until its viz
+// is interactive. If the viz cannot load (library or view load error, or
+// no firstinteractive within load_timeout) it stays up with a badge.
+function overlay(name = active) {
+  const entry = pool.get(name);
+  const ready = entry && entry.interactive;
+  const error = libraryError || (entry && entry.error);
+  const img = document.getElementById("placeholder");
+  const badge = document.getElementById("stale");
+
+  img.hidden = ready || !snapshot;
+  if (snapshot && img.getAttribute("src") !== snapshot.url) img.src = snapshot.url;
+  badge.hidden = ready || !error;
+  badge.textContent = snapshot
+    ? "Stale as of " + new Date(snapshot.time * 1000).toLocaleString()
+    : "Dashboard unavailable";
+}
+
+// Report is derived from state only, so identical reruns never re-send it.
+function report() {
+  const entry = pool.get(active);
+  const value = {
+    active,
+    interactive: entry ? entry.interactive : false,
+    load_ms: entry ? entry.loadMs : null,
+    warm: entry ? entry.warm : false,
+    error: libraryError || (entry ? entry.error : null),
+    pool: [...pool.keys()],
+    refresh: Object.assign({ interval: auto ? auto.interval : null }, stats),
+  };
+  const key = JSON.stringify(value);
+  if (key !== lastReport) {
+    lastReport = key;
+    Streamlit.setValue(value);
+  }
+}
+
+async function fetchToken() {
+  const r = await fetch(tokenUrl, { cache: "no-store" });
+  const j = await r.json();
+  if (j.error) throw new Error(j.error);
+  if (j.grant) {
+    const next = new URL(tokenUrl);
+    next.searchParams.set("t", j.grant);
+    tokenUrl = next.href;
+  }
+  return j.token;
+}
+
+function createViz(name, url) {
+  const viz = document.createElement("tableau-viz");
+  viz.className = "pooled-viz";
+  viz.src = url;
+  viz.toolbar = "hidden";
+
+  // token callback: called on load and whenever the token expires
+  viz.token = PortalRUM.timedToken(name, fetchToken);
+
+  const entry = { name, viz, url, usedAt: performance.now(), startedAt: performance.now(),
+                  interactive: false, loadMs: null, warm: false,
+                  refreshedAt: performance.now(), refreshing: null, error: null };
+  const failed = (error) => {
+    if (entry.interactive || entry.error) return;
+    entry.error = error;
+    PortalRUM.failure(name, "interactive", error);
+    if (pool.get(active) === entry) {
+      overlay();
+      report();
+    }
+  };
+  viz.addEventListener("firstinteractive", () => {
+    entry.interactive = true;
+    entry.error = null;
+    entry.loadMs = Math.round(performance.now() - entry.startedAt);
+    entry.refreshedAt = performance.now();
+    PortalRUM.timing(name, "interactive", entry.loadMs);
+    if (pool.get(active) === entry) {
+      overlay();
+      report();
+    }
+  });
+  viz.addEventListener("vizloaderror", () => failed("load error"));
+  setTimeout(() => failed("timeout"), loadTimeoutMs);
+  document.getElementById("pool").appendChild(viz);
+  return entry;
+}
+
+function drop(name) {
+  pool.get(name).viz.remove();
+  pool.delete(name);
+}
+
+// Evict least recently used hidden vizzes beyond pool_size; the active viz
+// is never evicted. pool_size is the only bound: the vizzes live in
+// cross-origin Tableau iframes, whose memory this frame cannot measure.
+function evict(args) {
+  const idle = [...pool.entries()]
+    .filter(([name]) => name !== active)
+    .sort((a, b) => a[1].usedAt - b[1].usedAt);
+  while (idle.length && pool.size > args.pool_size) {
+    drop(idle.shift()[0]);
+  }
+}
+
+function rebuild(name) {
+  const old = pool.get(name);
+  drop(name);
+  const entry = createViz(name, old.url);
+  entry.viz.classList.toggle("active", name === active);
+  pool.set(name, entry);
+  report();
+}
+
+// ---- data refresh ----
+// Refresh and auto-refresh call refreshDataAsync() on the mounted viz:
+// new data without reloading the layout, fonts or workbook bootstrap.
+const stats = { done: 0, failed: 0, skipped: 0, merged: 0, last_ms: null };
+
+// Resolves to false only if the refresh itself failed.
+function refreshData(entry) {
+  if (!entry.interactive) {
+    stats.skipped++;  // still loading: it will show fresh data anyway
+    return Promise.resolve(true);
+  }
+  if (entry.refreshing) {
+    stats.merged++;   // one already in flight: share it
+    return entry.refreshing;
+  }
+  const started = performance.now();
+  entry.refreshing = entry.viz.refreshDataAsync()
+    .then(() => {
+      stats.done++;
+      stats.last_ms = Math.round(performance.now() - started);
+      entry.refreshedAt = performance.now();
+      PortalRUM.timing(entry.name, "refresh", stats.last_ms);
+      return true;
+    })
+    .catch((err) => {
+      stats.failed++;
+      console.warn("tableau_viz: refresh failed", err);
+      PortalRUM.failure(entry.name, "refresh", err.message || err);
+      return false;
+    })
+    .finally(() => {
+      entry.refreshing = null;
+      report();
+    });
+  return entry.refreshing;
+}
+
+// ---- auto-refresh ----
+// One timer, for the active viz only. Every delay is jittered and the first
+// one is random within the interval, so sessions opened together spread
+// their refreshes out; failures back off exponentially (up to MAX_BACKOFF
+// intervals). While the tab is hidden the timer is paused: ticks missed in
+// the meantime are counted as skipped and one refresh runs on return.
+const MAX_BACKOFF = 8;
+let auto = null;             // {name, interval, jitter, failures, dueAt}
+let timer = null;
+
+function scheduleIn(ms) {
+  clearTimeout(timer);
+  timer = null;
+  auto.dueAt = performance.now() + ms;
+  if (!document.hidden) timer = setTimeout(tick, ms);
+}
+
+function scheduleNext() {
+  const backoff = Math.min(2 ** auto.failures, MAX_BACKOFF);
+  const spread = 1 - auto.jitter + 2 * auto.jitter * Math.random();
+  scheduleIn(auto.interval * 1000 * backoff * spread);
+}
+
+async function tick() {
+  timer = null;
+  const current = auto;
+  const entry = current && pool.get(current.name);
+  if (!entry) return;
+  const ok = await refreshData(entry);
+  if (auto !== current) return;  // switched dashboards meanwhile
+  current.failures = ok ? 0 : current.failures + 1;
+  scheduleNext();
+}
+
+function configureAuto(args, entry) {
+  const interval = args.refresh_interval || null;
+  if (!interval) {
+    clearTimeout(timer);
+    timer = null;
+    auto = null;
+    return;
+  }
+  if (auto && auto.name === args.name && auto.interval === interval) return;
+
+  auto = { name: args.name, interval, jitter: args.refresh_jitter, failures: 0, dueAt: 0 };
+  const age = performance.now() - entry.refreshedAt;
+  if (entry.interactive && age >= interval * 1000) {
+    scheduleIn(0);  // warm viz shown again with stale data
+  } else {
+    scheduleIn(Math.random() * (interval * 1000 - age));
+  }
+}
+
+document.addEventListener("visibilitychange", () => {
+  if (!auto) return;
+  if (document.hidden) {
+    clearTimeout(timer);
+    timer = null;
+    return;
+  }
+  const late = performance.now() - auto.dueAt;
+  if (late >= 0) {
+    const missed = Math.floor(late / (auto.interval * 1000));
+    if (missed) {
+      stats.skipped += missed;
+      report();
+    }
+    tick();
+  } else {
+    timer = setTimeout(tick, -late);
+  }
+});
+
+async function render(args) {
+  if (args.height !== lastHeight) {
+    lastHeight = args.height;
+    document.getElementById("pool").style.height = args.height + "px";
+    Streamlit.setHeight(args.height);
+  }
+  if (args.css_url && !document.getElementById("viz-css")) {
+    loadOnce("link", { id: "viz-css", rel: "stylesheet", href: args.css_url });
+  }
+  loadTimeoutMs = args.load_timeout * 1000;
+  if (args.token_url !== pageTokenUrl) {
+    // a newly minted page grant; otherwise keep the (fresher) renewed one
+    pageTokenUrl = tokenUrl = args.token_url;
+  }
+  PortalRUM.configure(args.rum_url);
+  snapshot = args.placeholder_url
+    ? { url: args.placeholder_url, time: args.placeholder_time } : null;
+  overlay(args.name);
+
+  try {
+    await loadLibrary(args.script_url, args.script_integrity, args.name);
+    libraryError = null;
+  } catch (err) {
+    libraryError = err.message;
+    overlay(args.name);
+    report();
+    return;
+  }
+
+  const refresh = lastNonce !== null && args.nonce !== lastNonce;
+  lastNonce = args.nonce;
+
+  let entry = pool.get(args.name);
+  if (entry && entry.url !== args.url) {
+    drop(args.name);
+    entry = null;
+  }
+  if (active !== args.name) {
+    if (entry) {
+      entry.warm = true;
+    } else {
+      entry = createViz(args.name, args.url);
+      pool.set(args.name, entry);
+    }
+    active = args.name;
+  } else if (!entry) {
+    entry = createViz(args.name, args.url);
+    pool.set(args.name, entry);
+  }
+  entry.usedAt = performance.now();
+
+  for (const [name, e] of pool) e.viz.classList.toggle("active", name === active);
+  evict(args);
+  configureAuto(args, entry);
+  overlay();
+
+  // explicit refresh: new data in place; rebuild only if that fails
+  if (refresh) {
+    const name = args.name;
+    refreshData(entry).then((ok) => {
+      if (!ok && pool.get(name) === entry) rebuild(name);
+    });
+    if (auto) scheduleNext();
+  }
+  report();
+}
+
+window.addEventListener("message", (event) => {
+  if (event.data && event.data.type === "streamlit:render") {
+    render(event.data.args).catch((err) => console.error("tableau_viz:", err));
+  }
+});
+
+Streamlit.ready();
@@ -0,0 +1,74 @@
+// tableau_viz/frontend/rum.js
+// Real-user timings of embedded vizzes, batched to the portal collector
+// (rum.py) with navigator.sendBeacon. Loaded by the tableau_viz frame and
+// by viewer.py. A no-op until configure() gets a collector URL.
+//
+// Event: {d: dashboard, k: kind, ms: duration} or {d, k, err: reason},
+// where kind is "script" (embedding library loaded), "interactive" (viz
+// first interactive), "token" (token callback) or "refresh".
+
+const PortalRUM = (() => {
+  const MAX_BATCH = 50;
+  const FLUSH_MS = 10000;
+  let endpoint = null;
+  let queue = [];
+  let timer = null;
+
+  function flush() {
+    clearTimeout(timer);
+    timer = null;
+    if (!endpoint || !queue.length) return;
+    const body = JSON.stringify({ events: queue });
+    queue = [];
+    // text/plain: a "simple" cross-origin request, no CORS preflight
+    const sent = navigator.sendBeacon
+      && navigator.sendBeacon(endpoint, new Blob([body], { type: "text/plain" }));
+    if (!sent) {
+      fetch(endpoint, { method: "POST", body, keepalive: true, mode: "no-cors" }).catch(() => {});
+    }
+  }
+
+  function record(event) {
+    if (!endpoint || !event.d) return;
+    queue.push(event);
+    if (queue.length >= MAX_BATCH) flush();
+    else if (!timer) timer = setTimeout(flush, FLUSH_MS);
+  }
+
+  function timing(dashboard, kind, ms) {
+    record({ d: dashboard, k: kind, ms: Math.round(ms) });
+  }
+
+  function failure(dashboard, kind, err) {
+    record({ d: dashboard, k: kind, err: String(err).slice(0, 80) });
+  }
+
+  // wrap a viz token callback so each call reports its latency / failure
+  function timedToken(dashboard, fetchToken) {
+    return async () => {
+      const started = performance.now();
+      try {
+        const token = await fetchToken();
+        timing(dashboard, "token", performance.now() - started);
+        return token;
+      } catch (err) {
+        failure(dashboard, "token", err.message || err);
+        throw err;
+      }
+    };
+  }
+
+  // the tab may be closed at any time: send what we have while we can
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "hidden") flush();
+  });
+  window.addEventListener("pagehide", flush);
+
+  return {
+    configure(url) { endpoint = url || null; },
+    timing,
+    failure,
+    timedToken,
+    flush,
+  };
+})();
@@ -0,0 +1,337 @@
+# ================================
+# token_server.py
+# ================================
+#
+# One asyncio token endpoint per process, replacing the Flask thread that
+# `streamlit_app copy.py` used to start for every session.
+#
+#   GET /new_jwt?t=<grant>  -> {"token": "<jwt>"}   (Cache-Control: no-store)
+#   GET /healthz  -> {"ok": true, ...}
+#   GET /metrics  -> Prometheus text (see metrics.py)
+#   GET /profile/arm?target=new_jwt&t=...  -> profile the next /new_jwt (profiler.py)
+#   GET /session/cookie?t=...  -> 204 + HttpOnly session cookie (session_store.py)
+#
+# Concurrent requests for the same subject share one signing operation
+# (single-flight); tokens themselves come from auth.TOKEN_CACHE.
+#
+# /new_jwt only answers a grant: a short-lived HMAC-signed payload (the
+# downloads.sign scheme) bound to one logged-in portal session, which the
+# page hands to its viz frame. Responses carry a renewed grant ("grant")
+# before the old one could lapse, so an open page keeps its viz, for up
+# to GRANT_MAX_AGE.
+# CORS is limited to the portal's own origins (PORTAL_ALLOWED_ORIGINS).
+#
+# Under launcher.py one shared daemon serves every worker:
+#
+#   python token_server.py --unix /tmp/portal-token.sock
+#
+# and workers get PORTAL_TOKEN_SOCKET (so they start no service of their
+# own) plus PORTAL_TOKEN_PUBLIC_URL (the launcher's TCP front for browsers).
+
+import argparse
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+import profiler
+import session_store
+from async_http import NO_STORE, HTTPServer, Request, Response, json_response
+from auth import TOKEN_CACHE, generate_tableau_jwt
+from config_store import get_config
+
+log = logging.getLogger(__name__)
+
+HOST = os.environ.get("PORTAL_TOKEN_HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORTAL_TOKEN_PORT", "5001"))
+TOKEN_TTL = int(os.environ.get("PORTAL_TOKEN_TTL", "600"))
+
+# URL the browser should use (e.g. behind a reverse proxy); defaults to
+# the address the service actually bound.
+PUBLIC_URL = os.environ.get("PORTAL_TOKEN_PUBLIC_URL")
+
+# Unix socket of a shared token daemon (set by launcher.py for its workers).
+SOCKET = os.environ.get("PORTAL_TOKEN_SOCKET")
+
+# A grant outlives one token, so the frame's next fetch can still renew it.
+GRANT_TTL = int(os.environ.get("PORTAL_TOKEN_GRANT_TTL", str(2 * TOKEN_TTL)))
+GRANT_MAX_AGE = int(os.environ.get("PORTAL_TOKEN_GRANT_MAX_AGE", str(8 * 3600)))
+
+# Pages allowed to read the service's responses: Streamlit and viewer.py.
+ORIGINS = tuple(o.strip().rstrip("/") for o in os.environ.get(
+    "PORTAL_ALLOWED_ORIGINS",
+    "http://localhost:8501,http://127.0.0.1:8501,http://localhost:8502,http://127.0.0.1:8502",
+).split(",") if o.strip())
+
+
+# -----------------------------------
+# Grants
+# -----------------------------------
+def grant(session: str, issued: Optional[int] = None) -> str:
+    """Credential for /new_jwt, bound to `session` (an opaque per-session id)."""
+    from downloads import sign
+    now = int(time.time())
+    return sign({"p": "jwt", "s": session, "o": issued or now, "exp": now + GRANT_TTL})
+
+
+def session_grant(state) -> str:
+    """
+    The grant of a Streamlit session (`state`: st.session_state), minted on
+    first use and again once half of it is used up, so reruns in between
+    pass the frame the same URL.
+    """
+    cached = state.get("jwt_grant")
+    if cached is None or cached[1] < time.time():
+        # a random binding: the grant never carries the session id itself
+        import session_store
+        binding = state.setdefault("jwt_binding", session_store.new_session_id())
+        cached = state["jwt_grant"] = (grant(binding), time.time() + GRANT_TTL / 2)
+    return cached[0]
+
+
+def token_url(state) -> str:
+    """/new_jwt URL for the viz frame of a Streamlit session."""
+    return public_url() + "/new_jwt?t=" + session_grant(state)
+
+
+def check_grant(token: str) -> Dict:
+    """The grant's payload; ValueError unless it is a valid, unexpired /new_jwt grant."""
+    from downloads import verify
+    try:
+        payload = verify(token)
+    except (ValueError, KeyError) as exc:
+        raise ValueError("invalid grant") from exc
+    if payload.get("p") != "jwt" or not payload.get("s"):
+        raise ValueError("invalid grant")
+    return payload
+
+
+def renewed(payload: Dict) -> Optional[str]:
+    """
+    A fresh grant for the same session, or None while this one still
+    outlives the frame's next fetch (at most one token lifetime away)
+    and past GRANT_MAX_AGE.
+    """
+    now = time.time()
+    if payload["exp"] - now > GRANT_TTL - TOKEN_TTL / 2 or now - payload["o"] > GRANT_MAX_AGE:
+        return None
+    return grant(payload["s"], payload["o"])
+
+
+# -----------------------------------
+# Service
+# -----------------------------------
+class TokenService:
+    """HTTP token endpoint running on its own event-loop thread."""
+
+    def __init__(self, host: str = HOST, port: int = PORT, ttl_seconds: int = TOKEN_TTL,
+                 unix_path: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.ttl_seconds = ttl_seconds
+        self.unix_path = unix_path
+        self.url: Optional[str] = None
+        self.http = HTTPServer(cors_origin=ORIGINS)
+        self.http.route("/new_jwt")(self.new_jwt)
+        self.http.route("/healthz")(self.healthz)
+        # a shared daemon also merges in its launcher workers' metrics
+        self.http.route("/metrics")(
+            metrics.handler(metrics.workers_dir(unix_path) if unix_path else None))
+        profiler.serve_on(self.http)  # admin-signed /profile/arm
+        session_store.serve_on(self.http)  # one-time links setting the session cookie
+        self.flights = 0
+        self.merged = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- tokens ----
+    @staticmethod
+    def subject() -> Optional[str]:
+        secrets = get_config().secrets
+        return secrets.get("tableau_user") or secrets.get("admin_user")
+
+    async def mint(self, subject: Optional[str]) -> str:
+        """Single-flight: callers for the same subject await one signing job."""
+        fut = self._inflight.get(subject)
+        if fut is None:
+            self.flights += 1
+            fut = self._loop.run_in_executor(None, generate_tableau_jwt, subject, self.ttl_seconds)
+            self._inflight[subject] = fut
+            fut.add_done_callback(lambda _f: self._inflight.pop(subject, None))
+        else:
+            self.merged += 1
+        return await asyncio.shield(fut)
+
+    def mint_profiled(self, subject: Optional[str]) -> str:
+        """Executor job of an armed /new_jwt: the signing path under the profiler."""
+        with profiler.profile("new_jwt"):
+            return generate_tableau_jwt(subject, self.ttl_seconds)
+
+    # ---- handlers ----
+    async def new_jwt(self, request: Request) -> Response:
+        started = time.perf_counter()
+        try:
+            payload = check_grant(request.arg("t", ""))
+        except ValueError as exc:
+            return json_response({"error": str(exc)}, 403, NO_STORE)
+        try:
+            if profiler.ARMED and profiler.take("new_jwt"):
+                token = await self._loop.run_in_executor(None, self.mint_profiled, self.subject())
+            else:
+                token = await self.mint(self.subject())
+        except Exception as exc:
+            metrics.TOKEN_ERRORS.inc()
+            return json_response({"error": str(exc)}, 500, NO_STORE)
+        minted = time.perf_counter()
+        metrics.PHASES.observe(minted - started, "new_jwt", "mint")
+        metrics.TOKEN_MINTS.inc()
+        body = {"token": token}
+        fresh = renewed(payload)
+        if fresh:
+            body["grant"] = fresh
+        response = json_response(body, headers=NO_STORE)
+        metrics.PHASES.observe(time.perf_counter() - minted, "new_jwt", "respond")
+        return response
+
+    async def healthz(self, request: Request) -> Response:
+        return json_response({
+            "ok": True,
+            "requests": self.http.requests,
+            "flights": self.flights,
+            "merged": self.merged,
+            "token_cache": TOKEN_CACHE.stats(),
+        }, headers=NO_STORE)
+
+    # ---- lifecycle ----
+    def start(self) -> "TokenService":
+        ready = threading.Event()
+        error = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._loop = loop
+            try:
+                if self.unix_path:
+                    if os.path.exists(self.unix_path):
+                        os.unlink(self.unix_path)  # stale socket from a crashed daemon
+                    loop.run_until_complete(self.http.start(unix_path=self.unix_path))
+                    self.url = f"unix:{self.unix_path}"
+                else:
+                    try:
+                        server = loop.run_until_complete(self.http.start(self.host, self.port))
+                    except OSError as exc:
+                        # Port taken (another worker, a stale process): fall back
+                        # to an ephemeral port rather than failing the page.
+                        log.warning("token server port %s unavailable (%s); using a free port",
+                                    self.port, exc)
+                        server = loop.run_until_complete(self.http.start(self.host, 0))
+                    sock_host, sock_port = server.sockets[0].getsockname()[:2]
+                    self.url = f"http://{sock_host}:{sock_port}"
+            except Exception as exc:
+                error.append(exc)
+                ready.set()
+                loop.close()
+                return
+            ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="token-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if error:
+            raise RuntimeError("token server failed to start") from error[0]
+        log.info("token server listening on %s", self.url)
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.http.close(), loop).result(timeout)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join(timeout)
+
+
+# -----------------------------------
+# Process-wide instance
+# -----------------------------------
+_service: Optional[TokenService] = None
+_lock = threading.Lock()
+
+
+def ensure_started() -> Optional[TokenService]:
+    """
+    Start the token service once per process; later calls are free.
+    Returns None when a shared daemon (PORTAL_TOKEN_SOCKET) serves instead.
+    """
+    global _service
+    if SOCKET:
+        return None
+    if _service is None:
+        with _lock:
+            if _service is None:
+                _service = TokenService().start()
+    return _service
+
+
+def public_url() -> str:
+    if PUBLIC_URL:
+        return PUBLIC_URL
+    if SOCKET:
+        raise RuntimeError("PORTAL_TOKEN_SOCKET is set but PORTAL_TOKEN_PUBLIC_URL is not")
+    return ensure_started().url
+
+
+@atexit.register
+def stop() -> None:
+    global _service
+    with _lock:
+        if _service is not None:
+            _service.stop()
+            _service = None
+
+
+if __name__ == "__main__":
+    import shutil
+    import signal
+
+    import assets
+    import downloads
+    import rum
+    import snapshots
+
+    parser = argparse.ArgumentParser(description="Portal token service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = TokenService(args.host, args.port, unix_path=args.unix)
+    assets.serve_on(service.http)  # workers publish static/ URLs pointing here
+    snapshots.serve_on(service.http)
+    downloads.serve_on(service.http)
+    rum.serve_on(service.http)
+    service.start()
+    print(f"Token server on {service.url}/new_jwt (Ctrl+C to stop)", flush=True)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    service.stop()
+    if args.unix and os.path.exists(args.unix):
+        os.unlink(args.unix)
+    if args.unix:
+        shutil.rmtree(metrics.workers_dir(args.unix), ignore_errors=True)
@@ -0,0 +1,63 @@
+# vendor_tableau.py — pin a copy of the Tableau Embedding API v3 library
+#
+#   python vendor_tableau.py                   # fetch "latest" from the configured host
+#   python vendor_tableau.py --version 3.12.0  # fetch a specific release
+#
+# Writes static/vendor/tableau.embedding.<version>.<hash>.min.js and
+# static/vendor/tableau_embedding.json (version + SRI hash). Commit both;
+# assets.tableau_script_tag() then serves the pinned copy with integrity
+# checking and immutable caching instead of the uncacheable "latest" URL.
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import requests
+
+import assets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pin a copy of the Tableau Embedding API v3 library")
+    parser.add_argument("--host", default=None, help="Tableau host (default: secrets.json host)")
+    parser.add_argument("--version", default="latest", help='release, e.g. "3.12.0" (default: latest)')
+    args = parser.parse_args()
+
+    host = (args.host or assets.tableau_host()).rstrip("/")
+    release = "3.latest" if args.version == "latest" else args.version
+    url = f"{host}/javascripts/api/tableau.embedding.{release}.min.js"
+
+    print(f"Fetching {url} ...")
+    resp = requests.get(url, timeout=30)
+    resp.raise_for_status()
+    data = resp.content
+
+    version = args.version
+    if version == "latest":
+        # the bundle carries its own version string; fall back to the hash
+        m = re.search(rb'["\'](3\.\d+\.\d+)["\']', data)
+        version = m.group(1).decode() if m else "latest"
+
+    name = f"tableau.embedding.{version}.{assets.content_hash(data)}.min.js"
+    os.makedirs(assets.VENDOR_DIR, exist_ok=True)
+    with open(os.path.join(assets.VENDOR_DIR, name), "wb") as f:
+        f.write(data)
+
+    lock = {
+        "version": version,
+        "file": name,
+        "integrity": assets.sri_hash(data),
+        "source_url": url,
+        "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(assets.TABLEAU_LOCK, "w", encoding="utf-8") as f:
+        json.dump(lock, f, indent=2)
+
+    print(f"✅ Pinned {name} ({len(data):,} bytes)")
+    print(f"   integrity {lock['integrity']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,14 @@
-from flask import Flask, request, render_template_string
+from urllib.parse import urlencode
+
+from flask import Flask, request
 from flask_cors import CORS
 
+import assets
+import profiler
+import rum
+import token_server
+from config_store import get_config
+
 app = Flask(__name__)
 CORS(app)
 
@@ -8,13 +16,17 @@ TEMPLATE = """
 <!DOCTYPE html>
 <html>
 <head>
-    <script type="module" src="{{ module_url }}"></script>
+    {{ module_tag | safe }}
+    <script src="{{ rum_script }}"></script>
 </head>
 <body style="margin:0; padding:0; overflow:hidden;">
 
 <div id="viz_container" style="width:100vw; height:100vh;"></div>
 
 <script type="module">
+const dashboard = {{ dashboard | tojson }};
+PortalRUM.configure({{ rum_url | tojson }});
+
 async function loadViz() {
 
     console.log("Loading Tableau viz...");
@@ -28,12 +40,25 @@ async function loadViz() {
     viz.style.width = "100%";
     viz.style.height = "100vh";
 
-    // Auto-refresh JWT token
-    viz.token = async () => {
-        const r = await fetch("http://127.0.0.1:5001/new_jwt", { cache: "no-store" });
+    // Auto-refresh JWT token (latency reported to the RUM collector)
+    let tokenUrl = {{ token_url | tojson }};
+    viz.token = PortalRUM.timedToken(dashboard, async () => {
+        const r = await fetch(tokenUrl, { cache: "no-store" });
         const j = await r.json();
+        if (j.error) throw new Error(j.error);
+        if (j.grant) {
+            const next = new URL(tokenUrl);
+            next.searchParams.set("t", j.grant);  // renewed grant for the next token
+            tokenUrl = next.href;
+        }
         return j.token;
-    };
+    });
+
+    const started = performance.now();
+    viz.addEventListener("firstinteractive", () =>
+        PortalRUM.timing(dashboard, "interactive", performance.now() - started));
+    viz.addEventListener("vizloaderror", () =>
+        PortalRUM.failure(dashboard, "interactive", "load error"));
 
     container.appendChild(viz);
 }
@@ -45,11 +70,32 @@ loadViz();
 </html>
 """
 
+# compiled once (render_template_string recompiles it on every request)
+_template = app.jinja_env.from_string(TEMPLATE)
+
 @app.get("/view")
 def view():
+    # only portal links work: they carry the session's /new_jwt grant (?t=)
+    try:
+        token_server.check_grant(request.args.get("t", ""))
+    except ValueError as exc:
+        return str(exc), 403
+    # admin link from the portal sidebar: this one render under the profiler
+    if profiler.allowed(request.args.get("profile")):
+        with profiler.profile("view"):
+            return render_view()
+    return render_view()
+
+
+def render_view():
     view_url = request.args.get("url")
-    module_url = "https://prod-in-a.online.tableau.com/javascripts/api/tableau.embedding.3.latest.min.js"
-    return render_template_string(TEMPLATE, view_url=view_url, module_url=module_url)
+    module_tag = assets.tableau_script_tag()
+    token_url = token_server.public_url() + "/new_jwt?" + urlencode({"t": request.args["t"]})
+    # RUM is keyed by dashboards.json name; other URLs are not reported
+    dashboard = next((n for n, u in get_config().urls.items() if u == view_url), None)
+    return _template.render(view_url=view_url, module_tag=module_tag,
+                            token_url=token_url, dashboard=dashboard,
+                            rum_url=rum.collector_url(), rum_script=assets.script_url("rum"))
 
 if __name__ == "__main__":
     app.run(port=8502)
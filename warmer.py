@@ -0,0 +1,293 @@
+# ================================
+# warmer.py
+# ================================
+#
+# Pre-loads the most used views so the first person of the day does not
+# wait for Tableau to compute them from a cold cache:
+#
+#   python warmer.py                          # one pass now
+#   python warmer.py --at 07:00               # daily, before business hours
+#   python warmer.py --watch-refreshes 300    # also after extract refreshes
+#   python warmer.py history --days 30        # warm-up latency per view
+#
+# A pass renders each view once through the REST image endpoint (a fresh
+# render, maxAge 1 min), which fills the server's query and tile caches.
+# Views go hottest first: portal opens over the last WINDOW_DAYS (which
+# streamlit_app counts in memory and flushes here every FLUSH_INTERVAL
+# from a background thread), then catalog total_views, then
+# dashboards.json order. At most CONCURRENCY renders are in flight, so
+# the warm-up never competes with real users for the whole site.
+# Every render's latency is kept, so a workbook that keeps getting slower
+# shows up in `history`.
+
+import argparse
+import atexit
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config_store import get_config
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WARMER_DB = os.environ.get("PORTAL_WARMER_DB", os.path.join(BASE_DIR, "warmer.db"))
+CONCURRENCY = int(os.environ.get("PORTAL_WARM_CONCURRENCY", "2"))
+WINDOW_DAYS = int(os.environ.get("PORTAL_WARM_WINDOW_DAYS", "14"))
+FLUSH_INTERVAL = 30.0
+
+# `history` flags a view whose latest warm-up is this much slower than
+# its median over the period.
+SLOWER = 1.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS opens (
+    name TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, day)
+);
+CREATE TABLE IF NOT EXISTS warmups (
+    at REAL NOT NULL,
+    name TEXT NOT NULL,
+    view_id TEXT,
+    ms INTEGER,
+    ok INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS warmups_name ON warmups (name, at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_local = threading.local()
+
+
+def connect(path: str = WARMER_DB) -> sqlite3.Connection:
+    """Thread-local connection (created, with the schema, on first use)."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conns[path] = conn
+    return conn
+
+
+# -----------------------------------
+# Open counts (written by the portal)
+# -----------------------------------
+# (path, name, UTC day) -> opens not yet written
+_opens: Dict[tuple, int] = {}
+_opens_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+
+
+def record_open(name: str, path: str = WARMER_DB) -> None:
+    """Count one portal open of dashboard `name` (in memory; never blocks on SQLite)."""
+    global _flusher
+    key = (path, name, time.strftime("%Y-%m-%d", time.gmtime()))
+    with _opens_lock:
+        _opens[key] = _opens.get(key, 0) + 1
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="warmer-opens", daemon=True)
+            _flusher.start()
+            atexit.register(flush_opens)
+
+
+def flush_opens() -> None:
+    """Write the counted opens in one transaction per database."""
+    with _opens_lock:
+        pending = _opens.copy()
+        _opens.clear()
+    by_path: Dict[str, List] = {}
+    for (path, name, day), count in pending.items():
+        by_path.setdefault(path, []).append((name, day, count))
+    for path, rows in by_path.items():
+        try:
+            conn = connect(path)
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO opens VALUES (?, ?, ?)"
+                    " ON CONFLICT (name, day) DO UPDATE SET count = count + excluded.count",
+                    rows)
+        except sqlite3.Error as exc:
+            log.warning("could not record %d open count(s): %s", len(rows), exc)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush_opens()
+
+
+def open_counts(days: int = WINDOW_DAYS, path: str = WARMER_DB) -> Dict[str, int]:
+    flush_opens()
+    rows = connect(path).execute(
+        "SELECT name, SUM(count) FROM opens WHERE day >= date('now', ?) GROUP BY name",
+        (f"-{days} days",)).fetchall()
+    return dict(rows)
+
+
+def hot_views(limit: Optional[int] = None, path: str = WARMER_DB) -> List[Dict]:
+    """[{"name", "url", "view_id", "opens"}] hottest first."""
+    cfg = get_config()
+    opens = open_counts(path=path)
+    catalog_views = {}
+    if cfg.catalog is not None:
+        catalog_views = {v["id"]: v.get("total_views") or 0 for v in cfg.catalog.views}
+    order = {name: i for i, name in enumerate(cfg.names)}
+    views = [{"name": n, "url": cfg.urls[n], "view_id": cfg.view_ids.get(n),
+              "opens": opens.get(n, 0)} for n in cfg.names]
+    views.sort(key=lambda v: (-v["opens"], -catalog_views.get(v["view_id"], 0), order[v["name"]]))
+    return views[:limit] if limit else views
+
+
+# -----------------------------------
+# Warm-up
+# -----------------------------------
+def warm_one(client, view: Dict, path: str = WARMER_DB) -> Dict:
+    started = time.perf_counter()
+    result = {"name": view["name"], "view_id": view["view_id"], "ok": True, "error": None}
+    try:
+        view_id = result["view_id"] = view["view_id"] or client.view_id_for(view["url"])
+        client.view_image(view_id, resolution="high", max_age_minutes=1)
+    except Exception as exc:
+        result.update(ok=False, error=str(exc))
+        log.warning("warm-up of %s failed: %s", view["name"], exc)
+    result["ms"] = round((time.perf_counter() - started) * 1000)
+    connect(path).execute("INSERT INTO warmups VALUES (?, ?, ?, ?, ?, ?)",
+                          (time.time(), result["name"], result["view_id"], result["ms"],
+                           int(result["ok"]), result["error"]))
+    return result
+
+
+def warm(client=None, concurrency: int = CONCURRENCY, limit: Optional[int] = None,
+         path: str = WARMER_DB) -> Dict:
+    """One pass over the hot views, at most `concurrency` at a time."""
+    if client is None:
+        from tableau_client import get_client
+        client = get_client()
+    views = hot_views(limit, path)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="warm") as pool:
+        results = list(pool.map(lambda v: warm_one(client, v, path), views))
+    for r in results:
+        print(f"  {r['name']}: {'ok' if r['ok'] else 'FAILED'} in {r['ms']:,} ms", flush=True)
+    ok = [r["ms"] for r in results if r["ok"]]
+    summary = {"views": len(results), "failed": len(results) - len(ok),
+               "seconds": round(time.perf_counter() - started, 1),
+               "p50_ms": round(statistics.median(ok)) if ok else None}
+    log.info("warm-up pass: %s", summary)
+    return summary
+
+
+# -----------------------------------
+# Extract refreshes
+# -----------------------------------
+def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def refreshes_since_last_check(client, path: str = WARMER_DB) -> int:
+    """Extract refresh jobs that succeeded since the previous check."""
+    conn = connect(path)
+    watermark = _meta(conn, "refresh_watermark")
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    if watermark is None:
+        count = 0  # first check: only refreshes from now on count
+    else:
+        flt = f"jobType:eq:refresh_extracts,status:eq:Success,completedAt:gt:{watermark}"
+        count = sum(1 for _ in client.paginate("jobs", "backgroundJobs", "backgroundJob",
+                                               filter=flt))
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('refresh_watermark', ?)", (now,))
+    return count
+
+
+# -----------------------------------
+# History
+# -----------------------------------
+def history(days: int = 30, path: str = WARMER_DB) -> List[Dict]:
+    """Per view: runs, failures, median / latest ms and whether it got slower."""
+    rows = connect(path).execute(
+        "SELECT name, ms, ok FROM warmups WHERE at >= ? ORDER BY at",
+        (time.time() - days * 86400,)).fetchall()
+    by_name: Dict[str, List] = {}
+    for name, ms, ok in rows:
+        by_name.setdefault(name, []).append((ms, ok))
+    report = []
+    for name, runs in by_name.items():
+        ok = [ms for ms, good in runs if good]
+        median = statistics.median(ok) if ok else None
+        latest = ok[-1] if ok else None
+        report.append({"name": name, "runs": len(runs), "failed": len(runs) - len(ok),
+                       "median_ms": round(median) if median else None, "latest_ms": latest,
+                       "slower": bool(median and len(ok) >= 3 and latest > SLOWER * median)})
+    return sorted(report, key=lambda r: -(r["median_ms"] or 0))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tableau cache warmer")
+    parser.add_argument("command", nargs="?", default="warm", choices=("warm", "history"))
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--top", type=int, metavar="N", help="only the N hottest views")
+    parser.add_argument("--at", metavar="HH:MM", help="warm daily at this local time")
+    parser.add_argument("--every", type=float, metavar="SECONDS", help="warm every SECONDS")
+    parser.add_argument("--watch-refreshes", type=float, metavar="SECONDS",
+                        help="poll for finished extract refreshes every SECONDS and warm after them")
+    parser.add_argument("--days", type=int, default=30, help="history period")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "history":
+        print(f"{'view':<32} {'runs':>5} {'failed':>6} {'median ms':>10} {'latest ms':>10}")
+        for r in history(args.days):
+            print(f"{r['name'][:32]:<32} {r['runs']:>5} {r['failed']:>6} "
+                  f"{r['median_ms'] or '-':>10} {r['latest_ms'] or '-':>10}"
+                  f"{'  <- slower' if r['slower'] else ''}")
+        return 0
+
+    from exporter import next_run
+    from tableau_client import get_client
+
+    client = get_client()
+    every = args.every or (86400 if args.at else None)
+    if not every and not args.watch_refreshes:
+        summary = warm(client, args.concurrency, args.top)
+        return 1 if summary["failed"] else 0
+
+    scheduled = next_run(args.at, every, None) if every else float("inf")
+    polled = time.time()
+    if args.watch_refreshes:
+        refreshes_since_last_check(client)  # set the watermark
+    while True:
+        time.sleep(max(0.0, min(scheduled, polled + (args.watch_refreshes or float("inf")))
+                       - time.time()))
+        reason = None
+        try:
+            if time.time() >= scheduled:
+                reason = "schedule"
+                scheduled = next_run(args.at, every, scheduled)
+            if args.watch_refreshes and time.time() >= polled + args.watch_refreshes:
+                polled = time.time()
+                refreshes = refreshes_since_last_check(client)
+                if refreshes:
+                    reason = reason or f"{refreshes} extract refresh(es)"
+            if reason:
+                log.info("warming (%s)", reason)
+                warm(client, args.concurrency, args.top)
+        except Exception:
+            log.exception("warm-up failed")
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())